@@ -0,0 +1,291 @@
+"""
+Backfill of a long incorporation date range (e.g. several months) split across worker processes.
+Range is cut into shards of a few days, every worker runs its own LeadManager and event loop on the shards it gets,
+so pandas stages run in parallel and more requests are in flight. All workers take tokens from shared memory token
+buckets (one per API key), so together they stay within the Companies House rate limit.
+Coordinator merges shard leads, dedupes them on company_number and appends them to the lead store. Leads with
+incomplete officer data and failed requests go to the main cache and retry queue, next tracker run picks them up.
+Run from the repo root: python backfill.py --days-back 180 --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import shutil
+import tempfile
+from datetime import date, timedelta
+from logging import handlers
+from os.path import join
+from toolBox.rateLimiter import SharedTokenBucketLimiter
+from toolBox.sheetIndex import SheetIndex
+from toolBox.tracing import span, tracer
+from toolBox.utils import utilMaster
+from toolBox import IS_WINDOWS
+from tracker import closeLogging, createLeadStore, createManager, exportMetrics, setupLogging
+# Config constants (and pandas) are imported by the functions using them, so --help and spawned workers importing
+# this module do not read config on import
+
+# Set once per worker process by initShardWorker()
+_workerContext = {}
+
+
+def splitDateRange(dateFrom: date, dateTo: date, shardDays: int) -> list:
+    """
+    Splits [@dateFrom, @dateTo] into consecutive (first, last) ranges of at most @shardDays days
+    """
+    shards = []
+    first = dateFrom
+    while first <= dateTo:
+        last = min(first + timedelta(days = shardDays - 1), dateTo)
+        shards.append((first, last))
+        first = last + timedelta(days = 1)
+    return shards
+
+
+def initShardWorker(limiterStates: list, logQueue: multiprocessing.Queue, workDir: str, excludeIds: list) -> None:
+    """
+    Runs once in every worker process: log records go to the coordinator, shared buckets and ids to skip are kept
+    """
+    rootLogger = logging.getLogger()
+    rootLogger.handlers = [handlers.QueueHandler(logQueue)]
+    rootLogger.setLevel(logging.INFO)
+    _workerContext.update(limiterStates = limiterStates, workDir = workDir, excludeIds = excludeIds)
+    if IS_WINDOWS:
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy()) #windows-specific thing!
+
+
+def runShard(task: dict) -> dict:
+    """
+    Searches one date range of the backfill and fetches officers of companies found, runs in a worker process.
+    Returns leads of the shard, parsed search rows (to cache held back leads), held back companies, failed requests
+    and request metrics. A failed shard returns its error instead of raising it, so other shards are kept
+    """
+    from toolBox import REQUEST_TYPES
+    logger = logging.getLogger(f"backfillShard{task['shard']}")
+    # Shard rows carry run id of the backfill, metrics are merged by the coordinator
+    shardMeta = utilMaster.generateRunMetaData(REQUEST_TYPES)
+    shardMeta.update(run_id = task["run_id"], run_start_ts = task["run_start_ts"])
+    try:
+        return collectShard(task, shardMeta, logger)
+    except Exception as e:
+        logger.error(f"Shard {task['shard']} ({task['date_from']} - {task['date_to']}) failed: {e!r}")
+        return {"shard": task["shard"], "task": task, "error": repr(e), "metrics": shardMeta["metrics"]}
+
+
+def collectShard(task: dict, shardMeta: dict, logger: logging.Logger) -> dict:
+    """
+    Runs search and officer lookups of one shard on its own LeadManager and event loop
+    """
+    import pandas as pd
+    from toolBox.leadManager import LeadManager
+    from toolBox import (
+        REST_KEYS,
+        REST_URL,
+        SEARCH_URL,
+        SEARCH_PAGE_SIZE,
+        OFFICERS_PAGE_SIZE,
+        RATE,
+        LIMIT,
+        CONNECTION_CONFIG,
+        SCHEDULER_CONFIG,
+        CACHE,
+        REQUEST_TYPES
+    )
+    # Each shard caches to its own throwaway db, http cache is skipped so that processes do not contend for it
+    manager = LeadManager(
+        rate = RATE,
+        limit = LIMIT,
+        logger = logger,
+        sleepTimeBuffer = 2,
+        cache = join(_workerContext["workDir"], f"shard_{task['shard']}.db"),
+        cacheTable = CACHE["companies_table"],
+        retryTable = CACHE["retries_table"],
+        allowedRequestTypes = REQUEST_TYPES,
+        connectionConfig = CONNECTION_CONFIG,
+        limiterMode = "shared_token_bucket",
+        schedulerConfig = SCHEDULER_CONFIG,
+        apiKeys = REST_KEYS,
+        limiterStates = _workerContext["limiterStates"]
+    )
+    excludeIds = _workerContext["excludeIds"]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        logger.info(f"Shard {task['shard']} searches companies incorporated between {task['date_from']} and {task['date_to']}")
+        manager.prepareSearchStorage(task["cols_to_save"])
+        loop.run_until_complete(
+            manager.streamLeads(
+                searchUrl = SEARCH_URL,
+                baseUrl = REST_URL,
+                auth = None,
+                baseParams = task["params"],
+                dateFrom = task["date_from"],
+                dateTo = task["date_to"],
+                metaData = shardMeta,
+                excludeIds = excludeIds,
+                cachedCompanyNumbers = [],
+                searchPageSize = SEARCH_PAGE_SIZE,
+                officersPageSize = OFFICERS_PAGE_SIZE
+            )
+        )
+        manager.cacheSearch(runMetaData = shardMeta)
+        searchResults, e = manager.tidySearchResults(cacheDf = pd.DataFrame(), sheetCompanyNumbers = pd.Series(excludeIds, dtype = object))
+        if e is not None:
+            raise e
+        leads = pd.merge(searchResults, manager.tidyOfficerResults(), on = "company_number", how = "left")
+        return {
+            "shard": task["shard"],
+            "leads": leads,
+            "search": manager.processedSearch,
+            "incomplete": manager.getIncompleteCompanies(),
+            "retries": manager.toRetryList,
+            "metrics": shardMeta["metrics"]
+        }
+    finally:
+        loop.run_until_complete(manager.close())
+        loop.close()
+        manager.cacheConn.close()
+
+
+def shardRetry(task: dict) -> dict:
+    """
+    Retry queue entry replaying search of a failed shard's window, next regular run searches it (bisecting as needed)
+    and looks up officers of companies found
+    """
+    from toolBox import SEARCH_URL
+    params = dict(task["params"])
+    params.update(incorporated_from = str(task["date_from"]), incorporated_to = str(task["date_to"]), start_index = 0)
+    return {"url": SEARCH_URL, "requestType": "search", "companyNumber": None, "params": params, "status": None}
+
+
+def mergeShards(results: list, leadColumns: list) -> tuple:
+    """
+    Concatenates shard outputs, returns leads deduped on company_number, search rows, held back companies and retries.
+    Shards do not overlap, dedupe guards against companies listed on both sides of a shard boundary
+    """
+    import pandas as pd
+    if not results:
+        return pd.DataFrame(columns = leadColumns), pd.DataFrame(columns = ["company_number"]), set(), []
+    leads = pd.concat([result["leads"] for result in results], ignore_index = True)
+    leads.drop_duplicates(subset = "company_number", keep = "first", inplace = True)
+    search = pd.concat([result["search"] for result in results], ignore_index = True)
+    search.drop_duplicates(subset = "company_number", keep = "first", inplace = True)
+    incomplete = set().union(*(result["incomplete"] for result in results))
+    retries = [entry for result in results for entry in result["retries"]]
+    return leads.reset_index(drop = True), search.reset_index(drop = True), incomplete, retries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Backfills leads of a long date range with several worker processes")
+    parser.add_argument("--days-back", type = int, default = None, help = "days of incorporation dates to cover, control panel value by default")
+    parser.add_argument("--workers", type = int, default = None, help = "worker processes (backfill.workers of config)")
+    parser.add_argument("--shard-days", type = int, default = None, help = "days searched by one shard (backfill.shard_days of config)")
+    args = parser.parse_args()
+    import pandas as pd
+    from toolBox import BACKFILL_CONFIG, CACHE, GSHEET_ID, LEAD_SHEET_SCHEMA, LIMIT, REQUEST_TYPES, REST_KEYS
+    workers = args.workers if args.workers is not None else BACKFILL_CONFIG["workers"]
+    shardDays = args.shard_days if args.shard_days is not None else BACKFILL_CONFIG["shard_days"]
+    utils = utilMaster()
+    runMeta = utils.generateRunMetaData(REQUEST_TYPES)
+    logHandlers = setupLogging(utils, runMeta["run_id"])
+    utils.logger.info(f"Backfill {runMeta['run_id']} starts...")
+    manager = createManager(utils)
+    sheetReader = createLeadStore(utils)
+    leadIndex = SheetIndex(db = CACHE["db"], table = CACHE["sheet_index_table"], logger = utils.logger)
+    # Spawned workers do not inherit threads or open connections of the coordinator
+    context = multiprocessing.get_context("spawn")
+    logQueue = context.Queue()
+    # Records of workers are handled by the coordinator's handlers (console, log db, discord)
+    workerLogListener = handlers.QueueListener(logQueue, *logging.getLogger().handlers, respect_handler_level = True)
+    workerLogListener.start()
+    workDir = tempfile.mkdtemp(prefix = "backfill_")
+    try:
+        with span("read_inputs"):
+            searchParams, e = sheetReader.prepareSeachInputs(sheetId = GSHEET_ID, workSheetsToRead = [sheetReader.controlPanelSheetName])
+            if e is not None:
+                utils.logger.error(f"Got and error when preparing search inputs: {e}")
+                return
+            colsToSave, e = sheetReader.getColsToKeep()
+            if e is not None:
+                utils.logger.error(f"Error getting columns to save: {e}")
+                return
+            e = sheetReader.syncLeadIndex(leadIndex)
+            if e is not None:
+                utils.logger.error(f"Got an error when syncing lead index: {e}")
+                return
+            sheetLeadIds = leadIndex.companyNumbers()
+        searchWindow = utils.createSearchWindow(args.days_back if args.days_back is not None else searchParams["days_back"])
+        if searchWindow is None:
+            return
+        shards = splitDateRange(*searchWindow, shardDays = shardDays)
+        tasks = [
+            {
+                "shard": i,
+                "date_from": dateFrom,
+                "date_to": dateTo,
+                "params": searchParams["params"],
+                "cols_to_save": colsToSave,
+                "run_id": runMeta["run_id"],
+                "run_start_ts": runMeta["run_start_ts"]
+            }
+            for i, (dateFrom, dateTo) in enumerate(shards)
+        ]
+        utils.logger.info(
+            f"Backfilling companies incorporated between {searchWindow[0]} and {searchWindow[1]}: "
+            f"{len(tasks)} shards on {workers} workers"
+        )
+        # One shared bucket per API key, every worker takes tokens of a key from the same one
+        limiterStates = [SharedTokenBucketLimiter.createState(LIMIT, context = context) for _ in range(max(len(REST_KEYS), 1))]
+        results, failed = [], []
+        with span("collect_shards"):
+            with context.Pool(
+                processes = workers,
+                initializer = initShardWorker,
+                initargs = (limiterStates, logQueue, workDir, list(sheetLeadIds))) as pool:
+                for result in pool.imap_unordered(runShard, tasks):
+                    runMeta["metrics"].merge(result["metrics"])
+                    if "error" in result:
+                        failed.append(result)
+                        continue
+                    results.append(result)
+                    utils.logger.info(f"Shard {result['shard']} done with {len(result['leads'])} leads, {len(results) + len(failed)}/{len(tasks)} shards done")
+        if failed:
+            windows = ", ".join(f"{result['task']['date_from']} - {result['task']['date_to']}" for result in failed)
+            utils.logger.error(f"{len(failed)} shards failed, their windows go to the retry queue: {windows}")
+        with span("tidy_and_merge"):
+            leads, search, incompleteCompanies, retries = mergeShards(results, list(LEAD_SHEET_SCHEMA.values()))
+            retries += [shardRetry(result["task"]) for result in failed]
+            if incompleteCompanies:
+                utils.logger.warning(f"Holding back {len(incompleteCompanies)} leads with incomplete officer data")
+                leads = leads[~leads["company_number"].isin(incompleteCompanies)]
+            leads = leads[LEAD_SHEET_SCHEMA.values()]
+        with span("append_leads"):
+            appended, e = sheetReader.appendToSheet(sheetLeads = pd.Series(sheetLeadIds, dtype = object), df = leads, leadIndex = leadIndex)
+        notAppended = set(leads["company_number"]) - set(appended)
+        if e is not None:
+            utils.logger.error(f"Append stopped after {len(appended)} leads, {len(notAppended)} stay in cache: {e}")
+        # Held back leads and failed requests are left to regular runs, same as tracker does with its own
+        with span("cache_results"):
+            heldBack = incompleteCompanies | notAppended
+            if heldBack:
+                manager.cacheCompanies(search[search["company_number"].isin(heldBack)])
+            manager.toRetryList = retries
+            e = manager.cacheRetries("backfill")
+            if e is not None:
+                utils.logger.warning(f"Erros with caching retries: {e}")
+        runtimeStats = utils.getRunTimeStats(runMeta)
+        runtimeStats["new_leads"] = len(appended)
+        utils.logger.info(f"Backfill summary: {runtimeStats}")
+        exportMetrics(utils, runMeta["metrics"])
+    finally:
+        leadIndex.close()
+        sheetReader.close()
+        asyncio.run(manager.close())
+        shutil.rmtree(workDir, ignore_errors = True)
+        utils.logger.info(f"Backfill spans:\n{tracer.formatSummary()}")
+        workerLogListener.stop()
+        closeLogging(*logHandlers)
+
+
+if __name__ == "__main__":
+    main()
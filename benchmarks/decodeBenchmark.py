@@ -0,0 +1,86 @@
+"""
+Compares response decoding: stdlib json to generic dicts (what resp.json() did) vs toolBox.decoding fast path.
+Payloads mimic real API responses: a full 5000 item search page and a 100 item officers page.
+Run from the repo root: python -m benchmarks.decodeBenchmark
+"""
+import json
+from time import perf_counter
+from toolBox import decoding
+
+REPEATS = {"search": 10, "officers": 300}
+
+
+def searchPayload(itemCnt: int = 5000) -> bytes:
+    items = []
+    for i in range(itemCnt):
+        items.append({
+            "company_name": f"RESTAURANT NUMBER {i} LTD",
+            "company_number": f"{i:08d}",
+            "company_status": "active",
+            "company_type": "ltd",
+            "kind": "search-results#company",
+            "links": {"company_profile": f"/company/{i:08d}"},
+            "date_of_creation": "2022-11-25",
+            "registered_office_address": {
+                "address_line_1": f"{i} High Street",
+                "address_line_2": "Second Floor",
+                "locality": "London",
+                "postal_code": "EC1A 1BB",
+                "country": "United Kingdom"
+            },
+            "sic_codes": ["56101", "56102"]
+        })
+    return json.dumps({"hits": itemCnt, "items": items, "kind": "search-results#advanced-search", "top_hit": items[0]}).encode()
+
+
+def officersPayload(itemCnt: int = 100) -> bytes:
+    items = []
+    for i in range(itemCnt):
+        items.append({
+            "name": f"SURNAME {i}, Firstname Middlename",
+            "officer_role": "director",
+            "appointed_on": "2022-11-25",
+            "nationality": "British",
+            "occupation": "Director",
+            "country_of_residence": "England",
+            "date_of_birth": {"month": 1, "year": 1980},
+            "address": {
+                "address_line_1": f"{i} High Street",
+                "locality": "London",
+                "postal_code": "EC1A 1BB",
+                "premises": "1"
+            },
+            "links": {"officer": {"appointments": f"/officers/{i}/appointments"}}
+        })
+    return json.dumps({
+        "total_results": itemCnt,
+        "items_per_page": itemCnt,
+        "start_index": 0,
+        "active_count": itemCnt,
+        "resigned_count": 0,
+        "kind": "officer-list",
+        "items": items,
+        "links": {"self": "/company/00000000/officers"}
+    }).encode()
+
+
+def timeIt(func, raw: bytes, repeats: int) -> float:
+    start = perf_counter()
+    for _ in range(repeats):
+        func(raw)
+    return (perf_counter() - start) / repeats
+
+
+def main() -> None:
+    payloads = {"search": searchPayload(), "officers": officersPayload()}
+    print(f"fast path backend: {decoding.JSON_BACKEND}")
+    print(f"{'payload':>9} {'size, KB':>9} {'json dicts, ms':>15} {'fast, ms':>10} {'speedup':>8}")
+    for requestType, raw in payloads.items():
+        repeats = REPEATS[requestType]
+        baseline = timeIt(json.loads, raw, repeats)
+        typed = timeIt(lambda body: decoding.decodeResponse(body, requestType), raw, repeats)
+        print(f"{requestType:>9} {len(raw) / 1024:>9.0f} {baseline * 1e3:>15.2f} {typed * 1e3:>10.2f} {baseline / typed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Cold start regression check: imports entry points in fresh interpreters with python -X importtime and fails
+when one of them takes longer than its budget or pulls in a heavy dependency it should import lazily.
+Budgets are cumulative import times in ms (best of --repeat runs), they leave headroom for slower machines.
+Imports and --help of the entry points run without CONFIG_PATH and secrets: neither may need config.
+Run from the repo root: python -m benchmarks.importTime (exit code 1 on regression)
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+HEAVY = ("pandas", "numpy", "janitor", "pygsheets", "googleapiclient", "dataset", "sqlalchemy", "aiohttp", "requests")
+# Importing toolBox or an entry point must not read .env, secrets or config either
+CONFIG = ("yaml", "dotenv")
+# Variables config and secrets are read from, removed from the environment of the checks
+CONFIG_VARS = ("CONFIG_PATH", "REST_KEY", "REST_KEYS", "GSHEET_SECRET")
+TARGETS = (
+    # (module, budget in ms, top level modules it must not import)
+    ("toolBox", 25, HEAVY + CONFIG),
+    ("toolBox.utils", 50, HEAVY + CONFIG),
+    ("toolBox.metrics", 25, HEAVY + CONFIG),
+    ("toolBox.tracing", 50, HEAVY + CONFIG),
+    ("tracker", 250, HEAVY + CONFIG),
+    ("daemon", 250, HEAVY + CONFIG),
+    # Imported again by every spawned backfill worker
+    ("backfill", 250, HEAVY + CONFIG)
+)
+# Entry points whose --help has to work without config
+HELP_TARGETS = ("tracker.py", "daemon.py", "backfill.py")
+
+
+def cleanEnv() -> dict:
+    """
+    Environment of the checks, without config path and secrets
+    """
+    return {name: value for name, value in os.environ.items() if name not in CONFIG_VARS}
+
+
+def measure(module: str) -> tuple:
+    """
+    Imports @module in a fresh interpreter, returns its cumulative import time (ms) and top level modules it imported
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output = True,
+        text = True,
+        env = cleanEnv()
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    lines = [line for line in result.stderr.splitlines() if line.startswith("import time:")]
+    # Modules imported by the interpreter itself (site, .pth files) come before the target and are not counted
+    imported, cumulative = set(), None
+    started = False
+    for line in lines:
+        _, cumulativeUs, name = (part.strip() for part in line.split(":", 1)[1].split("|"))
+        if not started:
+            started = name == "site"
+            continue
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative = int(cumulativeUs) / 1e3
+    return cumulative, imported
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Checks cold start import time of entry points")
+    parser.add_argument("--repeat", type = int, default = 3, help = "runs per module, best one is reported")
+    args = parser.parse_args()
+    failures = []
+    print(f"{'module':<20} {'best, ms':>10} {'budget, ms':>12}  heavy imports")
+    for module, budget, forbidden in TARGETS:
+        runs = [measure(module) for _ in range(args.repeat)]
+        best = min(run[0] for run in runs)
+        leaked = sorted(set(forbidden) & runs[0][1])
+        print(f"{module:<20} {best:>10.1f} {budget:>12}  {', '.join(leaked) or '-'}")
+        if best > budget:
+            failures.append(f"{module} imports in {best:.1f} ms, budget is {budget} ms")
+        if leaked:
+            failures.append(f"{module} imports {', '.join(leaked)} at import time")
+    for script in HELP_TARGETS:
+        result = subprocess.run([sys.executable, script, "--help"], capture_output = True, text = True, env = cleanEnv())
+        print(f"{script + ' --help':<20} {'ok' if result.returncode == 0 else 'failed':>10}")
+        if result.returncode != 0:
+            failures.append(f"{script} --help fails without config:\n{result.stderr[-2000:]}")
+    if failures:
+        print("\n".join(["", "Import time regressions:"] + failures))
+        sys.exit(1)
+    print("\nAll entry points are within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Local stand-in for the Companies House advanced search and officers endpoints, used by benchmarks.
+Companies are generated deterministically from incorporation dates, so repeated runs see the same data.
+Responses carry X-Ratelimit-* headers of a fixed window budget per API key (basic auth user), requests above it get 429,
+extra 429s can be injected at random to exercise the retry path.
+Run standalone from the repo root: python -m benchmarks.mockCompaniesHouse --port 8080
+"""
+import argparse
+import asyncio
+import random
+from aiohttp import web
+from datetime import date, timedelta
+from math import ceil
+from time import time
+
+DEFAULTS = dict(
+    latency = 0.02, # seconds every response is delayed by
+    jitter = 0.01, # up to this many seconds are added at random
+    companies_per_day = 40, # companies incorporated on every date
+    max_officers = 6, # companies get between 1 and this many officers
+    max_search_size = 5000, # largest search page served, same as the API
+    max_officers_page = 100, # largest officers page served, same as the API
+    limit = 600, # requests allowed per window and API key
+    window = 5, # seconds of a rate limit window
+    error_rate_429 = 0.0 # share of requests answered with 429 regardless of the budget
+)
+
+
+class MockCompaniesHouse:
+    """
+    aiohttp application serving /advanced-search/companies and /company/{number}/officers.
+    /_stats returns served request counters
+    """
+    def __init__(self, **settings) -> None:
+        self.settings = {**DEFAULTS, **settings}
+        # API key -> [window start, requests counted in the window]
+        self.windows = {}
+        # windows counts rate limit windows opened over all keys, each of them had a budget of limit requests
+        self.stats = dict(requests = 0, search = 0, officers = 0, throttled = 0, injected_429 = 0, keys = 0, windows = 0)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/advanced-search/companies", self.search)
+        app.router.add_get("/company/{companyNumber}/officers", self.officers)
+        app.router.add_get("/_stats", self.getStats)
+        return app
+
+    def _rateLimit(self, apiKey: str) -> tuple:
+        """
+        Counts request against the current window of @apiKey, returns whether it is allowed and rate limit headers
+        """
+        now = time()
+        window = self.settings["window"]
+        limit = self.settings["limit"]
+        if apiKey not in self.windows:
+            self.windows[apiKey] = [now, 0]
+            self.stats["keys"] = len(self.windows)
+            self.stats["windows"] += 1
+        keyWindow = self.windows[apiKey]
+        if now - keyWindow[0] >= window:
+            keyWindow[0] = now
+            keyWindow[1] = 0
+            self.stats["windows"] += 1
+        keyWindow[1] += 1
+        headers = {
+            "X-Ratelimit-Limit": str(limit),
+            "X-Ratelimit-Remain": str(max(limit - keyWindow[1], 0)),
+            "X-Ratelimit-Reset": str(ceil(keyWindow[0] + window)),
+            "X-Ratelimit-Window": f"{window}s"
+        }
+        return keyWindow[1] <= limit, headers
+
+    async def _respond(self, request: web.Request, endpoint: str, payloadFunc) -> web.Response:
+        self.stats["requests"] += 1
+        self.stats[endpoint] += 1
+        await asyncio.sleep(self.settings["latency"] + random.uniform(0, self.settings["jitter"]))
+        allowed, headers = self._rateLimit(request.headers.get("Authorization", ""))
+        if not allowed:
+            self.stats["throttled"] += 1
+            return web.json_response({"error": "too many requests"}, status = 429, headers = headers)
+        if random.random() < self.settings["error_rate_429"]:
+            self.stats["injected_429"] += 1
+            headers["Retry-After"] = "1"
+            return web.json_response({"error": "too many requests"}, status = 429, headers = headers)
+        return web.json_response(payloadFunc(), headers = headers)
+
+    @staticmethod
+    def companyNumber(day: date, i: int) -> str:
+        return f"{(day.toordinal() * 1000 + i) % 10 ** 8:08d}"
+
+    def _company(self, day: date, i: int) -> dict:
+        companyNumber = self.companyNumber(day, i)
+        return {
+            "company_name": f"RESTAURANT {companyNumber} LTD",
+            "company_number": companyNumber,
+            "company_status": "active",
+            "company_type": "ltd",
+            "kind": "search-results#company",
+            "links": {"company_profile": f"/company/{companyNumber}"},
+            "date_of_creation": str(day),
+            "registered_office_address": {
+                "address_line_1": f"{i} High Street",
+                "locality": "London",
+                "postal_code": "EC1A 1BB"
+            },
+            "sic_codes": ["56101"]
+        }
+
+    async def search(self, request: web.Request) -> web.Response:
+        query = request.query
+        dateFrom = date.fromisoformat(query["incorporated_from"])
+        dateTo = date.fromisoformat(query["incorporated_to"])
+        startIndex = int(query.get("start_index", 0))
+        size = min(int(query.get("size", 20)), self.settings["max_search_size"])
+        perDay = self.settings["companies_per_day"]
+        hits = max((dateTo - dateFrom).days + 1, 0) * perDay
+
+        def payload() -> dict:
+            items = [
+                self._company(dateFrom + timedelta(days = k // perDay), k % perDay)
+                for k in range(startIndex, min(startIndex + size, hits))
+            ]
+            return {"hits": hits, "items": items, "kind": "search-results#advanced-search"}
+        return await self._respond(request, "search", payload)
+
+    async def officers(self, request: web.Request) -> web.Response:
+        companyNumber = request.match_info["companyNumber"]
+        startIndex = int(request.query.get("start_index", 0))
+        pageSize = min(int(request.query.get("items_per_page", 35)), self.settings["max_officers_page"])
+        total = int(companyNumber) % self.settings["max_officers"] + 1 if companyNumber.isdigit() else 1
+
+        def payload() -> dict:
+            items = [
+                {"name": f"SURNAME {j}, Firstname", "officer_role": "director", "appointed_on": "2022-11-25"}
+                for j in range(startIndex, min(startIndex + pageSize, total))
+            ]
+            return {
+                "total_results": total,
+                "items_per_page": pageSize,
+                "start_index": startIndex,
+                "items": items,
+                "kind": "officer-list"
+            }
+        return await self._respond(request, "officers", payload)
+
+    async def getStats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+def serve(host: str, port: int, settings: dict) -> None:
+    """
+    Runs mock server until interrupted, meant as a target of a separate process
+    """
+    web.run_app(MockCompaniesHouse(**settings).app(), host = host, port = port, print = None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Local Companies House stand-in")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8080)
+    for name, default in DEFAULTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", dest = name, type = type(default), default = default)
+    args = vars(parser.parse_args())
+    host, port = args.pop("host"), args.pop("port")
+    print(f"Serving mock Companies House on http://{host}:{port} with {args}")
+    serve(host, port, args)
+
+
+if __name__ == "__main__":
+    main()
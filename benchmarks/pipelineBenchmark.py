@@ -0,0 +1,172 @@
+"""
+End-to-end throughput of the search -> officers -> merge pipeline against benchmarks.mockCompaniesHouse.
+Mock runs in a separate process, pipeline uses LeadManager the same way tracker.py does (without the lead store).
+Officers are looked up while searching, the same way tracker.py runs.
+Reports requests/sec, share of the rate budget used, p50/p99 request latency and peak memory.
+Run from the repo root: python -m benchmarks.pipelineBenchmark --days 30 --companies-per-day 40
+"""
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import tempfile
+import aiohttp
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from multiprocessing import Process
+from os.path import join
+from time import perf_counter, sleep
+from urllib.request import urlopen
+from benchmarks.mockCompaniesHouse import DEFAULTS, serve
+from toolBox.leadManager import LeadManager
+from toolBox.utils import utilMaster
+try:
+    import resource
+except ImportError:
+    # Not available on windows, peak memory is not reported there
+    resource = None
+
+COLS_TO_SAVE = ["company_name", "company_number", "registered_office_address", "date_of_creation", "company_type", "sic_codes"]
+
+
+def freePort() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def fetchStats(baseUrl: str) -> dict:
+    with urlopen(f"{baseUrl}/_stats") as resp:
+        return json.loads(resp.read())
+
+
+def startMock(settings: dict) -> tuple:
+    """
+    Starts mock server process and waits until it answers
+    """
+    port = freePort()
+    process = Process(target = serve, args = ("127.0.0.1", port, settings), daemon = True)
+    process.start()
+    baseUrl = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            fetchStats(baseUrl)
+            return process, baseUrl
+        except OSError:
+            sleep(0.05)
+    process.terminate()
+    raise RuntimeError("Mock server did not start")
+
+
+def latencyTrace(latencies: list) -> aiohttp.TraceConfig:
+    """
+    Records time from sending a request to receiving its response headers
+    """
+    async def onStart(session, context, params) -> None:
+        context.start = perf_counter()
+
+    async def onEnd(session, context, params) -> None:
+        latencies.append(perf_counter() - context.start)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(onStart)
+    trace.on_request_end.append(onEnd)
+    return trace
+
+
+async def runPipeline(args: argparse.Namespace, baseUrl: str, workDir: str, latencies: list, metaData: dict) -> pd.DataFrame:
+    logger = logging.getLogger("pipelineBenchmark")
+    manager = LeadManager(
+        cache = join(workDir, "cache.db"),
+        cacheTable = "companies",
+        retryTable = "retry_queue",
+        rate = args.window,
+        limit = args.limit,
+        sleepTimeBuffer = 0,
+        logger = logger,
+        allowedRequestTypes = ["search", "officers"],
+        limiterMode = args.limiter_mode,
+        # Mock keeps a budget per key, like the API does per registered application
+        apiKeys = [f"benchmark{i}" for i in range(args.keys)] if args.keys > 1 else None,
+        schedulerConfig = {"workers": args.workers, "queue_size": args.workers * 5}
+    )
+    manager.traceConfigs.append(latencyTrace(latencies))
+    auth = aiohttp.BasicAuth("benchmark", "")
+    dateTo = date.today()
+    dateFrom = dateTo - timedelta(days = args.days - 1)
+    try:
+        manager.prepareSearchStorage(COLS_TO_SAVE)
+        await manager.streamLeads(
+            searchUrl = f"{baseUrl}/advanced-search/companies",
+            baseUrl = baseUrl,
+            auth = auth,
+            baseParams = {"company_status": "active"},
+            dateFrom = dateFrom,
+            dateTo = dateTo,
+            metaData = metaData,
+            excludeIds = [],
+            cachedCompanyNumbers = [],
+            searchPageSize = args.search_page_size,
+            officersPageSize = args.officers_page_size
+        )
+        manager.cacheSearch(runMetaData = metaData)
+        searchResults, e = manager.tidySearchResults(cacheDf = pd.DataFrame(), sheetCompanyNumbers = pd.Series([], dtype = object))
+        if e is not None:
+            raise e
+        return pd.merge(searchResults, manager.tidyOfficerResults(), on = "company_number", how = "left")
+    finally:
+        await manager.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "End-to-end pipeline benchmark against a local mock API")
+    parser.add_argument("--days", type = int, default = 30, help = "incorporation dates searched")
+    parser.add_argument("--workers", type = int, default = 20)
+    parser.add_argument("--limiter-mode", default = "token_bucket")
+    parser.add_argument("--keys", type = int, default = 1, help = "API keys in the pool, each gets its own budget")
+    parser.add_argument("--search-page-size", type = int, default = 5000)
+    parser.add_argument("--officers-page-size", type = int, default = 100)
+    for name, default in DEFAULTS.items():
+        if name in ("max_search_size", "max_officers_page"):
+            continue
+        parser.add_argument(f"--{name.replace('_', '-')}", dest = name, type = type(default), default = default)
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.ERROR)
+
+    settings = {name: getattr(args, name) for name in DEFAULTS if hasattr(args, name)}
+    settings["max_search_size"] = args.search_page_size
+    settings["max_officers_page"] = args.officers_page_size
+    process, baseUrl = startMock(settings)
+    latencies = []
+    try:
+        with tempfile.TemporaryDirectory() as workDir:
+            start = perf_counter()
+            metaData = utilMaster.generateRunMetaData(["search", "officers"])
+            merged = asyncio.run(runPipeline(args, baseUrl, workDir, latencies, metaData))
+            elapsed = perf_counter() - start
+        stats = fetchStats(baseUrl)
+    finally:
+        process.terminate()
+        process.join()
+
+    # Budget of the windows the mock actually opened (per key), requests it throttled did not fit into them
+    budget = args.limit * stats["windows"]
+    peakMb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource is not None else float("nan")
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1e3 if latencies else (float("nan"), float("nan"))
+    print(f"settings: {settings}, workers: {args.workers}, limiter: {args.limiter_mode}, keys: {args.keys}")
+    print(f"leads: {len(merged)}, with officers: {int((merged['company_officer_names'].fillna('') != '').sum())}")
+    print(f"elapsed, s: {elapsed:.2f}")
+    print(f"requests: {stats['requests']} (search {stats['search']}, officers {stats['officers']})")
+    print(f"429s: {stats['throttled']} over budget, {stats['injected_429']} injected")
+    print(f"requests/sec: {stats['requests'] / elapsed:.1f}")
+    print(f"rate budget used: {(stats['requests'] - stats['throttled']) / budget:.1%} of {args.limit} per {args.window}s over {stats['windows']} key windows")
+    print(f"latency p50 / p99, ms: {p50:.1f} / {p99:.1f}")
+    print(f"peak memory (max RSS), MB: {peakMb:.0f}")
+    metrics = metaData["metrics"]
+    print(f"limiter wait, s: {sum(hist.sum for hist in metrics.limiterWait.values()):.2f}, retries: {dict(metrics.retries)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares officer results assembly: per company pd.concat (previous implementation) vs LeadManager.tidyOfficerResults.
+Run from the repo root: python -m benchmarks.tidyOfficerBenchmark
+"""
+import logging
+import tempfile
+import pandas as pd
+from os.path import join
+from time import perf_counter
+from toolBox.leadManager import LeadManager
+
+SIZES = [1000, 2000, 4000, 8000, 16000]
+OFFICERS_PER_COMPANY = 3
+# Old implementation gets too slow to wait for on bigger inputs
+CONCAT_MAX_SIZE = 8000
+
+
+def fillStorage(manager: LeadManager, companyCnt: int) -> None:
+    """
+    Fills officer column buffers the same way parsed officer pages do
+    """
+    storage = {"company_number": [], "officer": []}
+    for i in range(companyCnt):
+        companyNumber = f"{i:08d}"
+        for j in range(OFFICERS_PER_COMPANY):
+            storage["company_number"].append(companyNumber)
+            storage["officer"].append(f"director: PERSON {j}, Name")
+    manager.officerStorage = storage
+
+
+def concatTidy(storage: dict) -> pd.DataFrame:
+    """
+    Previous implementation: one-row frame per company concatenated to a growing frame
+    """
+    grouped = {}
+    for companyNumber, officer in zip(storage["company_number"], storage["officer"]):
+        grouped.setdefault(companyNumber, []).append(officer)
+    outframe = pd.DataFrame(columns = ["company_number", "company_officer_names"])
+    for companyNumber, officers in grouped.items():
+        row = pd.DataFrame({"company_number": [companyNumber], "company_officer_names": ["; ".join(officers)]})
+        outframe = pd.concat([outframe, row], ignore_index = True)
+    return outframe
+
+
+def timeIt(func, *args) -> float:
+    start = perf_counter()
+    func(*args)
+    return perf_counter() - start
+
+
+def main() -> None:
+    logger = logging.getLogger("benchmark")
+    with tempfile.TemporaryDirectory() as tmpDir:
+        manager = LeadManager(
+            cache = join(tmpDir, "cache.db"),
+            cacheTable = "companies",
+            retryTable = "retries",
+            rate = 300,
+            limit = 600,
+            sleepTimeBuffer = 0,
+            logger = logger,
+            allowedRequestTypes = ["search", "officers"]
+        )
+        print(f"{'companies':>10} {'concat, s':>10} {'groupby, s':>11} {'groupby us/company':>19}")
+        for size in SIZES:
+            fillStorage(manager, size)
+            concatTime = timeIt(concatTidy, manager.officerStorage) if size <= CONCAT_MAX_SIZE else float("nan")
+            groupbyTime = timeIt(manager.tidyOfficerResults)
+            print(f"{size:>10} {concatTime:>10.3f} {groupbyTime:>11.4f} {groupbyTime / size * 1e6:>19.2f}")
+
+
+if __name__ == "__main__":
+    main()
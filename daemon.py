@@ -0,0 +1,109 @@
+"""
+Long-running alternative to scheduling tracker.py with cron: one process runs search cycles on an interval or
+cron expression. HTTP session, rate limiter state, lead store client, cache connections and log pipeline are
+created once and kept warm between cycles. SIGINT / SIGTERM finish the current cycle and shut down cleanly,
+a second signal stops right away.
+Run from the repo root: python daemon.py --interval 1800 or python daemon.py --cron "*/30 * * * *"
+"""
+import argparse
+import asyncio
+import signal
+from datetime import datetime
+from pytz import timezone
+from threading import Event
+from toolBox.cycleSchedule import createSchedule
+from toolBox.metrics import RunMetrics
+from toolBox.sheetIndex import SheetIndex
+from toolBox.tracing import tracer
+from toolBox.utils import utilMaster
+from toolBox import IS_WINDOWS
+from tracker import closeLogging, createLeadStore, createManager, exportMetrics, runCycle, setupLogging
+
+
+def handleSignals(stopEvent: Event, logger) -> None:
+    """
+    First signal asks the loop to stop after the current cycle, second one interrupts it
+    """
+    def onSignal(signum, frame) -> None:
+        if stopEvent.is_set():
+            raise KeyboardInterrupt
+        logger.info(f"Got signal {signum}, shutting down after the current cycle")
+        stopEvent.set()
+
+    for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), onSignal)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Runs tracker search cycles in a long-lived process")
+    parser.add_argument("--interval", type = float, default = None, help = "seconds between cycle starts (daemon.interval_seconds of config)")
+    parser.add_argument("--cron", default = None, help = "5 field cron expression, takes precedence over interval (daemon.cron of config)")
+    parser.add_argument("--max-cycles", type = int, default = None, help = "stop after this many cycles")
+    args = parser.parse_args()
+    # Config is only read once arguments are parsed, so --help works without it
+    from toolBox import CACHE, DAEMON_CONFIG, REQUEST_TYPES, TIMEZONE
+    # Schedule given by flags replaces the one of config as a whole
+    if args.interval is None and args.cron is None:
+        args.interval, args.cron = DAEMON_CONFIG.get("interval_seconds"), DAEMON_CONFIG.get("cron")
+    schedule = createSchedule(intervalSeconds = args.interval, cron = args.cron)
+    tz = timezone(TIMEZONE)
+
+    utils = utilMaster()
+    daemonMeta = utils.generateRunMetaData(REQUEST_TYPES)
+    dbLogHandler, discordLogHander, qListener = setupLogging(utils, daemonMeta["run_id"])
+    utils.logger.info(f"Daemon {daemonMeta['run_id']} starts, cycles run {schedule}")
+    stopEvent = Event()
+    handleSignals(stopEvent, utils.logger)
+    if IS_WINDOWS:
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy()) #windows-specific thing!
+    # One loop for the whole process, so the pooled session and limiter live across cycles
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    manager = createManager(utils)
+    sheetReader = createLeadStore(utils)
+    leadIndex = SheetIndex(db = CACHE["db"], table = CACHE["sheet_index_table"], logger = utils.logger)
+    # Metrics are accumulated over cycles, so exported counters only grow while the daemon lives
+    totalMetrics = RunMetrics(daemonMeta["run_id"], REQUEST_TYPES)
+    cycles, lastStart = 0, None
+    try:
+        while not stopEvent.is_set():
+            # Wall time in the configured timezone, cron expressions are read in it too
+            now = datetime.now(tz).replace(tzinfo = None)
+            nextStart = schedule.nextRun(lastStart, now)
+            waitSeconds = (nextStart - now).total_seconds()
+            if waitSeconds > 0:
+                utils.logger.info(f"Next cycle at {nextStart}")
+                if stopEvent.wait(waitSeconds):
+                    break
+            lastStart = datetime.now(tz).replace(tzinfo = None)
+            searchMeta = utils.generateRunMetaData(REQUEST_TYPES)
+            # Log records of the cycle carry its run id
+            dbLogHandler.runId = discordLogHander.runId = searchMeta["run_id"]
+            tracer.reset()
+            utils.logger.info(f"Cycle {cycles + 1}, run ID {searchMeta['run_id']} starts...")
+            try:
+                runCycle(utils, manager, sheetReader, leadIndex, loop, searchMeta)
+            except Exception as e:
+                # A failed cycle should not take the daemon down, the next one starts on schedule
+                utils.logger.error(f"Cycle {searchMeta['run_id']} failed: {e}")
+            totalMetrics.merge(searchMeta["metrics"])
+            exportMetrics(utils, totalMetrics)
+            utils.logger.info(f"Cycle spans:\n{tracer.formatSummary()}")
+            cycles += 1
+            if args.max_cycles is not None and cycles >= args.max_cycles:
+                break
+    except KeyboardInterrupt:
+        utils.logger.warning("Daemon interrupted during a cycle")
+    finally:
+        dbLogHandler.runId = discordLogHander.runId = daemonMeta["run_id"]
+        utils.logger.info(f"Daemon stops after {cycles} cycles")
+        leadIndex.close()
+        sheetReader.close()
+        loop.run_until_complete(manager.close())
+        loop.close()
+        closeLogging(dbLogHandler, discordLogHander, qListener)
+
+
+if __name__ == "__main__":
+    main()
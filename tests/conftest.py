@@ -0,0 +1,20 @@
+import pytest
+
+
+class FakeClock:
+    """
+    Stands in for time() / monotonic() of the modules under test, moves only when told to
+    """
+    def __init__(self, now: float = 1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,26 @@
+import pytest
+from toolBox.config import ConfigError, getApiKeys, validateConfig
+
+
+def test_api_keys_are_read_from_rest_keys_first(monkeypatch):
+    monkeypatch.setenv("REST_KEYS", "first, second ,")
+    monkeypatch.setenv("REST_KEY", "single")
+    assert getApiKeys() == ["first", "second"]
+
+
+def test_single_rest_key_is_used_without_rest_keys(monkeypatch):
+    monkeypatch.delenv("REST_KEYS", raising = False)
+    monkeypatch.setenv("REST_KEY", "single")
+    assert getApiKeys() == ["single"]
+
+
+def test_missing_api_key_fails_at_start_up(monkeypatch):
+    monkeypatch.delenv("REST_KEYS", raising = False)
+    monkeypatch.delenv("REST_KEY", raising = False)
+    with pytest.raises(ConfigError):
+        getApiKeys()
+
+
+def test_shared_limiter_is_not_a_config_value():
+    problems = validateConfig({"companies_house": {"limiter_mode": "shared_token_bucket"}})
+    assert any("companies_house.limiter_mode should be one of" in problem for problem in problems)
@@ -0,0 +1,49 @@
+from datetime import datetime
+import pytest
+from toolBox.cycleSchedule import CronSchedule, IntervalSchedule, createSchedule
+
+
+def test_interval_counts_from_previous_start():
+    schedule = IntervalSchedule(600)
+    now = datetime(2024, 5, 3, 10, 0)
+    assert schedule.nextRun(None, now) == now
+    assert schedule.nextRun(datetime(2024, 5, 3, 9, 55), now) == datetime(2024, 5, 3, 10, 5)
+    # Cycle overran the interval: next one starts right away
+    assert schedule.nextRun(datetime(2024, 5, 3, 9, 40), now) == now
+    with pytest.raises(ValueError):
+        IntervalSchedule(0)
+
+
+@pytest.mark.parametrize("expression, now, expected", [
+    ("*/15 * * * *", datetime(2024, 5, 3, 10, 7, 30), datetime(2024, 5, 3, 10, 15)),
+    # Next run is strictly after now
+    ("30 2 * * *", datetime(2024, 5, 3, 2, 30), datetime(2024, 5, 4, 2, 30)),
+    ("0 9 * * 1-5", datetime(2024, 5, 3, 10, 0), datetime(2024, 5, 6, 9, 0)),
+    ("0 8 * * 0", datetime(2024, 5, 3, 10, 0), datetime(2024, 5, 5, 8, 0)),
+    ("0 8 * * 7", datetime(2024, 5, 3, 10, 0), datetime(2024, 5, 5, 8, 0)),
+    # Both day fields restricted: either of them matching is enough
+    ("0 0 13 * 5", datetime(2024, 5, 4, 0, 0), datetime(2024, 5, 10, 0, 0)),
+    ("0 0 13 * 5", datetime(2024, 5, 10, 0, 0), datetime(2024, 5, 13, 0, 0)),
+    ("0 0 29 2 *", datetime(2025, 3, 1, 0, 0), datetime(2028, 2, 29, 0, 0)),
+    ("5,35 1-3/2 1 1,7 *", datetime(2024, 5, 3, 0, 0), datetime(2024, 7, 1, 1, 5)),
+])
+def test_cron_next_run(expression, now, expected):
+    assert CronSchedule(expression).nextRun(None, now) == expected
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* 5-2 * * *", "*/0 * * * *"])
+def test_invalid_cron_expressions_are_rejected(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_cron_that_never_matches_fails():
+    with pytest.raises(ValueError):
+        CronSchedule("0 0 31 2 *").nextRun(None, datetime(2024, 1, 1))
+
+
+def test_cron_takes_precedence_over_interval():
+    assert isinstance(createSchedule(intervalSeconds = 60, cron = "0 * * * *"), CronSchedule)
+    assert isinstance(createSchedule(intervalSeconds = 60), IntervalSchedule)
+    with pytest.raises(ValueError):
+        createSchedule()
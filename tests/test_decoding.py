@@ -0,0 +1,39 @@
+import json
+import pytest
+from toolBox import decoding
+from toolBox.searchNormaliser import SearchNormaliser
+
+COLS_TO_SAVE = ["company_name", "company_number", "jurisdiction", "registered_office_address", "sic_codes"]
+
+
+def searchBody() -> bytes:
+    items = [
+        {
+            "company_name": f"RESTAURANT {i} LTD",
+            "company_number": f"{i:08d}",
+            "jurisdiction": "england-wales",
+            "registered_office_address": {"address_line_1": f"{i} High Street", "locality": "London"},
+            "sic_codes": ["56101"]
+        }
+        for i in range(3)
+    ]
+    return json.dumps({"hits": len(items), "items": items, "kind": "search-results#advanced-search"}).encode()
+
+
+def normalisedRows(page) -> dict:
+    normaliser = SearchNormaliser(COLS_TO_SAVE)
+    normaliser += page.get("items")
+    return normaliser.buffers
+
+
+@pytest.mark.skipif(decoding.msgspec is None, reason = "msgspec is not installed")
+def test_msgspec_and_fallback_give_same_rows_for_non_default_column(monkeypatch):
+    fast = normalisedRows(decoding.decodeResponse(searchBody(), "search"))
+    monkeypatch.setattr(decoding, "msgspec", None)
+    fallback = normalisedRows(decoding.decodeResponse(searchBody(), "search"))
+    assert fast == fallback
+    assert fast["jurisdiction"] == ["england-wales"] * 3
+
+
+def test_empty_body_decodes_to_none():
+    assert decoding.decodeResponse(b"  ", "search") is None
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import pytest
+from toolBox import keyPool, rateLimiter
+from toolBox.keyPool import KeyPool
+
+LOGGER = logging.getLogger("test")
+
+
+@pytest.fixture
+def pool(clock, monkeypatch):
+    for module, name in ((rateLimiter, "monotonic"), (rateLimiter, "time"), (keyPool, "monotonic")):
+        monkeypatch.setattr(module, name, clock)
+    return KeyPool(["key-aaaa", "key-bbbb", None], rate = 10, limit = 4, logger = LOGGER)
+
+
+def acquireLabels(pool: KeyPool, count: int) -> list:
+    async def run():
+        return [(await pool.acquire()).label for _ in range(count)]
+    return asyncio.run(run())
+
+
+def test_keys_are_masked_and_empty_ones_dropped(pool):
+    assert [pooledKey.label for pooledKey in pool.keys] == ["...aaaa", "...bbbb"]
+    assert pool.keys[0].auth.login == "key-aaaa"
+
+
+def test_pool_without_keys_uses_caller_auth():
+    pool = KeyPool([], rate = 10, limit = 4, logger = LOGGER)
+    assert [(pooledKey.label, pooledKey.auth) for pooledKey in pool.keys] == [("default", None)]
+
+
+def test_shared_states_have_to_match_keys():
+    with pytest.raises(ValueError):
+        KeyPool(["key-aaaa", "key-bbbb"], rate = 10, limit = 4, logger = LOGGER, limiterMode = "shared_token_bucket", sharedStates = [None])
+
+
+def test_load_is_spread_to_key_with_most_budget(pool):
+    assert acquireLabels(pool, 4) == ["...aaaa", "...bbbb", "...aaaa", "...bbbb"]
+    # API reports less budget for one key, the other one takes the load
+    pool.release(pool.keys[1], {"X-Ratelimit-Remain": "0", "X-Ratelimit-Reset": "2000"}, 200)
+    assert acquireLabels(pool, 2) == ["...aaaa", "...aaaa"]
+    assert pool.stats() == {"...aaaa": {"sent": 4, "throttled": 0}, "...bbbb": {"sent": 2, "throttled": 0}}
+
+
+def test_throttled_key_leaves_and_reenters_rotation(pool, clock):
+    throttled = pool.keys[0]
+    pool.release(throttled, {"Retry-After": "5"}, 429)
+    assert pool.stats()["...aaaa"]["throttled"] == 1
+    assert throttled.limiter.available() == 0
+    assert pool.nextReadyIn() == 0
+    assert acquireLabels(pool, 4) == ["...bbbb"] * 4
+
+    pool.release(pool.keys[1], {"Retry-After": "10"}, 429)
+    assert pool.nextReadyIn() == pytest.approx(5)
+    clock.advance(5)
+    assert acquireLabels(pool, 2) == ["...aaaa", "...aaaa"]
+
+
+def test_acquire_sleeps_until_first_key_has_budget(pool, clock, monkeypatch):
+    slept = []
+
+    async def fakeSleep(seconds):
+        slept.append(seconds)
+        clock.advance(seconds)
+    monkeypatch.setattr(keyPool.asyncio, "sleep", fakeSleep)
+    acquireLabels(pool, 8)
+    pool.release(pool.keys[1], {"Retry-After": "30"}, 429)
+    # Both buckets are empty: the unblocked key refills one token in 2.5 seconds
+    assert acquireLabels(pool, 1) == ["...aaaa"]
+    assert slept == [pytest.approx(2.5)]
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from datetime import date
+import pytest
+from toolBox import retryQueue
+from toolBox.leadManager import LeadManager
+
+BASE_URL = "https://api.example"
+
+
+@pytest.fixture
+def manager(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(retryQueue, "time", clock)
+    monkeypatch.setattr(retryQueue, "uniform", lambda low, high: high)
+    manager = LeadManager(
+        cache = str(tmp_path / "cache.db"),
+        cacheTable = "companies",
+        retryTable = "retry_queue",
+        rate = 10,
+        limit = 100,
+        sleepTimeBuffer = 0,
+        logger = logging.getLogger("test"),
+        allowedRequestTypes = ["search", "officers"],
+        retryConfig = {"base_delay": 60}
+    )
+    manager.prepareSearchStorage(["company_number"])
+    yield manager
+    asyncio.run(manager.close())
+
+
+def test_replay_that_raises_is_rescheduled(manager, clock, monkeypatch):
+    async def raising(**kwargs):
+        raise RuntimeError("connection reset")
+    monkeypatch.setattr(manager, "makeRequest", raising)
+    manager.retryQueue.pushMany([{
+        "url": f"{BASE_URL}/company/00000001/officers",
+        "requestType": "officers",
+        "companyNumber": "00000001",
+        "params": {"start_index": 0},
+        "status": 500
+    }])
+    clock.advance(60)
+    entries = manager.claimRetries("officers")
+
+    asyncio.run(manager.streamLeads(
+        searchUrl = f"{BASE_URL}/advanced-search/companies",
+        baseUrl = BASE_URL,
+        auth = None,
+        baseParams = {},
+        dateFrom = date(2024, 1, 1),
+        dateTo = date(2024, 1, 1),
+        metaData = {},
+        excludeIds = [],
+        cachedCompanyNumbers = ["00000001"],
+        officerRetries = entries
+    ))
+    assert manager.getIncompleteCompanies() == {"00000001"}
+    # Released with backoff instead of staying leased until the claim expires
+    assert manager.claimRetries("officers") == []
+    clock.advance(60)
+    assert [entry["attempts"] for entry in manager.claimRetries("officers")] == [1]
+
+
+def fakeSearchApi(perDay: int, requests: list):
+    """
+    Stands in for makeRequest: search windows have @perDay companies a day, companies have no officers
+    """
+    async def makeRequest(requestType, url, params = None, storage = None, **kwargs):
+        requests.append((requestType, params))
+        if requestType == "officers":
+            return {"items": [], "total_results": 0}
+        dateFrom = date.fromisoformat(params["incorporated_from"])
+        dateTo = date.fromisoformat(params["incorporated_to"])
+        hits = ((dateTo - dateFrom).days + 1) * perDay
+        start = params["start_index"]
+        page = {
+            "hits": hits,
+            "items": [
+                {"company_number": f"{dateFrom.toordinal() + k // perDay}-{k % perDay}"}
+                for k in range(start, min(start + params["size"], hits))
+            ]
+        }
+        if storage is not None:
+            storage += page["items"]
+        return page
+    return makeRequest
+
+
+def streamWindow(manager: LeadManager, dateFrom: date, dateTo: date, pageSize: int) -> None:
+    asyncio.run(manager.streamLeads(
+        searchUrl = f"{BASE_URL}/advanced-search/companies",
+        baseUrl = BASE_URL,
+        auth = None,
+        baseParams = {},
+        dateFrom = dateFrom,
+        dateTo = dateTo,
+        metaData = {},
+        excludeIds = [],
+        cachedCompanyNumbers = [],
+        searchPageSize = pageSize
+    ))
+
+
+def test_windows_to_split_are_probed_instead_of_fetched(manager, monkeypatch):
+    requests = []
+    monkeypatch.setattr(manager, "makeRequest", fakeSearchApi(4, requests))
+    # 32 hits: probe, two probed halves of 16 hits, four full pages of 8 hits
+    streamWindow(manager, date(2024, 1, 1), date(2024, 1, 8), pageSize = 10)
+    sizes = sorted(params["size"] for requestType, params in requests if requestType == "search")
+    assert sizes == [1, 1, 1, 10, 10, 10, 10]
+    assert manager.searchStorage.rowCnt == 32
+
+
+def test_single_day_is_paged_without_probe(manager, monkeypatch):
+    requests = []
+    monkeypatch.setattr(manager, "makeRequest", fakeSearchApi(25, requests))
+    streamWindow(manager, date(2024, 1, 1), date(2024, 1, 1), pageSize = 10)
+    starts = sorted(params["start_index"] for requestType, params in requests if requestType == "search")
+    assert starts == [0, 10, 20]
+    assert manager.searchStorage.rowCnt == 25
@@ -0,0 +1,81 @@
+import json
+import pytest
+from toolBox.metrics import Histogram, RunMetrics
+
+
+@pytest.fixture
+def metrics():
+    metrics = RunMetrics("run-1", ["search", "officers"])
+    metrics.observeRequest("search", 200, 0.03, nBytes = 1000)
+    metrics.observeRequest("officers", 200, 0.2, nBytes = 300)
+    metrics.observeRequest("officers", 200, 0.04, nBytes = 200)
+    metrics.observeRequest("officers", 429, 0.02)
+    metrics.observeRequest("officers", 0, 120.0)
+    metrics.observeLimiterWait("officers", 0.5)
+    metrics.countRetry("officers", "429_on_the_spot")
+    metrics.countCacheHit("officers")
+    return metrics
+
+
+def samples(text: str) -> dict:
+    """
+    Parses sample lines of Prometheus text format to {series: value}
+    """
+    lines = [line for line in text.splitlines() if line and not line.startswith("#")]
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1]) for line in lines}
+
+
+def test_histogram_quantiles_are_interpolated_within_buckets():
+    hist = Histogram((1.0, 2.0))
+    for value in (0.5, 1.5, 1.5, 1.5, 5.0):
+        hist.observe(value)
+    assert hist.counts == [1, 3, 1]
+    assert hist.quantile(0.5) == pytest.approx(1.5)
+    assert hist.quantile(1) == 2.0
+    assert Histogram((1.0,)).quantile(0.5) is None
+
+
+def test_prometheus_export_has_cumulative_buckets_and_counters(metrics):
+    text = metrics.toPrometheus()
+    values = samples(text)
+    p = "companies_house"
+    assert values[f'{p}_requests_total{{request_type="officers",status="200"}}'] == 2
+    assert values[f'{p}_requests_total{{request_type="officers",status="0"}}'] == 1
+    assert values[f'{p}_request_duration_seconds_bucket{{request_type="officers",status="200",le="0.05"}}'] == 1
+    assert values[f'{p}_request_duration_seconds_bucket{{request_type="officers",status="200",le="+Inf"}}'] == 2
+    assert values[f'{p}_request_duration_seconds_count{{request_type="officers",status="200"}}'] == 2
+    assert values[f'{p}_retries_total{{request_type="officers",reason="429_on_the_spot"}}'] == 1
+    assert values[f'{p}_response_bytes_total{{request_type="officers"}}'] == 500
+    assert values[f'{p}_response_cache_hits_total{{request_type="officers"}}'] == 1
+    # Every metric family is declared once, run id only labels the start timestamp
+    types = [line.split()[2] for line in text.splitlines() if line.startswith("# TYPE")]
+    assert len(types) == len(set(types)) == 7
+    assert [series for series in values if "run_id" in series] == [f'{p}_run_start_timestamp_seconds{{run_id="run-1"}}']
+
+
+def test_json_export_matches_counters(metrics, tmp_path):
+    promPath, jsonPath = tmp_path / "run.prom", tmp_path / "run.json"
+    assert metrics.export(promPath = str(promPath), jsonPath = str(jsonPath)) is None
+    assert promPath.read_text() == metrics.toPrometheus()
+    exported = json.loads(jsonPath.read_text())
+    assert exported["run_id"] == "run-1"
+    officers = {entry["status"]: entry for entry in exported["requests"] if entry["request_type"] == "officers"}
+    assert {status: entry["count"] for status, entry in officers.items()} == {0: 1, 200: 2, 429: 1}
+    assert officers[0]["latency_seconds"]["buckets"]["+Inf"] == 1
+    assert exported["limiter_wait_seconds"]["officers"]["count"] == 1
+    assert exported["response_bytes"] == {"search": 1000, "officers": 500}
+
+
+def test_export_returns_error_instead_of_raising(metrics, tmp_path):
+    assert isinstance(metrics.export(promPath = str(tmp_path / "missing" / "run.prom")), OSError)
+
+
+def test_merged_metrics_add_up(metrics):
+    other = RunMetrics("run-1", ["search", "officers"])
+    other.observeRequest("officers", 200, 0.04, nBytes = 100)
+    other.countRetry("officers", "429_on_the_spot")
+    metrics.merge(other)
+    assert metrics.requestCounts("officers") == (3, 2)
+    assert metrics.typeLatency("officers").count == 5
+    assert metrics.retries[("officers", "429_on_the_spot")] == 2
+    assert metrics.bytes["officers"] == 600
@@ -0,0 +1,115 @@
+import logging
+import pytest
+from toolBox import rateLimiter
+from toolBox.rateLimiter import SharedTokenBucketLimiter, SlidingWindowLimiter, TokenBucketLimiter
+
+LOGGER = logging.getLogger("test")
+
+
+@pytest.fixture(autouse = True)
+def frozenTime(clock, monkeypatch):
+    # Wall clock and monotonic clock move together, so Reset headers can be built from clock.now
+    monkeypatch.setattr(rateLimiter, "monotonic", clock)
+    monkeypatch.setattr(rateLimiter, "time", clock)
+
+
+def drain(limiter, clock) -> int:
+    sent = 0
+    while limiter.tryAcquire(clock.now) <= 0:
+        sent += 1
+    return sent
+
+
+def test_token_bucket_refills_over_time(clock):
+    limiter = TokenBucketLimiter(rate = 10, limit = 5, logger = LOGGER)
+    assert drain(limiter, clock) == 5
+    assert limiter.tryAcquire(clock.now) == pytest.approx(2)
+    clock.advance(2)
+    assert limiter.tryAcquire(clock.now) == 0
+    assert limiter.tryAcquire(clock.now) > 0
+
+
+def test_token_bucket_syncs_remaining_from_headers(clock):
+    limiter = TokenBucketLimiter(rate = 10, limit = 100, logger = LOGGER)
+    assert limiter.tryAcquire(clock.now) == 0
+    assert limiter.tryAcquire(clock.now) == 0
+    # Second request is still in flight and not counted by the API yet
+    limiter.syncFromHeaders({"X-Ratelimit-Remain": "4", "X-Ratelimit-Reset": str(clock.now + 10)}, 200)
+    assert limiter.pending == 1
+    assert drain(limiter, clock) == 3
+    # Full budget is back once the API window resets
+    clock.advance(10)
+    assert limiter.available() == 100
+
+
+def test_exhausted_window_blocks_until_reset(clock):
+    limiter = TokenBucketLimiter(rate = 10, limit = 100, logger = LOGGER, sleepTimeBuffer = 1)
+    limiter.tryAcquire(clock.now)
+    limiter.syncFromHeaders({"X-Ratelimit-Remain": "0", "X-Ratelimit-Reset": str(clock.now + 5)}, 200)
+    assert limiter.tryAcquire(clock.now) == pytest.approx(6)
+    clock.advance(6)
+    assert limiter.tryAcquire(clock.now) == 0
+
+
+def test_429_blocks_for_retry_after(clock):
+    limiter = TokenBucketLimiter(rate = 10, limit = 100, logger = LOGGER)
+    limiter.tryAcquire(clock.now)
+    limiter.syncFromHeaders({"Retry-After": "3", "X-Ratelimit-Reset": str(clock.now + 8)}, 429)
+    assert limiter.available() == 0
+    assert limiter.tryAcquire(clock.now) == pytest.approx(3)
+    clock.advance(3)
+    assert limiter.tryAcquire(clock.now) == 0
+
+
+def test_sliding_window_frees_capacity_as_requests_age_out(clock):
+    limiter = SlidingWindowLimiter(rate = 10, limit = 3, logger = LOGGER)
+    limiter.tryAcquire(clock.now)
+    clock.advance(4)
+    assert drain(limiter, clock) == 2
+    assert limiter.tryAcquire(clock.now) == pytest.approx(6)
+    clock.advance(6)
+    assert drain(limiter, clock) == 1
+
+
+def test_sliding_window_syncs_remaining_from_headers(clock):
+    limiter = SlidingWindowLimiter(rate = 10, limit = 5, logger = LOGGER)
+    limiter.tryAcquire(clock.now)
+    # API counted requests we did not see (e.g. another process), budget is padded until its window resets
+    limiter.syncFromHeaders({"X-Ratelimit-Remain": "2", "X-Ratelimit-Reset": str(clock.now + 4)}, 200)
+    assert limiter.available() == 2
+    # Padding expires at the API reset, our own request only once it is @rate seconds old
+    clock.advance(4)
+    assert limiter.available() == 4
+    clock.advance(6)
+    assert limiter.available() == 5
+    # API reporting more budget than we think drops our oldest timestamps
+    assert drain(limiter, clock) == 5
+    for _ in range(4):
+        limiter.syncFromHeaders({}, 200)
+    limiter.syncFromHeaders({"X-Ratelimit-Remain": "3", "X-Ratelimit-Reset": str(clock.now + 10)}, 200)
+    assert limiter.available() == 3
+
+
+def test_shared_bucket_is_split_between_limiters(clock):
+    state = SharedTokenBucketLimiter.createState(10)
+    first = SharedTokenBucketLimiter(rate = 10, limit = 10, logger = LOGGER, state = state)
+    second = SharedTokenBucketLimiter(rate = 10, limit = 10, logger = LOGGER, state = state)
+    first.lastRefill = clock.now
+    assert first.tryAcquire(clock.now) == 0
+    assert drain(second, clock) == 9
+    assert first.tryAcquire(clock.now) > 0
+    assert second.pending == 10
+
+
+def test_shared_bucket_ignores_stale_budget_of_same_window(clock):
+    state = SharedTokenBucketLimiter.createState(10)
+    first = SharedTokenBucketLimiter(rate = 10, limit = 10, logger = LOGGER, state = state)
+    second = SharedTokenBucketLimiter(rate = 10, limit = 10, logger = LOGGER, state = state)
+    first.lastRefill = clock.now
+    first.tryAcquire(clock.now)
+    second.tryAcquire(clock.now)
+    # Response to the later request is read first, the earlier one reports budget already used
+    second.syncFromHeaders({"X-Ratelimit-Remain": "8", "X-Ratelimit-Reset": str(clock.now + 10)}, 200)
+    assert first.available() == 7
+    first.syncFromHeaders({"X-Ratelimit-Remain": "9", "X-Ratelimit-Reset": str(clock.now + 10)}, 200)
+    assert first.available() == second.available() == 7
@@ -0,0 +1,52 @@
+import logging
+import pytest
+from toolBox.recordKeeper import discordHandler
+
+
+def record(message: str, level: int = logging.WARNING, funcName: str = "fetchOfficers") -> logging.LogRecord:
+    rec = logging.LogRecord("test", level, __file__, 1, message, None, None)
+    rec.funcName = funcName
+    return rec
+
+
+@pytest.fixture
+def handler():
+    # Webhook is never called: tests only use message preparation
+    h = discordHandler(webhook = "http://127.0.0.1:9/none", poc1 = "1", poc2 = "2", runId = "run", flushInterval = 0)
+    yield h
+    h.close()
+
+
+def test_records_differing_in_numbers_are_collapsed(handler):
+    lines = handler._prepareLines([
+        record("Got 429 for /company/00000001/officers, waiting for 1.5 seconds"),
+        record("Got 429 for /company/00000002/officers, waiting for 2.5 seconds"),
+        record("Got 429 for /company/00000002/officers, waiting for 2.5 seconds", level = logging.ERROR)
+    ])
+    assert len(lines) == 2
+    # Latest occurrence is shown with the count
+    assert lines[0].endswith("/company/00000002/officers, waiting for 2.5 seconds (x2)")
+    assert "(x" not in lines[1]
+
+
+def test_lines_are_packed_into_few_messages_with_header(handler):
+    messages = handler._prepareMessages([record(f"warning {chr(97 + i)}") for i in range(5)])
+    assert len(messages) == 1
+    assert messages[0].startswith("<@1>\n<@2>\nRun: run.")
+    assert messages[0].count("\n") == 2 + 5
+
+
+def test_messages_are_split_at_character_limit(handler):
+    # Letters only, so the records do not collapse into one line
+    records = [record(chr(97 + i % 26) * 300 + chr(97 + i // 26)) for i in range(30)]
+    messages = handler._prepareMessages(records)
+    assert len(messages) > 1
+    assert all(len(message) <= 2000 for message in messages)
+    assert all(message.startswith("<@1>\n<@2>\nRun: run.") for message in messages)
+    assert sum(message.count("\n") - 2 for message in messages) == 30
+
+
+def test_overlong_line_is_truncated_to_fit_with_header(handler):
+    messages = handler._prepareMessages([record("x" * 5000)])
+    assert len(messages) == 1
+    assert len(messages[0]) == 2000
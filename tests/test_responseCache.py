@@ -0,0 +1,83 @@
+import asyncio
+import json
+import logging
+import pytest
+from toolBox import responseCache
+from toolBox.leadManager import Connector
+from toolBox.responseCache import ResponseCache
+
+LOGGER = logging.getLogger("test")
+URL = "https://api.example/company/00000001/officers"
+
+
+@pytest.fixture
+def cache(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(responseCache, "time", clock)
+    cache = ResponseCache(str(tmp_path / "http.db"), LOGGER, ttl = 60, maxEntries = 2, requestTypes = ["officers"], evictEvery = 1000)
+    yield cache
+    cache.conn.close()
+
+
+def test_key_does_not_depend_on_param_order():
+    assert ResponseCache.makeKey(URL, {"b": 2, "a": 1}) == ResponseCache.makeKey(URL, {"a": "1", "b": "2"})
+    assert ResponseCache.makeKey(URL) == URL
+
+
+def test_entry_goes_stale_after_ttl_and_revalidation_restarts_it(cache, clock):
+    cache.store(URL, b"{}", etag = "v1")
+    assert cache.lookup(URL)["fresh"]
+    clock.advance(60)
+    stale = cache.lookup(URL)
+    assert (stale["fresh"], stale["etag"]) == (False, "v1")
+    cache.markFresh(URL, etag = None)
+    assert cache.lookup(URL) == {"body": b"{}", "etag": "v1", "fresh": True}
+
+
+def test_least_recently_used_entries_are_evicted(cache, clock):
+    for key in ("a", "b", "c"):
+        cache.store(key, b"{}")
+        clock.advance(1)
+    # Reading "a" makes "b" the least recently used entry
+    cache.lookup("a")
+    cache.evict()
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") is not None and cache.lookup("c") is not None
+    assert cache.stats["evicted"] == 1
+
+
+def test_stale_entry_is_revalidated_with_etag(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(responseCache, "time", clock)
+    connector = Connector(
+        rate = 10,
+        limit = 100,
+        sleepTimeBuffer = 0,
+        logger = LOGGER,
+        allowedRequestTypes = ["officers"],
+        httpCacheConfig = {"db": str(tmp_path / "http.db"), "ttl": 60, "request_types": ["officers"]}
+    )
+    cache = connector.responseCache
+    body = json.dumps({"items": [{"name": "A"}], "total_results": 1}).encode()
+    sentHeaders = []
+
+    async def limitedGet(session, url, auth, requestType, metrics = None, params = None, headers = None):
+        sentHeaders.append(headers)
+        if headers is not None and headers.get("If-None-Match") == "v1":
+            return 304, url, None, "v1"
+        return 200, url, body, "v1"
+    monkeypatch.setattr(connector, "_Connector__limitedGet", limitedGet)
+
+    async def run():
+        try:
+            pages = []
+            for _ in range(3):
+                pages.append(await connector.makeRequest("officers", URL, None, None, None, None))
+                clock.advance(40)
+            return pages
+        finally:
+            await connector.close()
+
+    pages = asyncio.run(run())
+    # Request, fresh hit without a request, conditional request answered with 304
+    assert sentHeaders == [None, {"If-None-Match": "v1"}]
+    assert [page["total_results"] for page in pages] == [1, 1, 1]
+    assert cache.stats == {"fresh": 1, "revalidated": 1, "stored": 1, "evicted": 0}
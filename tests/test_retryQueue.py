@@ -0,0 +1,82 @@
+import logging
+import dataset
+import pytest
+from toolBox import retryQueue
+from toolBox.retryQueue import RetryQueue
+
+URL = "https://api.example/company/00000001/officers"
+
+
+@pytest.fixture
+def queue(clock, monkeypatch):
+    monkeypatch.setattr(retryQueue, "time", clock)
+    # Upper bound of the jitter range, so due times are predictable
+    monkeypatch.setattr(retryQueue, "uniform", lambda low, high: high)
+    db = dataset.connect("sqlite:///:memory:")
+    yield RetryQueue(db, "retry_queue", logging.getLogger("test"), baseDelay = 60, maxDelay = 600, maxAttempts = 3, leaseSeconds = 900)
+    db.close()
+
+
+def push(queue: RetryQueue, url: str = URL, params: dict = None) -> None:
+    queue.pushMany([{"url": url, "requestType": "officers", "companyNumber": "00000001", "params": params, "status": 500}])
+
+
+def test_entries_are_claimed_once_due_and_removed_on_ack(queue, clock):
+    push(queue)
+    assert queue.claim("officers") == []
+    clock.advance(60)
+    claimed = queue.claim("officers")
+    assert [entry["companyNumber"] for entry in claimed] == ["00000001"]
+    # Claimed entries are leased to the run that claimed them
+    assert queue.claim("officers") == []
+    queue.ack(claimed)
+    assert queue.pendingCount() == 0
+
+
+def test_lease_of_abandoned_claim_expires(queue, clock):
+    push(queue)
+    clock.advance(60)
+    first = queue.claim("officers")
+    clock.advance(899)
+    assert queue.claim("officers") == []
+    clock.advance(2)
+    reclaimed = queue.claim("officers")
+    assert [entry["id"] for entry in reclaimed] == [entry["id"] for entry in first]
+
+
+def test_nack_reschedules_with_exponential_backoff(queue, clock):
+    push(queue)
+    clock.advance(60)
+    queue.nack(queue.claim("officers"))
+    clock.advance(60)
+    claimed = queue.claim("officers")
+    assert claimed[0]["attempts"] == 1
+    queue.nack(claimed)
+    # Delay doubles with every failed attempt
+    clock.advance(119)
+    assert queue.claim("officers") == []
+    clock.advance(1)
+    assert queue.claim("officers")[0]["attempts"] == 2
+
+
+def test_entry_is_dropped_after_max_attempts(queue, clock):
+    push(queue)
+    for _ in range(3):
+        clock.advance(600)
+        claimed = queue.claim("officers")
+        assert len(claimed) == 1
+        queue.nack(claimed)
+    assert queue.pendingCount() == 0
+
+
+def test_same_request_is_queued_once(queue):
+    push(queue, url = f"{URL}?start_index=100")
+    push(queue, params = {"start_index": 100})
+    assert queue.pendingCount() == 1
+
+
+def test_backoff_jitter_stays_within_capped_range():
+    queue = RetryQueue.__new__(RetryQueue)
+    queue.baseDelay, queue.maxDelay = 60, 600
+    for attempts, delay in ((1, 60), (2, 120), (4, 480), (10, 600)):
+        assert all(delay / 2 <= queue.backoff(attempts) <= delay for _ in range(50))
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from toolBox.scheduler import RequestScheduler
+
+LOGGER = logging.getLogger("test")
+
+
+class FakeConnector:
+    """
+    Answers every request after @delay seconds with its url, tracks how many requests of each type run at once
+    """
+    def __init__(self, delay: float = 0.01, failOn: str = None) -> None:
+        self.delay = delay
+        self.failOn = failOn
+        self.running = {}
+        self.peak = {}
+        self.urls = []
+
+    async def makeRequest(self, requestType: str, url: str, **kwargs) -> dict:
+        self.running[requestType] = self.running.get(requestType, 0) + 1
+        self.peak[requestType] = max(self.peak.get(requestType, 0), self.running[requestType])
+        try:
+            await asyncio.sleep(self.delay)
+            if url == self.failOn:
+                raise RuntimeError("boom")
+            self.urls.append(url)
+            return {"url": url}
+        finally:
+            self.running[requestType] -= 1
+
+
+def spec(url: str, requestType: str = "search", **extra) -> dict:
+    return dict(url = url, requestType = requestType, **extra)
+
+
+def test_type_limits_cap_concurrency_per_request_type():
+    connector = FakeConnector()
+    scheduler = RequestScheduler(connector, LOGGER, workers = 10, typeLimits = {"search": 2})
+    specs = [spec(f"s{i}") for i in range(6)] + [spec(f"o{i}", "officers") for i in range(6)]
+    asyncio.run(scheduler.run(specs))
+    assert connector.peak["search"] == 2
+    assert connector.peak["officers"] > 2
+    assert len(connector.urls) == 12
+
+
+def test_follow_ups_from_callbacks_are_drained():
+    connector = FakeConnector(delay = 0)
+
+    async def run():
+        # Queue of one: follow-ups must not wait for capacity held by the spec whose callback adds them
+        scheduler = RequestScheduler(connector, LOGGER, workers = 1, queueSize = 1)
+
+        async def nextPages(page: dict) -> None:
+            for i in range(3):
+                scheduler.submitFollowUp(spec(f"{page['url']}/{i}"))
+        scheduler.start()
+        await scheduler.submit(spec("first", callback = nextPages))
+        await asyncio.wait_for(scheduler.drain(), timeout = 5)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert connector.urls == ["first", "first/0", "first/1", "first/2"]
+    assert scheduler.workers == []
+
+
+def test_failures_are_counted_and_reported_to_on_error():
+    connector = FakeConnector(delay = 0, failOn = "bad")
+    errors = []
+
+    async def onError(e: Exception) -> None:
+        errors.append(str(e))
+    scheduler = RequestScheduler(connector, LOGGER, workers = 2)
+    asyncio.run(scheduler.run([spec("good"), spec("bad", onError = onError)]))
+    assert scheduler.failed == 1
+    assert errors == ["boom"]
+    assert connector.urls == ["good"]
+
+
+def test_stop_cancels_workers_without_waiting_for_queue():
+    connector = FakeConnector(delay = 10)
+
+    async def run():
+        scheduler = RequestScheduler(connector, LOGGER, workers = 2)
+        scheduler.start()
+        for i in range(4):
+            await scheduler.submit(spec(f"s{i}"))
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(scheduler.stop(), timeout = 1)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.workers == []
+    assert connector.urls == []
+    assert connector.running["search"] == 0
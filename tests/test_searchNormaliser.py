@@ -0,0 +1,49 @@
+from toolBox.searchNormaliser import SearchNormaliser
+
+COLS_TO_SAVE = ["company_name", "registered_office_address", "company_number", "sic_codes", "date_of_creation"]
+RUN_META_DATA = {"run_id": "run-1", "run_start_ts": "2024-01-02 00:00:00"}
+
+
+def item(i: int, **overrides) -> dict:
+    return {
+        "company_name": f"CAFE {i} LTD",
+        "company_number": f"{i:08d}",
+        "registered_office_address": {"address_line_1": f"{i} High Street", "locality": "London"},
+        "sic_codes": ["56101", "56102"],
+        "date_of_creation": "2024-01-01",
+        **overrides
+    }
+
+
+def test_pages_are_flattened_to_columns_with_flattened_ones_last():
+    normaliser = SearchNormaliser(COLS_TO_SAVE)
+    normaliser += [item(1)]
+    normaliser += [item(2, registered_office_address = None, sic_codes = None), {"company_number": "00000003"}]
+    assert len(normaliser) == 3
+    frame = normaliser.toFrame(RUN_META_DATA)
+    assert list(frame.columns) == [
+        "company_name", "company_number", "date_of_creation", "address_string", "sic_codes_string", "added_on_run_id", "added_run_ts"
+    ]
+    assert frame["address_string"].tolist() == ["1 High Street, London", "", ""]
+    assert frame["sic_codes_string"].tolist() == ["56101, 56102", "", ""]
+    assert frame["company_name"].tolist() == ["CAFE 1 LTD", "CAFE 2 LTD", None]
+    assert set(frame["added_on_run_id"]) == {"run-1"}
+
+
+def test_buffers_are_released_after_building_frame():
+    normaliser = SearchNormaliser(COLS_TO_SAVE)
+    normaliser += [item(1)]
+    normaliser.toFrame(RUN_META_DATA)
+    assert len(normaliser) == 0
+    assert all(buffer == [] for buffer in normaliser.buffers.values())
+    assert normaliser.toFrame(RUN_META_DATA).empty
+
+
+def test_on_page_hook_gets_every_normalised_page():
+    normaliser = SearchNormaliser(["company_number"])
+    pages = []
+    normaliser.onPage = pages.append
+    normaliser += [item(1), item(2)]
+    normaliser += None
+    normaliser += []
+    assert [[entry["company_number"] for entry in page] for page in pages] == [["00000001", "00000002"], []]
@@ -0,0 +1,78 @@
+import logging
+from types import SimpleNamespace
+import pytest
+from toolBox.sheetIndex import SheetIndex
+from toolBox.sheetManager import sheetManager
+
+HEADER = ["company_name", "company_number", "date_of_creation"]
+
+
+class FakeWorksheet:
+    """
+    In-memory leads tab, grid size is taken at fetch time like pygsheets does
+    """
+    def __init__(self, values: list) -> None:
+        self.values = values
+        self.rows = len(values)
+
+    def get_row(self, row: int, include_tailing_empty = True) -> list:
+        return self.values[row - 1]
+
+    def get_values(self, start: tuple, end: tuple, include_tailing_empty_rows = True) -> list:
+        rows = [row[start[1] - 1:end[1]] for row in self.values[start[0] - 1:end[0]]]
+        while not include_tailing_empty_rows and rows and not any(rows[-1]):
+            rows.pop()
+        return rows
+
+    def cell(self, address: tuple):
+        row, col = address
+        return SimpleNamespace(value = self.values[row - 1][col - 1] if row <= len(self.values) else "")
+
+    def get_col(self, col: int, include_tailing_empty = True) -> list:
+        return [row[col - 1] for row in self.values]
+
+
+class FakeSpreadsheet:
+    def __init__(self, values: list) -> None:
+        self.values = values
+        self.cached = FakeWorksheet(values)
+
+    def worksheets(self, sheet_property = None, value = None, force_fetch = False) -> list:
+        if force_fetch:
+            self.cached = FakeWorksheet(self.values)
+        return [self.cached]
+
+
+def lead(i: int) -> list:
+    return [f"LEAD {i} LTD", f"{i:08d}", "2024-01-0{}".format(i % 9 + 1)]
+
+
+@pytest.fixture
+def store():
+    manager = sheetManager(logger = logging.getLogger("test"), benchmarkSheets = [], controlPanelSheetName = "cp", leadsSheetName = "leads")
+    manager.spreadsheet = FakeSpreadsheet([HEADER, lead(1), lead(2)])
+    return manager
+
+
+@pytest.fixture
+def leadIndex():
+    index = SheetIndex(db = ":memory:", table = "sheet_index", logger = logging.getLogger("test"))
+    yield index
+    index.close()
+
+
+def test_rows_appended_by_other_writers_are_indexed(store, leadIndex):
+    assert store.syncLeadIndex(leadIndex) is None
+    assert leadIndex.rowCount() == 2
+    # Another writer appends past the grid size seen by the first sync
+    store.spreadsheet.values.extend([lead(3), lead(4)])
+    assert store.syncLeadIndex(leadIndex) is None
+    assert leadIndex.rowCount() == 4
+    assert leadIndex.companyNumbers()[-1] == "00000004"
+
+
+def test_in_place_edit_rebuilds_index(store, leadIndex):
+    store.syncLeadIndex(leadIndex)
+    store.spreadsheet.values[2] = lead(7)
+    assert store.syncLeadIndex(leadIndex) is None
+    assert sorted(leadIndex.companyNumbers()) == ["00000001", "00000007"]
@@ -0,0 +1,95 @@
+import logging
+import pandas as pd
+import pytest
+from toolBox.sheetIndex import SheetIndex
+from toolBox.sqliteLeadStore import SqliteLeadStore
+
+LOGGER = logging.getLogger("test")
+
+
+@pytest.mark.parametrize("header", ["Actual Input", " Data-Type ", "Purpose (search)", "it's.Here", "a@b", "Café  Name", "x/y:z?"])
+def test_names_are_cleaned_like_janitor(header):
+    janitor = pytest.importorskip("janitor")
+    expected = janitor.clean_names(pd.DataFrame(columns = [header])).columns[0]
+    assert SqliteLeadStore.cleanName(header) == expected
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteLeadStore(LOGGER, "controlPanel", "leads", db = str(tmp_path / "leads.db"), chunkRows = 2)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def index():
+    index = SheetIndex(db = ":memory:", table = "lead_index", logger = LOGGER)
+    yield index
+    index.close()
+
+
+class FailingIndex:
+    """
+    Lead index that fails to record the chunk after @okChunks, like a run dying between a write and its index update
+    """
+    def __init__(self, okChunks: int) -> None:
+        self.okChunks = okChunks
+
+    def extend(self, rows, startRow: int) -> int:
+        if self.okChunks == 0:
+            raise RuntimeError("run died")
+        self.okChunks -= 1
+        return len(list(rows))
+
+
+def leads(*numbers: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "company_name": [f"CAFE {n} LTD" for n in numbers],
+        "company_number": [f"{n:08d}" for n in numbers],
+        "date_of_creation": [f"2024-01-{n:02d}" for n in numbers],
+        "added_run_ts": ["2024-02-01 00:00:00"] * len(numbers)
+    })
+
+
+def storedNumbers(store: SqliteLeadStore) -> list:
+    return [row[0] for row in store.conn.execute('SELECT company_number FROM "leads" ORDER BY rowid')]
+
+
+def test_append_indexes_every_chunk(store, index):
+    assert store.syncLeadIndex(index) is None
+    appended, e = store.appendToSheet(pd.Series([], dtype = object), leads(3, 1, 2), leadIndex = index)
+    assert e is None
+    # Leads go in by incorporation date
+    assert appended == storedNumbers(store) == index.companyNumbers() == ["00000001", "00000002", "00000003"]
+    assert str(index.watermark()) == "2024-01-03"
+
+
+def test_append_resumed_after_failure_does_not_duplicate_leads(store, index):
+    batch = leads(1, 2, 3, 4, 5)
+    appended, e = store.appendToSheet(pd.Series([], dtype = object), batch.copy(), leadIndex = FailingIndex(okChunks = 1))
+    assert isinstance(e, RuntimeError)
+    # Second chunk was written, but the run died before indexing it
+    assert appended == ["00000001", "00000002"]
+    assert len(storedNumbers(store)) == 4
+
+    # Next run: sync reads the unindexed tail, only leads not in the store are appended
+    assert store.syncLeadIndex(index) is None
+    existing = pd.Series(index.companyNumbers(), dtype = object)
+    rest = batch[~batch["company_number"].isin(existing)].copy()
+    appended, e = store.appendToSheet(existing, rest, leadIndex = index)
+    assert (appended, e) == (["00000005"], None)
+    assert storedNumbers(store) == index.companyNumbers() == [f"{n:08d}" for n in range(1, 6)]
+
+
+def test_sync_reads_only_new_rows_and_rebuilds_after_edits(store, index):
+    store.appendToSheet(pd.Series([], dtype = object), leads(1, 2), leadIndex = index)
+    with store.conn:
+        store.conn.execute('INSERT INTO "leads" (company_number, date_of_creation) VALUES (?, ?)', ("00000009", "2024-01-09"))
+    assert store.syncLeadIndex(index) is None
+    assert index.companyNumbers() == ["00000001", "00000002", "00000009"]
+
+    # Last indexed row changed in place: index can not be trusted anymore and is rebuilt
+    with store.conn:
+        store.conn.execute('DELETE FROM "leads" WHERE company_number = ?', ("00000009",))
+        store.conn.execute('UPDATE "leads" SET company_number = ? WHERE company_number = ?', ("00000007", "00000002"))
+    assert store.syncLeadIndex(index) is None
+    assert index.companyNumbers() == ["00000001", "00000007"]
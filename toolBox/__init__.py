@@ -1,44 +1,75 @@
-import yaml
-import json
-from dotenv import load_dotenv
-from os import getenv
-from sys import platform
-from pathlib import PureWindowsPath
-#Read platform - needed for windows-specific steps
-IS_WINDOWS = "win" in str(platform).lower()
-# Read Secrets from ENV variable
-load_dotenv()
-REST_KEY = getenv("REST_KEY")
-GSHEET_SECRET = json.loads(getenv("GSHEET_SECRET"))
-# Read main config yaml
-_configPath = PureWindowsPath(getenv("CONFIG_PATH")) if IS_WINDOWS else getenv("CONFIG_PATH") 
-with open(_configPath, "r") as configFile:
-    CONFIG = yaml.safe_load(configFile)
-# Store config components for convenience
-# Gsheet
-_gsheetConfig = CONFIG["gsheet"]
-LEAD_SHEET_SCHEMA = _gsheetConfig["lead_sheet_schema"]
-GSHEET_ID = _gsheetConfig["sheet_id"]
-BENCHMARK_SHEETNAMES = _gsheetConfig["benchmark_sheets"].split(",")
-GSHEET_CONTROL_PANEL_NAME = _gsheetConfig["tab_names"]["control_panel"]
-GSHEET_LEAD_TABLE_NAME = _gsheetConfig["tab_names"]["leads"]
- 
-_apiConfig = CONFIG["companies_house"]
-REST_URL =_apiConfig["base_url"]
-SEARCH_URL = _apiConfig["search_url"]
-RATE = _apiConfig["rate"]
-LIMIT = _apiConfig["limit"]
-
-REQUEST_TYPES = list(CONFIG["request_types"].values())
-
-_loggerConfig = CONFIG["logger"]
-LOG_FOLDER = _loggerConfig["folder"]
-LOG_FILE_NAME = _loggerConfig["file_name"]
-LOG_FORMAT = _loggerConfig["format"]
-LOG_DB = _loggerConfig["db"]
-LOG_DB_TABLE_NAME = _loggerConfig["db_table"]
-TIMEZONE = _loggerConfig["timezone"]
-
-CACHE = CONFIG["cache"]
-
-DISCORD_CONFIG = CONFIG["discord"]
+from toolBox.config import IS_WINDOWS, ConfigError, getApiKeys, getConfig, getSecret
+# Constants below are resolved on first access (module __getattr__), so importing toolBox or any of its modules
+# does not read .env, secrets or main config yaml. Config is read, validated and cached by getConfig()
+
+# Secrets and switches from ENV variables
+_ENV_CONSTANTS = {
+    "REST_KEY": lambda: getSecret("REST_KEY"),
+    # Keys of several registered applications (comma separated REST_KEYS), each has its own rate budget
+    "REST_KEYS": getApiKeys,
+    "GSHEET_SECRET": lambda: getSecret("GSHEET_SECRET", parseJson = True),
+    # Opt-in profiling of tracker runs, same as its --profile flag
+    "PROFILE_RUN": lambda: (getSecret("TRACKER_PROFILE") or "").lower() in ("1", "true", "yes")
+}
+# Config components stored for convenience
+_CONFIG_CONSTANTS = {
+    "CONFIG": lambda c: c,
+    # Gsheet
+    "LEAD_SHEET_SCHEMA": lambda c: c["gsheet"]["lead_sheet_schema"],
+    "GSHEET_ID": lambda c: c["gsheet"]["sheet_id"],
+    "BENCHMARK_SHEETNAMES": lambda c: c["gsheet"]["benchmark_sheets"].split(","),
+    "GSHEET_CONTROL_PANEL_NAME": lambda c: c["gsheet"]["tab_names"]["control_panel"],
+    "GSHEET_LEAD_TABLE_NAME": lambda c: c["gsheet"]["tab_names"]["leads"],
+    "GSHEET_APPEND_CONFIG": lambda c: c["gsheet"]["append"],
+    # Backend the control panel is read from and leads are written to
+    "LEAD_STORE_CONFIG": lambda c: c["lead_store"],
+    # API
+    "REST_URL": lambda c: c["companies_house"]["base_url"],
+    "SEARCH_URL": lambda c: c["companies_house"]["search_url"],
+    "SEARCH_PAGE_SIZE": lambda c: c["companies_house"]["search_page_size"],
+    "OFFICERS_PAGE_SIZE": lambda c: c["companies_house"]["officers_page_size"],
+    "RATE": lambda c: c["companies_house"]["rate"],
+    "LIMIT": lambda c: c["companies_house"]["limit"],
+    "LIMITER_MODE": lambda c: c["companies_house"]["limiter_mode"],
+    "CONNECTION_CONFIG": lambda c: c["companies_house"]["connection"],
+
+    "SCHEDULER_CONFIG": lambda c: c["scheduler"],
+    "DAEMON_CONFIG": lambda c: c["daemon"],
+    "BACKFILL_CONFIG": lambda c: c["backfill"],
+
+    "REQUEST_TYPES": lambda c: list(c["request_types"].values()),
+    # Logging
+    "LOG_FOLDER": lambda c: c["logger"]["folder"],
+    "LOG_FILE_NAME": lambda c: c["logger"]["file_name"],
+    "LOG_FORMAT": lambda c: c["logger"]["format"],
+    "LOG_DB": lambda c: c["logger"]["db"],
+    "LOG_DB_TABLE_NAME": lambda c: c["logger"]["db_table"],
+    "LOG_DB_BATCH_SIZE": lambda c: c["logger"]["db_batch_size"],
+    "LOG_DB_FLUSH_INTERVAL": lambda c: c["logger"]["db_flush_interval"],
+    "PROFILE_FOLDER": lambda c: c["logger"]["profile_folder"],
+    "TIMEZONE": lambda c: c["logger"]["timezone"],
+
+    "METRICS_CONFIG": lambda c: c["metrics"],
+
+    "CACHE": lambda c: c["cache"],
+    "RETRY_QUEUE_CONFIG": lambda c: c["retry_queue"],
+    "HTTP_CACHE_CONFIG": lambda c: c["http_cache"],
+
+    "DISCORD_CONFIG": lambda c: c["discord"]
+}
+
+
+def __getattr__(name: str):
+    if name in _ENV_CONSTANTS:
+        value = _ENV_CONSTANTS[name]()
+    elif name in _CONFIG_CONSTANTS:
+        value = _CONFIG_CONSTANTS[name](getConfig())
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Cached as a regular attribute, later lookups do not come here
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    return sorted(list(globals()) + list(_ENV_CONSTANTS) + list(_CONFIG_CONSTANTS))
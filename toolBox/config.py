@@ -0,0 +1,158 @@
+import json
+from functools import lru_cache
+from os import getenv
+from sys import platform
+from typing import Union
+
+#Read platform - needed for windows-specific steps
+IS_WINDOWS = "win" in str(platform).lower()
+
+# Keys every config has to have, with the type their values need (tuples allow several types)
+_REQUIRED_KEYS = {
+    "gsheet.sheet_id": str,
+    "gsheet.benchmark_sheets": str,
+    "gsheet.tab_names.leads": str,
+    "gsheet.tab_names.control_panel": str,
+    "gsheet.lead_sheet_schema": dict,
+    "gsheet.append": dict,
+    "lead_store.backend": str,
+    "lead_store.sqlite": dict,
+    "companies_house.base_url": str,
+    "companies_house.search_url": str,
+    "companies_house.search_page_size": int,
+    "companies_house.officers_page_size": int,
+    "companies_house.rate": (int, float),
+    "companies_house.limit": int,
+    "companies_house.limiter_mode": str,
+    "companies_house.connection": dict,
+    "daemon": dict,
+    "backfill.workers": int,
+    "backfill.shard_days": int,
+    "scheduler": dict,
+    "request_types": dict,
+    "logger.file_name": str,
+    "logger.folder": str,
+    "logger.format": str,
+    "logger.timezone": str,
+    "logger.db": str,
+    "logger.db_table": str,
+    "logger.db_batch_size": int,
+    "logger.db_flush_interval": (int, float),
+    "logger.profile_folder": str,
+    "metrics.prometheus_file": str,
+    "metrics.json_file": str,
+    "cache.db": str,
+    "cache.companies_table": str,
+    "cache.retries_table": str,
+    "cache.sheet_index_table": str,
+    "retry_queue": dict,
+    "http_cache": dict,
+    "discord.webhook": str,
+    "discord.poc_1": str,
+    "discord.poc_2": str,
+    "discord.flush_interval": (int, float),
+    "discord.max_queue": int
+}
+# Keys that only take one of a few values
+# shared_token_bucket limiter is set by backfill.py itself, it only makes sense across worker processes
+_ALLOWED_VALUES = {
+    "lead_store.backend": ("gsheet", "sqlite"),
+    "companies_house.limiter_mode": ("token_bucket", "sliding_window")
+}
+
+
+class ConfigError(ValueError):
+    """
+    Raised when config or secrets are missing or invalid
+    """
+
+
+@lru_cache(maxsize = None)
+def loadEnv() -> None:
+    """
+    Reads .env to environment variables, once per process
+    """
+    # Deferred so that importing toolBox does not pay for it
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def _lookup(config: dict, dottedKey: str) -> tuple:
+    """
+    Returns (found, value) of a dotted key in nested dicts
+    """
+    value = config
+    for key in dottedKey.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return False, None
+        value = value[key]
+    return True, value
+
+
+def validateConfig(config: dict) -> list:
+    """
+    Returns list of problems found in @config, empty if it is valid
+    """
+    if not isinstance(config, dict):
+        return ["config is not a mapping"]
+    problems = []
+    for dottedKey, expected in _REQUIRED_KEYS.items():
+        found, value = _lookup(config, dottedKey)
+        if not found:
+            problems.append(f"{dottedKey} is missing")
+        # bool is an int subclass, but a flag in place of a number is a mistake
+        elif not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            typeNames = " or ".join(t.__name__ for t in (expected if isinstance(expected, tuple) else (expected,)))
+            problems.append(f"{dottedKey} should be {typeNames}, got {type(value).__name__}")
+    for dottedKey, allowed in _ALLOWED_VALUES.items():
+        found, value = _lookup(config, dottedKey)
+        if found and value not in allowed:
+            problems.append(f"{dottedKey} should be one of {allowed}, got {value}")
+    return problems
+
+
+@lru_cache(maxsize = None)
+def getConfig(path: str = None) -> dict:
+    """
+    Reads main config yaml from @path (CONFIG_PATH env variable by default) on first call, validates and caches it
+    """
+    loadEnv()
+    path = path if path is not None else getenv("CONFIG_PATH")
+    if path is None:
+        raise ConfigError("CONFIG_PATH is not set, it has to point to main config yaml")
+    if IS_WINDOWS:
+        from pathlib import PureWindowsPath
+        path = PureWindowsPath(path)
+    import yaml
+    with open(path, "r") as configFile:
+        config = yaml.safe_load(configFile)
+    problems = validateConfig(config)
+    if problems:
+        raise ConfigError(f"Invalid config {path}: " + "; ".join(problems))
+    return config
+
+
+def getSecret(name: str, parseJson: bool = False) -> Union[str, dict, None]:
+    """
+    Reads secret @name from env variables (or .env), optionally parsing it as JSON
+    """
+    loadEnv()
+    value = getenv(name)
+    if value is None or not parseJson:
+        return value
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"{name} is not valid JSON: {e}")
+
+
+def getApiKeys() -> list:
+    """
+    Reads Companies House API keys: comma separated REST_KEYS, REST_KEY if it is not set.
+    Raises ConfigError without any key, requests would go out unauthenticated otherwise
+    """
+    value = getSecret("REST_KEYS") or getSecret("REST_KEY") or ""
+    keys = [key.strip() for key in value.split(",") if key.strip()]
+    if not keys:
+        raise ConfigError("No Companies House API key configured, set REST_KEYS (comma separated) or REST_KEY")
+    return keys
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+from typing import Union
+
+
+class IntervalSchedule:
+    """
+    Cycles start every @seconds counted from the start of the previous cycle.
+    A cycle that overruns the interval is followed by the next one right away
+    """
+    def __init__(self, seconds: float) -> None:
+        if seconds <= 0:
+            raise ValueError("Interval has to be positive")
+        self.seconds = seconds
+
+    def nextRun(self, lastStart: Union[datetime, None], now: datetime) -> datetime:
+        if lastStart is None:
+            return now
+        return max(lastStart + timedelta(seconds = self.seconds), now)
+
+    def __str__(self) -> str:
+        return f"every {self.seconds} seconds"
+
+
+class CronSchedule:
+    """
+    Standard 5 field cron expression (minute hour day-of-month month day-of-week).
+    Fields take *, numbers, ranges (a-b), lists (a,b) and steps (*/n, a-b/n), day of week 0 or 7 is Sunday.
+    As in cron, a cycle runs when either day field matches if both are restricted
+    """
+    fieldRanges = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str) -> None:
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields, got '{expression}'")
+        self.expression = expression
+        parsed = [self.__parseField(field, low, high) for field, (low, high) in zip(fields, self.fieldRanges)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # Cron counts Sunday as 0 (and 7), datetime.weekday() as 6
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        self.daysRestricted = fields[2] != "*"
+        self.weekdaysRestricted = fields[4] != "*"
+
+    @staticmethod
+    def __parseField(field: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(","):
+            rangePart, _, step = part.partition("/")
+            step = int(step) if step else 1
+            if rangePart == "*":
+                start, end = low, high
+            elif "-" in rangePart:
+                start, end = (int(value) for value in rangePart.split("-", 1))
+            else:
+                start = int(rangePart)
+                end = high if step > 1 else start
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"Invalid cron field '{field}', values have to be within {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def __dayMatches(self, moment: datetime) -> bool:
+        dayOk = moment.day in self.days
+        weekdayOk = moment.weekday() in self.weekdays
+        if self.daysRestricted and self.weekdaysRestricted:
+            return dayOk or weekdayOk
+        return dayOk and weekdayOk
+
+    def nextRun(self, lastStart: Union[datetime, None], now: datetime) -> datetime:
+        """
+        First matching minute after @now, whole days and hours that cannot match are skipped
+        """
+        moment = now.replace(second = 0, microsecond = 0) + timedelta(minutes = 1)
+        limit = moment + timedelta(days = 366 * 5)
+        while moment < limit:
+            if moment.month not in self.months or not self.__dayMatches(moment):
+                moment = (moment + timedelta(days = 1)).replace(hour = 0, minute = 0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours = 1)).replace(minute = 0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes = 1)
+            else:
+                return moment
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+    def __str__(self) -> str:
+        return f"on cron '{self.expression}'"
+
+
+def createSchedule(intervalSeconds: float = None, cron: str = None) -> Union[IntervalSchedule, CronSchedule]:
+    """
+    Cron expression takes precedence over interval when both are given
+    """
+    if cron:
+        return CronSchedule(cron)
+    if intervalSeconds is None:
+        raise ValueError("Either interval or cron expression is needed")
+    return IntervalSchedule(intervalSeconds)
@@ -0,0 +1,75 @@
+import json
+from typing import List, Optional, Union
+# Optional fast decoders: msgspec decodes straight to typed structs (search items to dicts), orjson only speeds up parsing to dicts.
+# Without msgspec plain dicts are returned: building python objects from them costs more than it saves
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = "msgspec" if msgspec is not None else "orjson" if orjson is not None else "json"
+
+
+class _recordAccess:
+    """
+    Dict-like read access for typed records, so that consumers work the same with structs and plain dicts.
+    Missing and null fields both return @default
+    """
+    __slots__ = ()
+
+    def get(self, key: str, default = None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+
+if msgspec is not None:
+    class SearchPage(msgspec.Struct, _recordAccess):
+        """
+        Advanced search page. Items stay plain dicts: columns to keep come from the control panel,
+        so any field of an item has to be there, same as with the json fallback
+        """
+        hits: Optional[int] = None
+        items: Optional[List[dict]] = None
+
+    class OfficerItem(msgspec.Struct, _recordAccess):
+        name: Optional[str] = None
+        officer_role: Optional[str] = None
+
+    class OfficerPage(msgspec.Struct, _recordAccess):
+        total_results: Optional[int] = None
+        items_per_page: Optional[int] = None
+        start_index: Optional[int] = None
+        items: Optional[List[OfficerItem]] = None
+
+    _DECODERS = {
+        "search": msgspec.json.Decoder(SearchPage),
+        "officers": msgspec.json.Decoder(OfficerPage)
+    }
+    _GENERIC_DECODER = msgspec.json.Decoder()
+
+
+def _loads(raw: bytes):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def decodeResponse(raw: bytes, requestType: str) -> Union[object, dict, None]:
+    """
+    Decodes response body to a typed page of @requestType if msgspec is available, to plain dicts otherwise.
+    Returns None for empty bodies
+    """
+    if not raw or not raw.strip():
+        return None
+    if msgspec is not None:
+        decoder = _DECODERS.get(requestType, _GENERIC_DECODER)
+        return decoder.decode(raw)
+    return _loads(raw)
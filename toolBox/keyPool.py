@@ -0,0 +1,108 @@
+import asyncio
+from logging import Logger
+from time import monotonic
+from typing import Iterable, Union
+from aiohttp import BasicAuth
+from toolBox.rateLimiter import RateLimiter, createRateLimiter
+# Companies House budget is per API key (registered application), every key of the pool gets its own limiter
+
+
+class PooledKey:
+    """
+    API key of the pool with its own limiter. Key without auth means requests use auth given by the caller
+    """
+    def __init__(self, label: str, auth: Union[BasicAuth, None], limiter: RateLimiter) -> None:
+        self.label = label
+        self.auth = auth
+        self.limiter = limiter
+        self.sent = 0
+        self.throttled = 0
+
+
+class KeyPool:
+    """
+    Hands out API keys to requests: the key with most budget left is taken, so load spreads over all keys.
+    Key that got a 429 is blocked by its limiter until its window resets and is skipped meanwhile
+    """
+    def __init__(
+        self,
+        keys: Iterable,
+        rate: int,
+        limit: int,
+        logger: Logger,
+        limiterMode: str = "token_bucket",
+        sleepTimeBuffer: float = 0,
+        sharedStates: list = None) -> None:
+        self.logger = logger
+        keys = [key for key in keys if key] if keys is not None else []
+        if sharedStates is not None and len(sharedStates) != max(len(keys), 1):
+            raise ValueError(f"Got {len(sharedStates)} shared limiter states for {len(keys)} API keys")
+        # Without keys the pool holds one key using auth of the caller, so budget is tracked the same way
+        entries = [(self.maskKey(key), BasicAuth(key, "")) for key in keys] or [("default", None)]
+        self.keys = [
+            PooledKey(
+                label = label,
+                auth = auth,
+                limiter = createRateLimiter(
+                    mode = limiterMode,
+                    rate = rate,
+                    limit = limit,
+                    logger = logger,
+                    sleepTimeBuffer = sleepTimeBuffer,
+                    sharedState = sharedStates[i] if sharedStates is not None else None
+                )
+            )
+            for i, (label, auth) in enumerate(entries)
+        ]
+        self._announced = False
+
+    @staticmethod
+    def maskKey(key: str) -> str:
+        """
+        Label of @key safe to log
+        """
+        return f"...{key[-4:]}"
+
+    async def acquire(self) -> PooledKey:
+        """
+        Waits until one of the keys can send a request, takes capacity of the one with most budget left and returns it
+        """
+        while True:
+            now = monotonic()
+            waits = []
+            # Blocked keys report no budget, they are tried last and only succeed once their window has reset
+            for pooledKey in sorted(self.keys, key = lambda k: k.limiter.available(), reverse = True):
+                wait = pooledKey.limiter.tryAcquire(now)
+                if wait <= 0:
+                    pooledKey.sent += 1
+                    self._announced = False
+                    return pooledKey
+                waits.append(wait)
+            wait = min(waits)
+            # Only the first waiter of an exhausted period is logged to avoid flooding logs
+            if not self._announced and wait >= 1:
+                self.logger.warning(f"All {len(self.keys)} API keys hit RPS limit, sleeping for {round(wait, 2)} seconds")
+                self._announced = True
+            await asyncio.sleep(wait)
+
+    def release(self, pooledKey: PooledKey, headers, status: int) -> None:
+        """
+        Reports response of a request sent with @pooledKey back to its limiter (empty @headers if request failed)
+        """
+        pooledKey.limiter.syncFromHeaders(headers, status)
+        if status == 429:
+            pooledKey.throttled += 1
+            blockedFor = max(pooledKey.limiter.blockedUntil - monotonic(), 0)
+            self.logger.warning(f"API key {pooledKey.label} is out of rotation for {round(blockedFor, 2)} seconds")
+
+    def nextReadyIn(self) -> float:
+        """
+        Seconds until the first key is out of its back off
+        """
+        return max(min(pooledKey.limiter.blockedUntil for pooledKey in self.keys) - monotonic(), 0)
+
+    def stats(self) -> dict:
+        """
+        Requests sent and 429s received per key
+        """
+        return {pooledKey.label: {"sent": pooledKey.sent, "throttled": pooledKey.throttled} for pooledKey in self.keys}
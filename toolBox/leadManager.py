@@ -1,27 +1,124 @@
 import pandas as pd
 import dataset
 import aiohttp
-import asyncio
-from typing import Union
+from typing import Iterable, Union
 from logging import Logger
 from aiohttp import BasicAuth
-from datetime import datetime
+from sqlalchemy import text
+from time import perf_counter
+from datetime import date, timedelta
+from toolBox.keyPool import KeyPool
+from toolBox.scheduler import RequestScheduler
+from toolBox.searchNormaliser import SearchNormaliser
+from toolBox.decoding import decodeResponse
+from toolBox.responseCache import ResponseCache
+from toolBox.retryQueue import RetryQueue
+from toolBox.metrics import RunMetrics
+from toolBox.tracing import span, traced
 # Connector class for ratelimited requests to the API
 class Connector:
     """
     Class for ratelimiting
     """
-    def __init__(self, rate: int, limit: int, sleepTimeBuffer: int, logger: Logger, allowedRequestTypes: list):
+    def __init__(
+        self,
+        rate: int,
+        limit: int,
+        sleepTimeBuffer: int,
+        logger: Logger,
+        allowedRequestTypes: list,
+        connectionConfig: dict = None,
+        limiterMode: str = "token_bucket",
+        schedulerConfig: dict = None,
+        httpCacheConfig: dict = None,
+        apiKeys: list = None,
+        limiterStates: list = None):
         self.rate = rate
         self.limit = limit
-        self.semaphore = asyncio.Semaphore(1)
-        self.baseLimit = limit
         self.logger = logger
         self.allowedRequestTypes = allowedRequestTypes
-        # Timing variable for rate limiting
-        self.checkpoint = datetime.utcnow()
         # Buffer for rate limiting
         self.sleepTimeBuffer = sleepTimeBuffer
+        # Every API key has its own limiter, budgets are re-synced from API response headers.
+        # Without @apiKeys requests use auth passed by callers under one budget.
+        # @limiterStates are shared memory buckets of shared modes (one per key), used when several processes share budgets
+        self.keyPool = KeyPool(
+            keys = apiKeys,
+            rate = rate,
+            limit = limit,
+            logger = logger,
+            limiterMode = limiterMode,
+            sleepTimeBuffer = sleepTimeBuffer,
+            sharedStates = limiterStates
+        )
+        # Settings for the pooled session, session itself is created lazily within a running loop
+        self.connectionConfig = connectionConfig if connectionConfig is not None else {}
+        self.session = None
+        # aiohttp TraceConfigs attached to the session, e.g. to time requests in benchmarks
+        self.traceConfigs = []
+        # Worker pool settings for bulk requests
+        self.schedulerConfig = schedulerConfig if schedulerConfig is not None else {}
+        # Optional persistent cache of responses, used for conditional requests
+        self.responseCache = None
+        if httpCacheConfig is not None:
+            self.responseCache = ResponseCache(
+                db = httpCacheConfig["db"],
+                logger = logger,
+                ttl = httpCacheConfig.get("ttl", 86400),
+                maxEntries = httpCacheConfig.get("max_entries", 50000),
+                requestTypes = httpCacheConfig.get("request_types")
+            )
+
+    def __createSession(self) -> aiohttp.ClientSession:
+        """
+        Creates a long-lived session with a configured connection pool
+        """
+        connector = aiohttp.TCPConnector(
+            limit = self.connectionConfig.get("limit", 100),
+            limit_per_host = self.connectionConfig.get("limit_per_host", 20),
+            keepalive_timeout = self.connectionConfig.get("keepalive_timeout", 60),
+            ttl_dns_cache = self.connectionConfig.get("ttl_dns_cache", 600),
+            use_dns_cache = True
+        )
+        timeout = aiohttp.ClientTimeout(total = self.connectionConfig.get("request_timeout", 60))
+        self.logger.info("Opened pooled HTTP session")
+        return aiohttp.ClientSession(connector = connector, timeout = timeout, trace_configs = self.traceConfigs or None)
+
+    def getSession(self) -> aiohttp.ClientSession:
+        """
+        Returns shared session, (re)creating it if it does not exist or was closed.
+        Has to be called from within a running event loop
+        """
+        if self.session is None or self.session.closed:
+            self.session = self.__createSession()
+        return self.session
+
+    async def closeSession(self) -> None:
+        """
+        Closes shared session and releases pooled connections
+        """
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            self.logger.info("Closed pooled HTTP session")
+        self.session = None
+
+    async def close(self) -> None:
+        """
+        Releases everything the connector holds: pooled session and response cache
+        """
+        await self.closeSession()
+        if len(self.keyPool.keys) > 1:
+            self.logger.info(f"API key pool stats: {self.keyPool.stats()}")
+        if self.responseCache is not None:
+            self.responseCache.close()
+            self.responseCache = None
+
+    async def __aenter__(self):
+        self.getSession()
+        return self
+
+    async def __aexit__(self, excType, exc, tb) -> None:
+        await self.close()
 
     def __validateRequestType(self, requestType: str):
         """
@@ -33,7 +130,14 @@ class Connector:
             return None
 
     
-    def __cacheForRetry(self, url, requestType: str, toRetryList: list, companyNumber: str = None) -> Union[None, Exception]:
+    def __cacheForRetry(
+        self,
+        url,
+        requestType: str,
+        toRetryList: list,
+        companyNumber: str = None,
+        params: dict = None,
+        status: int = None) -> Union[None, Exception]:
         """
         Function for handling retry caching logic
         """
@@ -42,63 +146,29 @@ class Connector:
 
         if e is not None:
             return e
+        # Some callers (e.g. one-off requests) do not track retries
+        if toRetryList is None:
+            return None
     
-        if companyNumber is None:
-            companyNumber = ""
         toRetryList.append({
-            "url": url,
+            "url": str(url),
             "requestType": requestType,
-            "companyNumber": companyNumber
+            "companyNumber": companyNumber,
+            "params": params,
+            "status": status
         })
 
 
 
-    def __computeSleepTime(self) -> int:
-        """
-        Computes how much time has passed since last checkpoint.
-        Used to facilitate ratelimitting and handling 429
-        """
-        # Compute needed sleeptime
-        currentTs = datetime.utcnow()
-        timeAfterCheckpoit = (currentTs - self.checkpoint).seconds
-        sleepTime = self.rate - timeAfterCheckpoit + self.sleepTimeBuffer
-        return int(sleepTime)
-
-    async def __countRequest(self):
-        """
-        Facilitates ratelimitig by keeping track of how many tasks were completed and pausing if needed
-        """
-        async with self.semaphore:
-        # Check if we have tasks in the limit
-            #if self.limit._value >= int(self.baseLimit * 0.05): # This is a bit hacky, but works
-            if self.limit > 0: # This is a bit hacky, but works
-                # Consume if yes
-                self.limit -= 1
-                print(self.limit)
-                #await self.limit.acquire()
-            else:
-                # Compute needed sleeptime
-                sleepTime = self.__computeSleepTime()
-                # Log sleeping step
-                self.logger.warning(f"Hit RPS limit, sleeping for {sleepTime} seconds")
-                await asyncio.sleep(sleepTime)
-                # Assign new checkpoint to self
-                self.checkpoint = datetime.utcnow()
-                # Refresh our limit capacity
-                self.limit = self.baseLimit
-
     async def __handleOverLimit(self, url, requestType = None, companyNumber = None, toRetryList: list = None, first = True):
         """
-        Method to handle cases where we go over request limit and receive 429 from the API
+        Method to handle cases where we go over request limit and receive 429 from the API.
+        Limiter of the key knows when its window resets from the 429 headers, retry goes to another key
+        or waits for the first one to come back
         """
         if first:
-            sleepTime = self.__computeSleepTime()
-            self.logger.warning(f"Got 429 for {url}, sleeping for {sleepTime} to retry")
-            await asyncio.sleep(sleepTime)
-            # Assign new checkpoint to self
-            self.checkpoint = datetime.utcnow()
-            # Refresh our limit capacity
-            self.limit = self.baseLimit
+            waitTime = self.keyPool.nextReadyIn()
+            self.logger.warning(f"Got 429 for {url}, retrying in at least {round(waitTime, 2)} seconds")
         # If we are hitting 429 more than once, there probably is no point in sleeping more :(
         else:
             self.logger.warning(f"Saving {url} to retry cache")
@@ -106,24 +176,52 @@ class Connector:
                 url = url,
                 requestType = requestType,
                 companyNumber = companyNumber,
-                toRetryList = toRetryList
+                toRetryList = toRetryList,
+                status = 429
             )
             
             if e is not None:
                 self.logger.warning(f"Retry caching error: {e}")
     
-    def __gatherRequestStats(self, metaData: dict, requestType: str, respStatus: int) -> Union[None, KeyError]:
-        """
-        Stores data on responses in metaData dict. Mostly needed for runtime summary stats
-        """
-        try:
-            if 200<= respStatus < 300:
-                metaData[requestType]["success"].append(1)
-            else:
-                metaData[requestType]["rest"].append(1)
-        except KeyError as e:
-            self.logger.warning(f"Error when saving response to metadata dict: {e}")
-    
+    async def __limitedGet(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        auth: aiohttp.BasicAuth,
+        requestType: str,
+        metrics: RunMetrics = None,
+        params: dict = None,
+        headers: dict = None) -> tuple:
+        """
+        Sends GET request with the pooled API key that has most budget left and reports rate limit headers
+        of the response back to its limiter. @auth is only used if the pool has no keys of its own.
+        Time waited for the limiter, latency, status and size of the response are recorded to @metrics.
+        Returns status, final url, body (only read for 200) and ETag of the response
+        """
+        waitStart = perf_counter()
+        with span("limiter_wait"):
+            pooledKey = await self.keyPool.acquire()
+        auth = pooledKey.auth if pooledKey.auth is not None else auth
+        sent = perf_counter()
+        if metrics is not None:
+            metrics.observeLimiterWait(requestType, sent - waitStart)
+        with span(f"{requestType}_request"):
+            try:
+                resp = await session.get(url = url, auth = auth, params = params, headers = headers)
+            except Exception:
+                # Request did not reach the API or got no response, only release capacity accounting
+                self.keyPool.release(pooledKey, {}, 0)
+                if metrics is not None:
+                    metrics.observeRequest(requestType, 0, perf_counter() - sent)
+                raise
+            self.keyPool.release(pooledKey, resp.headers, resp.status)
+            async with resp:
+                body = await resp.read() if resp.status == 200 else None
+                if metrics is not None:
+                    nBytes = len(body) if body is not None else int(resp.headers.get("Content-Length", 0) or 0)
+                    metrics.observeRequest(requestType, resp.status, perf_counter() - sent, nBytes)
+                return resp.status, resp.url, body, resp.headers.get("ETag")
+
     async def makeRequest(
         self,
         requestType: str,
@@ -133,9 +231,11 @@ class Connector:
         toRetry: list,
         metaData: dict,
         params: dict = None,
-        companyNumber: str = None) -> None:
+        companyNumber: str = None) -> Union[object, None]:
         """
-        Async function for making http requests to company house API
+        Async function for making http requests to company house API.
+        Returns decoded response page (see toolBox.decoding) so that callers can schedule follow-up requests,
+        None if no valid data was received
         """
         e = self.__validateRequestType(requestType)
         # We stop the execution if we face an unexpected request type
@@ -144,56 +244,95 @@ class Connector:
             self.logger.error(f"Cannot make request because of unexpected type {requestType}: {e}")
             raise e
         
-        async with aiohttp.ClientSession() as session:
-            try:
-                await self.__countRequest()
-                resp = await session.get(url = url, auth = auth, params = params)
-                dataJson = await resp.json(content_type = None)
-                rUrl = resp.url
-                # Save resp status to metadata dict
-                self.__gatherRequestStats(metaData, requestType, resp.status)
-                if (status := resp.status) != 200:
-                    # If we still get 429
+        session = self.getSession()
+        # Run metadata carries the metrics of the run, one-off requests may come without them
+        metrics = metaData.get("metrics") if metaData is not None else None
+        try:
+            # Check response cache first: fresh entries cost no request, stale ones a conditional one
+            cacheKey, cached, headers = None, None, None
+            if self.responseCache is not None and self.responseCache.isCacheable(requestType):
+                cacheKey = self.responseCache.makeKey(url, params)
+                cached = self.responseCache.lookup(cacheKey)
+            if cached is not None and cached["fresh"]:
+                self.logger.info(f"Serving {cacheKey} from response cache")
+                if metrics is not None:
+                    metrics.countCacheHit(requestType)
+                return self.__saveData(decodeResponse(cached["body"], requestType), storage)
+            if cached is not None and cached["etag"] is not None:
+                headers = {"If-None-Match": cached["etag"]}
+
+            status, rUrl, body, etag = await self.__limitedGet(
+                session, url = url, auth = auth, requestType = requestType, metrics = metrics, params = params, headers = headers
+            )
+            # If we still get 429
+            if status == 429:
+                await self.__handleOverLimit(url = rUrl)
+                #Retry on the spot, limiter makes us wait for the window reset first
+                if metrics is not None:
+                    metrics.countRetry(requestType, "429_on_the_spot")
+                status, rUrl, body, etag = await self.__limitedGet(
+                    session, url = rUrl, auth = auth, requestType = requestType, metrics = metrics, headers = headers
+                )
+                if status in (200, 304):
+                    self.logger.info(f"Successful retry for {rUrl}")
+                else:
+                    self.logger.warning(f"Got {status} for {rUrl} after retry")
                     if status == 429:
-                        await self.__handleOverLimit(url = rUrl)
-                        #Retry on the spot
-                        retry = await session.get(url = rUrl, auth = auth)
-                        # Here I am repeating myself, maybe create a fancier get function?
-                        await self.__countRequest()
-                        # Save resp status to metadata dict
-                        self.__gatherRequestStats(metaData, requestType, retry.status)
-                        if (retryStatus := retry.status) == 200:
-                            self.logger.info(f"Successful retry for {rUrl}")
-                            dataJson  = await retry.json(content_type = None)
-                        else:
-                            self.logger.warning(f"Got {retryStatus} for {rUrl} after retry")
-                            if retryStatus == 429:
-                                await self.__handleOverLimit(
-                                    url = rUrl,
-                                    requestType = requestType,
-                                    companyNumber = companyNumber,
-                                    first = False,
-                                    toRetryList = toRetry
-                                )
-                #Check if data JSON is none - log this
-                if dataJson is not None:
-                    self.logger.info(f"Saving valid response from {rUrl}")
-                    if requestType == "officers":
-                        storage.append({
-                            "companyNumber": companyNumber,
-                            "data": dataJson.get("items", None)
-                        })
-                    else:
-                        storage += dataJson.get("items", None)
-            except Exception as e:
-                self.logger.warning(f"Got an error with {url}: {e}")
+                        if metrics is not None:
+                            metrics.countRetry(requestType, "429_queued")
+                        await self.__handleOverLimit(
+                            url = rUrl,
+                            requestType = requestType,
+                            companyNumber = companyNumber,
+                            first = False,
+                            toRetryList = toRetry
+                        )
+            # Server side errors are worth another try on a later run
+            if status >= 500:
+                self.logger.warning(f"Saving {rUrl} to retry cache after {status}")
+                if metrics is not None:
+                    metrics.countRetry(requestType, "5xx_queued")
+                self.__cacheForRetry(rUrl, requestType, toRetry, companyNumber = companyNumber, status = status)
+            if status == 304 and cached is not None:
+                self.responseCache.markFresh(cacheKey, etag)
+                self.logger.info(f"{rUrl} not modified, using cached response")
+                status, body = 200, cached["body"]
+            elif status == 200 and cacheKey is not None:
+                self.responseCache.store(cacheKey, body, etag)
+            #Check if data JSON is none - log this
+            dataJson = decodeResponse(body, requestType) if status == 200 else None
+            if dataJson is None:
+                self.logger.warning(f"No valid data received from {rUrl}, last status {status}")
+                return None
+            self.logger.info(f"Saving valid response from {rUrl}")
+            return self.__saveData(dataJson, storage)
+        except Exception as e:
+            self.logger.warning(f"Got an error with {url}, saving it to retry cache: {e}")
+            if metrics is not None:
+                metrics.countRetry(requestType, "error_queued")
+            self.__cacheForRetry(url, requestType, toRetry, companyNumber = companyNumber, params = params)
+            return None
 
     @staticmethod
-    async def performTasks(taskList: list) -> None:
+    def __saveData(dataJson, storage: list) -> Union[object, None]:
+        """
+        Adds response items to @storage. Requests without storage get their data saved by scheduler callbacks
         """
-        Function used for bulk sending async requests
+        if dataJson is not None and storage is not None:
+            storage += dataJson.get("items", [])
+        return dataJson
+
+    def createScheduler(self) -> RequestScheduler:
+        """
+        Creates worker pool scheduler configured for this connector
         """
-        await asyncio.gather(*taskList)
+        return RequestScheduler(
+            connector = self,
+            logger = self.logger,
+            workers = self.schedulerConfig.get("workers", 20),
+            queueSize = self.schedulerConfig.get("queue_size", 100),
+            typeLimits = self.schedulerConfig.get("type_limits")
+        )
 
 
 # Child object for having a 1 go-to entity for all lead operations
@@ -210,92 +349,350 @@ class LeadManager(Connector):
         limit: int,
         sleepTimeBuffer: int,
         logger: Logger,
-        allowedRequestTypes: list) -> None:
+        allowedRequestTypes: list,
+        connectionConfig: dict = None,
+        limiterMode: str = "token_bucket",
+        schedulerConfig: dict = None,
+        httpCacheConfig: dict = None,
+        retryConfig: dict = None,
+        apiKeys: list = None,
+        limiterStates: list = None) -> None:
 
-        super().__init__(rate, limit, sleepTimeBuffer, logger, allowedRequestTypes)
+        super().__init__(
+            rate,
+            limit,
+            sleepTimeBuffer,
+            logger,
+            allowedRequestTypes,
+            connectionConfig,
+            limiterMode,
+            schedulerConfig,
+            httpCacheConfig,
+            apiKeys,
+            limiterStates
+        )
         self.logger = logger
-        self.searchStorage = []
-        self.companyStorage = []
-        self.officerStorage = []
+        # Search pages are normalised to column buffers, see prepareSearchStorage()
+        self.searchStorage = None
+        # Column buffers of compact officer strings, pages are parsed as they arrive
+        self.officerStorage = {"company_number": [], "officer": []}
         self.toRetryList = []
+        # Claimed retry entries that failed again during this run
+        self.replayFailures = []
         self.cacheConn = dataset.connect(f"sqlite:///{cache}")
         self.cacheTable = cacheTable
         self.rertyTable = retryTable
+        self.__prepareCache()
+        retryConfig = retryConfig if retryConfig is not None else {}
+        self.retryBatchSize = retryConfig.get("batch_size", 500)
+        self.retryQueue = RetryQueue(
+            db = self.cacheConn,
+            table = retryTable,
+            logger = logger,
+            baseDelay = retryConfig.get("base_delay", 60),
+            maxDelay = retryConfig.get("max_delay", 3600),
+            maxAttempts = retryConfig.get("max_attempts", 8),
+            leaseSeconds = retryConfig.get("lease_seconds", 900)
+        )
 
-    @staticmethod
-    def __parseAddress(addressDict: dict) -> str:
+    def resetRunState(self) -> None:
         """
-        Parses company registered office address (dict) to string
+        Empties buffers filled during a run, so that a long-lived manager can run again.
+        Session, limiter state and cache connections are kept
+        """
+        self.searchStorage = None
+        self.processedSearch = None
+        self.officerStorage = {"company_number": [], "officer": []}
+        self.toRetryList = []
+        self.replayFailures = []
+
+    def __prepareCache(self) -> None:
         """
-        return ", ".join(list(addressDict.values()))
+        Switches cache db to WAL mode and makes sure tables have indexes on the columns we filter by
+        """
+        self.cacheConn.query("PRAGMA journal_mode=WAL")
+        types = self.cacheConn.types
+        companies = self.cacheConn.create_table(self.cacheTable)
+        companies.create_column("company_number", types.string)
+        companies.create_column("added_on_run_id", types.string)
+        companies.create_index(["company_number"])
+        companies.create_index(["added_on_run_id"])
+
+    def __loadTempKeys(self, tempTable: str, column: str, values: Iterable) -> None:
+        """
+        Bulk loads @values to a temp table so that they can be joined instead of inlined into SQL.
+        Temp tables live on a connection, so this has to be called within a transaction together with the query using it
+        """
+        executable = self.cacheConn.executable
+        executable.execute(text(f"CREATE TEMP TABLE IF NOT EXISTS {tempTable} ({column} TEXT PRIMARY KEY)"))
+        executable.execute(text(f"DELETE FROM {tempTable}"))
+        rows = [{"value": str(value)} for value in values]
+        if rows:
+            executable.execute(text(f"INSERT OR IGNORE INTO {tempTable} ({column}) VALUES (:value)"), rows)
+
+    def __searchPageSpec(
+        self,
+        url: str,
+        auth: BasicAuth,
+        params: dict,
+        metaData: dict,
+        startIndex: int,
+        pageSize: int,
+        storage: list = None,
+        callback = None) -> dict:
+        """
+        Builds scheduler spec for one page of advanced search results
+        """
+        pageParams = params.copy()
+        pageParams["start_index"] = startIndex
+        pageParams["size"] = pageSize
+        spec = dict(
+            url = url,
+            requestType = "search",
+            auth = auth,
+            params = pageParams,
+            storage = storage,
+            toRetry = self.toRetryList,
+            metaData = metaData
+        )
+        if callback is not None:
+            spec["callback"] = callback
+        return spec
 
     @staticmethod
-    def __parseSic(sicCodeList: list) -> str:
+    def __bisectWindow(dateFrom: date, dateTo: date) -> Union[tuple, None]:
         """
-        Converts list of sic codes to string
+        Splits incorporation date window into two halves, None if window is a single day
         """
-        return ", ".join(sicCodeList)
-    
-    def __parseSearcResults(self, colsToSave: list, runMetaData: dict) -> pd.DataFrame:
+        if dateFrom >= dateTo:
+            return None
+        middle = dateFrom + timedelta(days = (dateTo - dateFrom).days // 2)
+        return (dateFrom, middle), (middle + timedelta(days = 1), dateTo)
+
+    def __windowSpec(
+        self,
+        scheduler: RequestScheduler,
+        url: str,
+        auth: BasicAuth,
+        baseParams: dict,
+        window: tuple,
+        metaData: dict,
+        pageSize: int,
+        probe: bool = None) -> dict:
+        """
+        Builds spec for the first request of a date window search, its callback decides what happens next.
+        Windows likely to be split are probed with a one item page first, so no full page is fetched just to read hits.
+        @probe defaults to probing every window longer than a day, as there is no hit count to estimate from yet
+        """
+        dateFrom, dateTo = window
+        params = baseParams.copy()
+        params["incorporated_from"] = str(dateFrom)
+        params["incorporated_to"] = str(dateTo)
+        probe = dateFrom < dateTo if probe is None else probe
+
+        def split(hits: int) -> bool:
+            halves = self.__bisectWindow(dateFrom, dateTo) if hits > pageSize else None
+            if halves is None:
+                return False
+            # Too many hits for one page: narrower windows are cheaper than paging through the wide one.
+            # Halves expected to overflow a page again are probed, the rest gets a full page straight away
+            self.logger.info(f"{hits} hits between {dateFrom} and {dateTo}, splitting the window")
+            for half in halves:
+                scheduler.submitFollowUp(
+                    self.__windowSpec(scheduler, url, auth, baseParams, half, metaData, pageSize, probe = hits / 2 > pageSize)
+                )
+            return True
+
+        def pageThrough(hits: int, startIndex: int) -> None:
+            for index in range(startIndex, hits, pageSize):
+                scheduler.submitFollowUp(
+                    self.__searchPageSpec(url, auth, params, metaData, index, pageSize, storage = self.searchStorage)
+                )
+
+        async def planProbed(probePage: Union[object, None]) -> None:
+            if probePage is None:
+                return
+            hits = probePage.get("hits", 0)
+            if split(hits):
+                return
+            # Probe page already holds the whole window
+            if hits <= 1:
+                self.searchStorage += probePage.get("items", [])
+                return
+            pageThrough(hits, 0)
+
+        async def planWindow(firstPage: Union[object, None]) -> None:
+            if firstPage is None:
+                return
+            hits = firstPage.get("hits", 0)
+            if split(hits):
+                return
+            self.searchStorage += firstPage.get("items", [])
+            # Single day with more hits than a page fits, page through it
+            pageThrough(hits, pageSize)
+            if hits > pageSize:
+                self.logger.info(f"Scheduled {-(-hits // pageSize) - 1} more search pages for {hits} hits on {dateFrom}")
+
+        if probe:
+            return self.__searchPageSpec(url, auth, params, metaData, 0, 1, callback = planProbed)
+        # First page is not saved by makeRequest, callback saves it only if the window does not get split
+        return self.__searchPageSpec(url, auth, params, metaData, 0, pageSize, callback = planWindow)
+
+    def __searchRetrySpec(
+        self,
+        scheduler: RequestScheduler,
+        auth: BasicAuth,
+        entry: dict,
+        metaData: dict,
+        pageSize: int) -> dict:
+        """
+        Builds spec replaying a claimed search retry. First pages of a date window go through the window planner again,
+        so a window that grew since the failure still gets bisected, other pages are replayed as they are
+        """
+        params = dict(entry["params"] or {})
+        dateFrom, dateTo = params.pop("incorporated_from", None), params.pop("incorporated_to", None)
+        if int(params.get("start_index", 0)) == 0 and dateFrom is not None and dateTo is not None:
+            params.pop("start_index", None)
+            params.pop("size", None)
+            window = (date.fromisoformat(dateFrom), date.fromisoformat(dateTo))
+            spec = self.__windowSpec(scheduler, entry["url"], auth, params, window, metaData, pageSize)
+        else:
+            spec = dict(
+                url = entry["url"],
+                requestType = "search",
+                auth = auth,
+                params = entry["params"],
+                storage = self.searchStorage,
+                metaData = metaData
+            )
+        return self.__asReplay(spec, [entry])
+
+    def prepareSearchStorage(self, colsToSave: list) -> None:
+        """
+        Sets up column buffers that search pages are normalised into as they arrive
         """
-        Iterates over search results (list of dicts) and resaves it as a dataframe
+        self.searchStorage = SearchNormaliser(colsToSave)
+
+    def __parseSearcResults(self, runMetaData: dict) -> None:
+        """
+        Builds dataframe of search results from normalised column buffers
         """ 
-        #Read all data to dataframe
-        outframe = pd.DataFrame.from_records(self.searchStorage)
-        outframe = outframe[colsToSave]
-        #Apply transformations to complicated data structs in the dataframe
-        outframe["address_string"] = outframe["registered_office_address"].map(self.__parseAddress)
-        outframe["sic_codes_string"] = outframe["sic_codes"].map(self.__parseSic)
-        #Store in self
-        self.processedSearch = outframe
-        self.processedSearch.drop(columns = ["registered_office_address", "sic_codes"], inplace = True)
-        self.processedSearch["added_on_run_id"] = runMetaData["run_id"]
-        self.processedSearch["added_run_ts"] = runMetaData["run_start_ts"]
-        #TO-DO: add run id?
+        self.processedSearch = self.searchStorage.toFrame(runMetaData)
     
-    def cacheSearch(self, colsToSave: list, runMetaData: dict) -> Union[None, Exception]:
+    @traced()
+    def cacheSearch(self, runMetaData: dict) -> Union[None, Exception]:
         """
         Writes parsed search results to db
         """
         #TO-DO: exceptions handling
-        self.__parseSearcResults(colsToSave, runMetaData = runMetaData)
-        records = self.processedSearch.to_dict(orient = "records")
+        self.__parseSearcResults(runMetaData = runMetaData)
+        self.cacheCompanies(self.processedSearch)
+
+    def cacheCompanies(self, df: pd.DataFrame) -> None:
+        """
+        Writes rows of parsed search results (e.g. collected by other processes) to the cache table
+        """
+        records = df.to_dict(orient = "records")
         self.cacheConn[self.cacheTable].insert_many(records)
 
+    @traced()
     def cacheRetries(self, retryType: str) -> Union[None, Exception]:
         """
-        Write 429 request urls to cache for retries
+        Moves failed requests collected during the run to the retry queue
         """
-        #log exception?
-        #TO-DO: unite with cacheSearch?
         try:
             if (retryCnt := len(self.toRetryList)) == 0:
-                self.logger.info("No retry URLs to cache :(")
+                self.logger.info(f"No {retryType} requests to retry")
                 return
 
-            self.cacheConn[self.rertyTable].insert_many(self.toRetryList)
-            self.logger.info(f"Wrote {retryCnt} to cache")
+            self.retryQueue.pushMany(self.toRetryList)
+            self.logger.info(f"Queued {retryCnt} {retryType} requests for retry, {self.retryQueue.pendingCount()} pending in total")
             #Clean list so that it could be re-used for different type of retries
             self.toRetryList = []
             
         except Exception as e:   
             return e
 
-    def getCachedToAppend(self, existingIds: list, runMetaData: dict):
+    @traced()
+    def claimRetries(self, retryType: str) -> list:
+        """
+        Claims a batch of due retry entries of @retryType, they are replayed by streamLeads()
+        """
+        entries = self.retryQueue.claim(retryType, self.retryBatchSize)
+        self.logger.info(f"Claimed {len(entries)} {retryType} requests to retry")
+        return entries
+
+    def __asReplay(self, spec: dict, entries: list) -> dict:
+        """
+        Turns @spec into a replay of retry @entries: they are acknowledged once the request succeeds
+        and rescheduled with backoff if it fails again or raises, so failures do not go to toRetryList a second time
+        and entries are not left leased until their claim expires
+        """
+        failures = []
+        callback = spec.get("callback")
+        settled = False
+
+        def finish() -> None:
+            nonlocal settled
+            if settled:
+                return
+            settled = True
+            if failures:
+                self.retryQueue.nack(entries)
+                self.replayFailures.extend(entries)
+            else:
+                self.retryQueue.ack(entries)
+
+        async def settle(page: Union[object, None]) -> None:
+            try:
+                if callback is not None:
+                    await callback(page)
+            except Exception:
+                failures.append(spec)
+                raise
+            finally:
+                finish()
+
+        async def fail(e: Exception) -> None:
+            self.logger.warning(f"Replay of {len(entries)} retry entries for {spec.get('url')} raised: {e}")
+            failures.append(spec)
+            finish()
+
+        spec["toRetry"] = failures
+        spec["callback"] = settle
+        spec["onError"] = fail
+        return spec
+
+    def getIncompleteCompanies(self) -> set:
+        """
+        Company numbers with officer requests that failed during the run, call before cacheRetries().
+        Leads of these companies are held back in cache until their officers are fetched
+        """
+        failed = self.toRetryList + self.replayFailures
+        return {
+            entry["companyNumber"] for entry in failed
+            if entry.get("requestType") == "officers" and entry.get("companyNumber")
+        }
+
+    @traced()
+    def getCachedToAppend(self, existingIds: Iterable, runMetaData: dict):
         """
         Reads db for company entries that were searched on previous run and are not in @existingIds
         """
-        existingCompanies = [f"\'{item}\'" for item in existingIds]
-        existingCompanies = f"({','.join(existingCompanies)})"
         runId = runMetaData["run_id"]
-
-        results = self.cacheConn.query(
-            f"""
-            SELECT * FROM {self.cacheTable}
-            WHERE added_on_run_id <> :runId
-            AND company_number NOT IN {existingCompanies}
-            """, runId = runId
-        )
+        with self.cacheConn:
+            self.__loadTempKeys("sheet_company_numbers", "company_number", existingIds)
+            # Anti-join against indexed company_number instead of a NOT IN literal
+            results = list(self.cacheConn.query(
+                f"""
+                SELECT c.* FROM {self.cacheTable} c
+                WHERE c.added_on_run_id <> :runId
+                AND NOT EXISTS (
+                    SELECT 1 FROM temp.sheet_company_numbers s
+                    WHERE s.company_number = c.company_number
+                )
+                """, runId = runId
+            ))
 
         df = pd.DataFrame(results)
         try:
@@ -305,35 +702,7 @@ class LeadManager(Connector):
         return df
         #TO-DO: Exceptions handling
     
-    def __getCachedRetries(self, retryType: str):
-        """
-        Selects entries from retries cache filtered by a given type to pandas
-        """
-        try:
-            results = self.cacheConn.query(
-                f"""
-                SELECT url FROM retries
-                WHERE type = :retryType
-                """, retryType = retryType
-            )
-            return pd.DataFrame(results), None
-        except Exception as e:
-            return None, e
-    
-    def __deleteRetryEntries(self, urls: list):
-        """
-        Removes rows from retry cache
-        """
-        toDelete = [f"\'{url}\'" for url in urls]
-        toDelete = f"({','.join(toDelete)})"
-   
-        self.cacheConn.query(
-            f"""
-            DELETE FROM {self.rertyTable}
-            WHERE url IN {toDelete}
-            """
-        )
-    
+    @traced()
     def tidySearchResults(self, cacheDf: pd.DataFrame, sheetCompanyNumbers: pd.Series) -> tuple:
         """
         Merges processedSearch with cacheDf and cleans it
@@ -352,94 +721,232 @@ class LeadManager(Connector):
         except Exception as e:
             return None, e
 
-    def processRetryCache(
+    @staticmethod
+    def __parseOfficerData(officerJson: list) -> tuple:
+        """
+        Parses contents of officerList response to compact officer strings
+        """
+        try:
+            officers = [f"{officer['officer_role']}: {officer['name']}" for officer in officerJson]
+            return officers, None
+        except Exception as e:
+            return None, e
+
+    def __saveOfficerPage(self, companyNumber: str, page: dict) -> None:
+        """
+        Parses one page of officers and adds it to officerStorage, raw payload is not kept
+        """
+        officers, err = self.__parseOfficerData(page.get("items", []))
+        if err is not None:
+            self.logger.warning(f"Failed to parse officer data for company {companyNumber}. Data might be incomplete")
+            officers = []
+        # Companies without officers still get a row so that they show up in the results
+        if not officers:
+            officers = [None]
+        self.officerStorage["company_number"].extend([companyNumber] * len(officers))
+        self.officerStorage["officer"].extend(officers)
+
+    def __officerPageSaver(self, companyNumber: str):
+        """
+        Creates callback saving a single officer page
+        """
+        async def savePage(page: Union[object, None]) -> None:
+            if page is not None:
+                self.__saveOfficerPage(companyNumber, page)
+        return savePage
+
+    def __officerPageSpec(
         self,
-        retryType: str,
-        taskList: list,
+        baseUrl: str,
         auth: BasicAuth,
+        companyNumber: str,
         metaData: dict,
-        dbClean = True,
-        companyNumber: str = None,
-        taskUrlLog: list = None) -> Union[None, Exception]:
+        startIndex: int,
+        pageSize: int,
+        callback) -> dict:
+        """
+        Builds scheduler spec for one page of company officers
+        """
+        return dict(
+            url = f"{baseUrl}/company/{companyNumber}/officers",
+            requestType = "officers",
+            auth = auth,
+            params = {"start_index": startIndex, "items_per_page": pageSize},
+            storage = None,
+            toRetry = self.toRetryList,
+            companyNumber = companyNumber,
+            metaData = metaData,
+            callback = callback
+        )
+
+    def __officerPager(
+        self,
+        scheduler: RequestScheduler,
+        baseUrl: str,
+        auth: BasicAuth,
+        companyNumber: str,
+        metaData: dict,
+        pageSize: int):
         """
-        Queries urls for retrying from local DB and adds them to a list of tasks for Asyncio event loop
+        Creates callback that saves the first officer page and schedules the remaining ones
         """
-        retryFrame, err = self.__getCachedRetries(retryType = retryType)
-        if err is not None:
-            return err
-        # Handle case where we have no retries to process
-        if (cntRetries := len(retryFrame)) == 0:
-            self.logger.info("No retries to process")
-            return None
-        # Actual processing of data if we get any
-        else:
-            # This handles only two options, needs to be rewritten if we decide to do more
-            storage = self.searchStorage if retryType == "search" else self.officerStorage
-            retryLinks = retryFrame["url"].values
-            for url in retryLinks:
-                #Make sure that we don't add duplicate urls by using data from cache table
-                if taskUrlLog is None:
-                    pass
-                elif url in taskUrlLog:
-                    self.logger.info(f"Skipping {url} fromm retry cache because it was already present in task list")
-                    continue
-                taskList.append(
-                    self.makeRequest(
-                        url = url,
-                        requestType = retryType,
-                        logger = self.logger,
-                        auth = auth,
-                        storage = storage,
-                        toRetry = self.toRetryList,
-                        companyNumber = companyNumber,
-                        metaData = metaData
+        async def savePages(firstPage: Union[object, None]) -> None:
+            if firstPage is None:
+                return
+            self.__saveOfficerPage(companyNumber, firstPage)
+            totalResults = firstPage.get("total_results", 0)
+            for startIndex in range(pageSize, totalResults, pageSize):
+                scheduler.submitFollowUp(
+                    self.__officerPageSpec(
+                        baseUrl,
+                        auth,
+                        companyNumber,
+                        metaData,
+                        startIndex,
+                        pageSize,
+                        callback = self.__officerPageSaver(companyNumber)
                     )
                 )
-            self.logger.info(f"Added {cntRetries} search entries to retry from cache")
-            # Clean local db retry table so that we don't spend time on it next time
-            if dbClean:
-                self.__deleteRetryEntries(retryLinks)
-                self.logger.info("Cleaned retry entries from cache")
-            if taskUrlLog is not None:
-                del taskUrlLog
-            return None
+        return savePages
 
     @staticmethod
-    def __parseOfficerData(officerJson) -> str:
+    def __groupOfficerRetries(retryEntries: Union[Iterable, None]) -> dict:
+        pending = {}
+        for entry in retryEntries if retryEntries is not None else []:
+            pending.setdefault(entry["companyNumber"], []).append(entry)
+        return pending
+
+    def __officerFirstSpec(
+        self,
+        scheduler: RequestScheduler,
+        baseUrl: str,
+        auth: BasicAuth,
+        companyNumber: str,
+        metaData: dict,
+        pageSize: int,
+        pendingRetries: dict) -> dict:
+        """
+        Builds spec for the first officer page of a company, it settles claimed retries of that company if there are any
+        """
+        spec = self.__officerPageSpec(
+            baseUrl,
+            auth,
+            companyNumber,
+            metaData,
+            startIndex = 0,
+            pageSize = pageSize,
+            callback = self.__officerPager(scheduler, baseUrl, auth, companyNumber, metaData, pageSize)
+        )
+        if (entries := pendingRetries.pop(companyNumber, None)) is not None:
+            spec = self.__asReplay(spec, entries)
+        return spec
+
+    def __dropStaleOfficerRetries(self, pendingRetries: dict) -> None:
         """
-        Parses contents of officerList response
+        Companies that are not pending anymore (appended or removed from cache) have nowhere to put officers
         """
+        if stale := [entry for entries in pendingRetries.values() for entry in entries]:
+            self.logger.info(f"Dropping {len(stale)} officer retries of companies that are no longer pending")
+            self.retryQueue.ack(stale)
+
+    @traced()
+    async def streamLeads(
+        self,
+        searchUrl: str,
+        baseUrl: str,
+        auth: BasicAuth,
+        baseParams: dict,
+        dateFrom: date,
+        dateTo: date,
+        metaData: dict,
+        excludeIds: Iterable,
+        cachedCompanyNumbers: Iterable,
+        searchPageSize: int = 5000,
+        officersPageSize: int = 100,
+        searchRetries: Iterable = None,
+        officerRetries: Iterable = None) -> None:
+        """
+        Runs search and officer lookups on one scheduler instead of one phase after another.
+        Officers of a company are requested as soon as the search page listing it is normalised,
+        companies in @excludeIds (already on the sheet) or seen before in this run are skipped.
+        Officers of @cachedCompanyNumbers (leads held over from previous runs) are requested alongside the search.
+        Results end up in searchStorage and officerStorage.
+        Claimed @searchRetries are replayed on the same workers, @officerRetries are settled by the fresh fetch of their company;
+        companies held back after a failure come back from cache, so their officers are fetched from the first page again
+        """
+        pending = self.__groupOfficerRetries(officerRetries)
+        excluded = set(str(companyNumber) for companyNumber in excludeIds)
+        queued = set()
+        scheduler = self.createScheduler()
+
+        def queueOfficers(items: Iterable) -> None:
+            for item in items:
+                companyNumber = item.get("company_number")
+                if not companyNumber or companyNumber in excluded or companyNumber in queued:
+                    continue
+                queued.add(companyNumber)
+                scheduler.submitFollowUp(
+                    self.__officerFirstSpec(scheduler, baseUrl, auth, companyNumber, metaData, officersPageSize, pending)
+                )
+
+        self.searchStorage.onPage = queueOfficers
+        scheduler.start()
         try:
-            officers = [f"{officer['officer_role']}: {officer['name']}" for officer in officerJson]
-            officerStr = "; ".join(officers)
-            return officerStr, None
-        except Exception as e:
-            return None, e
-    
+            # Search goes first: its pages feed the officer lookups
+            await scheduler.submit(
+                self.__windowSpec(scheduler, searchUrl, auth, baseParams, (dateFrom, dateTo), metaData, searchPageSize)
+            )
+            for entry in searchRetries if searchRetries is not None else []:
+                await scheduler.submit(self.__searchRetrySpec(scheduler, auth, entry, metaData, searchPageSize))
+            queueOfficers({"company_number": companyNumber} for companyNumber in cachedCompanyNumbers)
+            await scheduler.drain()
+        finally:
+            await scheduler.stop()
+            self.searchStorage.onPage = None
+        if scheduler.failed > 0:
+            self.logger.warning(f"{scheduler.failed} search or officer requests failed")
+        self.logger.info(f"Looked up officers of {len(queued)} companies while searching")
+        self.__dropStaleOfficerRetries(pending)
+
+    @traced()
     def tidyOfficerResults(self) -> pd.DataFrame:
         """
-        Transforms list of officer dicts to a dataframe that can be convenietly joined with other company data
-        """
-        outframe = pd.DataFrame(columns = ["company_number", "company_officer_names"])
-        for entry in self.officerStorage:
-            companyNumber = entry["companyNumber"]
-            officerData, err = self.__parseOfficerData(entry["data"])
-            if err is not None:
-                self.logger.warning(f"Failed to parse officer data for company {companyNumber}. Data might be incomplete")
-            row = pd.DataFrame({
-                "company_number": [companyNumber],  "company_officer_names": [officerData]
-            })
-            outframe = pd.concat([outframe, row], ignore_index = True)
+        Transforms officer column buffers to a dataframe that can be convenietly joined with other company data.
+        Frame is built once and officer strings are joined per company with a single groupby, so cost is linear
+        """
+        officers = pd.DataFrame(self.officerStorage, columns = ["company_number", "officer"], dtype = object)
+        companies = officers["company_number"].unique()
+        outframe = (
+            officers.dropna(subset = ["officer"])
+            .groupby("company_number", sort = False)["officer"]
+            .agg("; ".join)
+            .reindex(companies, fill_value = "")
+            .rename("company_officer_names")
+            .rename_axis("company_number")
+            .reset_index()
+        )
         return outframe
 
-    def cleanCacheTable(self, cleanRetries = False):
+    @traced()
+    def cleanCacheTable(self, cleanRetries = False, keepCompanyNumbers: Iterable = None):
         """
-        Removes table from cache db
+        Removes cached companies except for @keepCompanyNumbers (leads held back for the next run)
         """
         try:
-            self.cacheConn.load_table(self.cacheTable).delete()
+            with self.cacheConn:
+                if keepCompanyNumbers:
+                    self.__loadTempKeys("kept_company_numbers", "company_number", keepCompanyNumbers)
+                    self.cacheConn.executable.execute(text(
+                        f"""
+                        DELETE FROM {self.cacheTable} WHERE company_number NOT IN (
+                            SELECT company_number FROM temp.kept_company_numbers
+                        )
+                        """
+                    ))
+                else:
+                    self.cacheConn.executable.execute(text(f"DELETE FROM {self.cacheTable}"))
             if cleanRetries:
-                self.cacheConn.load_table(self.rertyTable).delete()
+                self.retryQueue.clear()
                 self.logger.info(f"Cleaned cache!")
             return None
         except Exception as e:
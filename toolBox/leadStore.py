@@ -0,0 +1,101 @@
+import pandas as pd
+from abc import ABC, abstractmethod
+from logging import Logger
+from typing import Union
+from toolBox.sheetIndex import SheetIndex
+
+
+class LeadStore(ABC):
+    """
+    Where a run reads its inputs (control panel) from and where it writes new leads to.
+    Control panel is kept as @controlPanelSheetName + "Frame" attribute with parameter, purpose, data_type and
+    actual_input columns, parsing it is shared by all backends
+    """
+    def __init__(self, logger: Logger, controlPanelSheetName: str, leadsSheetName: str) -> None:
+        self.logger = logger
+        self.controlPanelSheetName = controlPanelSheetName
+        self.leadsSheetName = leadsSheetName
+
+    @abstractmethod
+    def prepareSeachInputs(self, sheetId: str, workSheetsToRead: list, validation = True) -> tuple:
+        """
+        Reads control panel and returns (searchParams, None) or (None, error)
+        """
+
+    @abstractmethod
+    def syncLeadIndex(self, leadIndex: SheetIndex) -> Union[None, Exception]:
+        """
+        Brings @leadIndex up to date with leads already in the store
+        """
+
+    @abstractmethod
+    def appendToSheet(self, sheetLeads: pd.Series, df: pd.DataFrame, leadIndex: SheetIndex = None) -> tuple:
+        """
+        Writes new leads and returns (appended company numbers, None) or (appended so far, error)
+        """
+
+    def close(self) -> None:
+        """
+        Releases backend resources, nothing to release by default
+        """
+
+    def _parseSearchParams(self, controlPanelFrame: pd.DataFrame) -> Union[dict, None]:
+        """
+        Function to parse control panel search params to a dict
+        """
+        try:
+            #Create base for
+            searchConfig = {"params": {}}
+            searchFrame = controlPanelFrame.query("purpose == 'search' and actual_input != ''")
+            for index, row in searchFrame.iterrows():
+                key = row["parameter"]
+                dataType = row["data_type"]
+                input = row["actual_input"]
+
+                if dataType == "list":
+                    input = ",".join(input.split(";\n"))
+                elif dataType == "int":
+                    input = int(input)
+
+                if key != "days_back":
+                    searchConfig["params"][key] = input
+                else:
+                    searchConfig[key] = input
+
+            return searchConfig, None
+        except Exception as e:
+            return None, e
+
+    def getColsToKeep(self) -> list: #Do we actualy need this?
+        """
+        Reads columns to keep from searched data
+        """
+        try:
+            searchFrame = getattr(self, f"{self.controlPanelSheetName}Frame")
+            colsStr = searchFrame.query("parameter == 'cols_to_keep'")["actual_input"].values[0]
+            cols = colsStr.split(";\n")
+            return cols, None
+        except Exception as e:
+            return None, e
+
+    @staticmethod
+    def _indexRows(companyNumbers: list, datesCreated: list) -> list:
+        """
+        Pairs company numbers with ISO incorporation dates, missing or unparsable dates become empty strings
+        """
+        datesCreated = list(datesCreated) + [""] * (len(companyNumbers) - len(datesCreated))
+        dates = pd.to_datetime(pd.Series(datesCreated[:len(companyNumbers)], dtype = object), errors = "coerce")
+        dates = dates.dt.strftime("%Y-%m-%d").fillna("")
+        return list(zip([str(number).strip() for number in companyNumbers], dates))
+
+    @staticmethod
+    def _prepareAppend(df: pd.DataFrame) -> list:
+        """
+        Converts leads to rows of values in the order they are appended (by incorporation date)
+        """
+        df["added_run_ts"] = df["added_run_ts"].astype(str)
+        df["date_of_creation"] = pd.to_datetime(df["date_of_creation"])
+        # Sort by created for convenience
+        df.sort_values(by = "date_of_creation", ascending = True, inplace = True)
+        df["date_of_creation"] = df["date_of_creation"].astype(str)
+        return df.values.tolist()
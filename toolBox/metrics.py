@@ -0,0 +1,244 @@
+import json
+import os
+from bisect import bisect_left
+from datetime import datetime
+from typing import Union
+
+# Upper bounds (seconds) of histogram buckets, the last bucket (+Inf) catches everything above
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Histogram:
+    """
+    Fixed bucket histogram: memory does not grow with the number of observations.
+    Quantiles are estimated by linear interpolation within the bucket they fall into
+    """
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram") -> None:
+        for i, cnt in enumerate(other.counts):
+            self.counts[i] += cnt
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> Union[float, None]:
+        """
+        Estimated @q quantile (0-1), None without observations. Values in the +Inf bucket are reported as the last bound
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, cnt in enumerate(self.counts):
+            if cnt and seen + cnt >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / cnt
+            seen += cnt
+        return self.buckets[-1]
+
+    def toDict(self) -> dict:
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return {"buckets": dict(zip(bounds, self.counts)), "count": self.count, "sum": round(self.sum, 6)}
+
+
+class RunMetrics:
+    """
+    Request metrics of a run, kept in run metadata and filled by Connector.
+    Everything is aggregated on the fly (counters and fixed bucket histograms keyed by request type / status),
+    so memory stays constant regardless of how many requests a run makes.
+    Exported as a Prometheus text file (for node exporter textfile collector) and as JSON
+    """
+    prefix = "companies_house"
+
+    def __init__(self, runId: str, requestTypes: list) -> None:
+        self.runId = runId
+        self.runStart = datetime.utcnow()
+        self.requestTypes = list(requestTypes)
+        # (requestType, status) -> count, status 0 stands for requests without a response (timeouts, resets)
+        self.requests = {}
+        # (requestType, status) -> Histogram of seconds from sending the request to reading its body
+        self.latency = {}
+        # requestType -> Histogram of seconds spent waiting for the rate limiter
+        self.limiterWait = {rtype: Histogram(WAIT_BUCKETS) for rtype in self.requestTypes}
+        # (requestType, reason) -> count of on the spot retries and requests queued for a later run
+        self.retries = {}
+        self.bytes = {rtype: 0 for rtype in self.requestTypes}
+        self.cacheHits = {rtype: 0 for rtype in self.requestTypes}
+
+    @staticmethod
+    def isSuccess(status: int) -> bool:
+        # 304 means our cached copy is still valid, so it counts as success
+        return 200 <= status < 300 or status == 304
+
+    def observeRequest(self, requestType: str, status: int, latency: float, nBytes: int = 0) -> None:
+        key = (requestType, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+        self.latency[key].observe(latency)
+        self.bytes[requestType] = self.bytes.get(requestType, 0) + nBytes
+
+    def observeLimiterWait(self, requestType: str, seconds: float) -> None:
+        if requestType not in self.limiterWait:
+            self.limiterWait[requestType] = Histogram(WAIT_BUCKETS)
+        self.limiterWait[requestType].observe(seconds)
+
+    def countRetry(self, requestType: str, reason: str) -> None:
+        key = (requestType, reason)
+        self.retries[key] = self.retries.get(key, 0) + 1
+
+    def countCacheHit(self, requestType: str) -> None:
+        self.cacheHits[requestType] = self.cacheHits.get(requestType, 0) + 1
+
+    def merge(self, other: "RunMetrics") -> None:
+        """
+        Adds metrics of @other (e.g. collected by another worker of the same run) to these
+        """
+        for key, cnt in other.requests.items():
+            self.requests[key] = self.requests.get(key, 0) + cnt
+        for target, source, buckets in (
+            (self.latency, other.latency, LATENCY_BUCKETS),
+            (self.limiterWait, other.limiterWait, WAIT_BUCKETS)):
+            for key, hist in source.items():
+                target.setdefault(key, Histogram(buckets)).merge(hist)
+        for key, cnt in other.retries.items():
+            self.retries[key] = self.retries.get(key, 0) + cnt
+        for rtype, cnt in other.bytes.items():
+            self.bytes[rtype] = self.bytes.get(rtype, 0) + cnt
+        for rtype, cnt in other.cacheHits.items():
+            self.cacheHits[rtype] = self.cacheHits.get(rtype, 0) + cnt
+
+    def requestCounts(self, requestType: str) -> tuple:
+        """
+        Returns (successful, other) request counts of @requestType
+        """
+        success, rest = 0, 0
+        for (rtype, status), cnt in self.requests.items():
+            if rtype != requestType:
+                continue
+            if self.isSuccess(status):
+                success += cnt
+            else:
+                rest += cnt
+        return success, rest
+
+    def typeLatency(self, requestType: str) -> Histogram:
+        """
+        Latency histogram of @requestType across all statuses
+        """
+        total = Histogram(LATENCY_BUCKETS)
+        for (rtype, status), hist in self.latency.items():
+            if rtype == requestType:
+                total.merge(hist)
+        return total
+
+    def toDict(self) -> dict:
+        return {
+            "run_id": self.runId,
+            "run_start_ts": self.runStart.isoformat(),
+            "requests": [
+                {"request_type": rtype, "status": status, "count": cnt, "latency_seconds": self.latency[(rtype, status)].toDict()}
+                for (rtype, status), cnt in sorted(self.requests.items())
+            ],
+            "limiter_wait_seconds": {rtype: hist.toDict() for rtype, hist in self.limiterWait.items()},
+            "retries": [
+                {"request_type": rtype, "reason": reason, "count": cnt}
+                for (rtype, reason), cnt in sorted(self.retries.items())
+            ],
+            "response_bytes": dict(self.bytes),
+            "cache_hits": dict(self.cacheHits)
+        }
+
+    @staticmethod
+    def __labels(**labels) -> str:
+        return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+    def __histogramLines(self, name: str, hist: Histogram, labels: dict) -> list:
+        lines = []
+        cumulative = 0
+        for bound, cnt in zip([str(bound) for bound in hist.buckets] + ["+Inf"], hist.counts):
+            cumulative += cnt
+            lines.append(f"{name}_bucket{self.__labels(**labels, le = bound)} {cumulative}")
+        lines.append(f"{name}_sum{self.__labels(**labels)} {hist.sum:.6f}")
+        lines.append(f"{name}_count{self.__labels(**labels)} {hist.count}")
+        return lines
+
+    def toPrometheus(self) -> str:
+        """
+        Metrics in Prometheus text exposition format.
+        Run id is only a label of the start timestamp, so series of other metrics stay the same across runs
+        """
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_run_start_timestamp_seconds Start of the run",
+            f"# TYPE {p}_run_start_timestamp_seconds gauge",
+            f"{p}_run_start_timestamp_seconds{self.__labels(run_id = self.runId)} {self.runStart.timestamp():.0f}",
+            f"# HELP {p}_requests_total Requests sent to the API by type and response status (0 - no response)",
+            f"# TYPE {p}_requests_total counter"
+        ]
+        for (rtype, status), cnt in sorted(self.requests.items()):
+            lines.append(f"{p}_requests_total{self.__labels(request_type = rtype, status = status)} {cnt}")
+        lines += [
+            f"# HELP {p}_request_duration_seconds Time from sending a request to reading its response",
+            f"# TYPE {p}_request_duration_seconds histogram"
+        ]
+        for (rtype, status), hist in sorted(self.latency.items()):
+            lines += self.__histogramLines(f"{p}_request_duration_seconds", hist, {"request_type": rtype, "status": status})
+        lines += [
+            f"# HELP {p}_limiter_wait_seconds Time requests spent waiting for the rate limiter",
+            f"# TYPE {p}_limiter_wait_seconds histogram"
+        ]
+        for rtype, hist in sorted(self.limiterWait.items()):
+            lines += self.__histogramLines(f"{p}_limiter_wait_seconds", hist, {"request_type": rtype})
+        lines += [
+            f"# HELP {p}_retries_total Requests retried on the spot or queued for a later run, by reason",
+            f"# TYPE {p}_retries_total counter"
+        ]
+        for (rtype, reason), cnt in sorted(self.retries.items()):
+            lines.append(f"{p}_retries_total{self.__labels(request_type = rtype, reason = reason)} {cnt}")
+        lines += [
+            f"# HELP {p}_response_bytes_total Bytes of response bodies received",
+            f"# TYPE {p}_response_bytes_total counter"
+        ]
+        for rtype, cnt in sorted(self.bytes.items()):
+            lines.append(f"{p}_response_bytes_total{self.__labels(request_type = rtype)} {cnt}")
+        lines += [
+            f"# HELP {p}_response_cache_hits_total Requests served from the response cache without calling the API",
+            f"# TYPE {p}_response_cache_hits_total counter"
+        ]
+        for rtype, cnt in sorted(self.cacheHits.items()):
+            lines.append(f"{p}_response_cache_hits_total{self.__labels(request_type = rtype)} {cnt}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def __writeAtomically(path: str, content: str) -> None:
+        # Collectors may read the file at any time, so it is replaced in one step
+        tmpPath = f"{path}.tmp"
+        with open(tmpPath, "w") as file:
+            file.write(content)
+        os.replace(tmpPath, path)
+
+    def export(self, promPath: str = None, jsonPath: str = None) -> Union[None, Exception]:
+        """
+        Writes metrics to a Prometheus text file at @promPath and/or a JSON file at @jsonPath
+        """
+        try:
+            if promPath is not None:
+                self.__writeAtomically(promPath, self.toPrometheus())
+            if jsonPath is not None:
+                self.__writeAtomically(jsonPath, json.dumps(self.toDict(), indent = 2))
+            return None
+        except Exception as e:
+            return e
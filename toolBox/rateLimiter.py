@@ -0,0 +1,269 @@
+import multiprocessing
+from collections import deque
+from logging import Logger
+from time import monotonic, time
+from typing import Union
+# Companies House rate limiting doc: https://developer-specs.company-information.service.gov.uk/guides/rateLimiting
+
+class RateLimiter:
+    """
+    Base class for rate limiters, waiting on them is left to the caller (see KeyPool.acquire()).
+    Children implement _tryConsume() which either takes capacity (returns 0) or returns seconds to wait.
+    No lock is used: asyncio is single threaded and _tryConsume() never awaits, so check + consume is atomic
+    """
+    def __init__(self, rate: int, limit: int, logger: Logger, sleepTimeBuffer: float = 0) -> None:
+        self.rate = rate
+        self.limit = limit
+        self.logger = logger
+        self.sleepTimeBuffer = sleepTimeBuffer
+        # Monotonic ts before which nobody is allowed to send requests (server told us to back off)
+        self.blockedUntil = 0.0
+        # Requests that took capacity but did not report back response headers yet
+        self.pending = 0
+
+    def _tryConsume(self, now: float) -> float:
+        raise NotImplementedError
+
+    def _resetBudget(self, remaining: int, resetIn: Union[float, None], now: float) -> None:
+        raise NotImplementedError
+
+    def available(self) -> float:
+        """
+        Approximate number of requests that can be sent right now
+        """
+        raise NotImplementedError
+
+    def tryAcquire(self, now: float) -> float:
+        """
+        Takes capacity for a request if there is some without waiting, returns 0 on success or seconds to wait
+        """
+        if now < self.blockedUntil:
+            return self.blockedUntil - now
+        wait = self._tryConsume(now)
+        if wait <= 0:
+            self.pending += 1
+        return wait
+
+    @staticmethod
+    def _readNumber(headers, key: str) -> Union[float, None]:
+        """
+        Reads numeric header value, None if missing or malformed
+        """
+        value = headers.get(key)
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def syncFromHeaders(self, headers, status: int) -> None:
+        """
+        Re-syncs local budget with the one reported by the API.
+        Has to be called once per successful tryAcquire() with response headers (or empty dict if request failed)
+        """
+        self.pending = max(self.pending - 1, 0)
+        now = monotonic()
+        remaining = self._readNumber(headers, "X-Ratelimit-Remain")
+        reset = self._readNumber(headers, "X-Ratelimit-Reset")
+        retryAfter = self._readNumber(headers, "Retry-After")
+        # Reset header is a unix timestamp of the window end
+        resetIn = max(reset - time(), 0) if reset is not None else None
+
+        if status == 429:
+            if retryAfter is not None:
+                backOff = retryAfter
+            elif resetIn is not None:
+                backOff = resetIn
+            else:
+                backOff = self.rate
+            self.blockedUntil = max(self.blockedUntil, now + backOff + self.sleepTimeBuffer)
+            self._resetBudget(0, backOff, now)
+            return
+
+        if remaining is not None:
+            # Requests still in flight were already counted by us, but not by the API response we are reading
+            self._resetBudget(max(int(remaining) - self.pending, 0), resetIn, now)
+            if remaining <= 0 and resetIn is not None:
+                self.blockedUntil = max(self.blockedUntil, now + resetIn + self.sleepTimeBuffer)
+
+
+class TokenBucketLimiter(RateLimiter):
+    """
+    Bucket of @limit tokens refilled continuously at @limit / @rate tokens per second
+    """
+    def __init__(self, rate: int, limit: int, logger: Logger, sleepTimeBuffer: float = 0) -> None:
+        super().__init__(rate, limit, logger, sleepTimeBuffer)
+        self.tokens = float(limit)
+        self.refillRate = limit / rate
+        self.lastRefill = monotonic()
+        # Window end reported by the API: full budget is available again after it
+        self.windowResetAt = None
+
+    def _refill(self, now: float) -> None:
+        if self.windowResetAt is not None and now >= self.windowResetAt:
+            self.tokens = float(self.limit)
+            self.windowResetAt = None
+        else:
+            self.tokens = min(self.limit, self.tokens + (now - self.lastRefill) * self.refillRate)
+        self.lastRefill = now
+
+    def _tryConsume(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.refillRate
+
+    def _resetBudget(self, remaining: int, resetIn: Union[float, None], now: float) -> None:
+        self._refill(now)
+        self.tokens = float(min(remaining, self.limit))
+        if resetIn is not None:
+            self.windowResetAt = now + resetIn
+
+    def available(self) -> float:
+        now = monotonic()
+        if now < self.blockedUntil:
+            return 0
+        self._refill(now)
+        return self.tokens
+
+
+class SlidingWindowLimiter(RateLimiter):
+    """
+    Allows at most @limit requests within any @rate seconds long window
+    """
+    def __init__(self, rate: int, limit: int, logger: Logger, sleepTimeBuffer: float = 0) -> None:
+        super().__init__(rate, limit, logger, sleepTimeBuffer)
+        self.sent = deque()
+
+    def _evict(self, now: float) -> None:
+        while self.sent and self.sent[0] <= now - self.rate:
+            self.sent.popleft()
+
+    def _tryConsume(self, now: float) -> float:
+        self._evict(now)
+        if len(self.sent) < self.limit:
+            self.sent.append(now)
+            return 0
+        return self.sent[0] + self.rate - now
+
+    def _resetBudget(self, remaining: int, resetIn: Union[float, None], now: float) -> None:
+        self._evict(now)
+        used = self.limit - min(remaining, self.limit)
+        # Drop our oldest timestamps if the API says we have more budget than we think
+        while len(self.sent) > used:
+            self.sent.popleft()
+        # Pad with timestamps expiring at the API window reset if the API says we have less
+        if len(self.sent) < used:
+            expiresAt = now + resetIn - self.rate if resetIn is not None else now
+            self.sent = deque(sorted([*self.sent, *[expiresAt] * (used - len(self.sent))]))
+
+    def available(self) -> float:
+        now = monotonic()
+        if now < self.blockedUntil:
+            return 0
+        self._evict(now)
+        return self.limit - len(self.sent)
+
+
+def _sharedSlot(index: int) -> property:
+    """
+    Attribute kept in slot @index of the shared state array of a limiter
+    """
+    def getter(self) -> float:
+        return self.state[index]
+
+    def setter(self, value: float) -> None:
+        self.state[index] = value
+    return property(getter, setter)
+
+
+class SharedTokenBucketLimiter(TokenBucketLimiter):
+    """
+    Token bucket shared by several processes (e.g. shards of a backfill) so that together they stay within one budget.
+    Bucket lives in shared memory created by createState() in the parent process and handed to children on start,
+    every read-modify-write of it happens under its lock, which is never held across an await.
+    Monotonic clock is system wide, so timestamps of different processes are comparable
+    """
+    # Slots of the shared state array
+    __TOKENS, __LAST_REFILL, __WINDOW_RESET_AT, __BLOCKED_UNTIL, __PENDING = range(5)
+
+    def __init__(self, rate: int, limit: int, logger: Logger, sleepTimeBuffer: float = 0, state = None) -> None:
+        # Parents are not initialised on purpose: they would reset the bucket other processes are using
+        self.rate = rate
+        self.limit = limit
+        self.logger = logger
+        self.sleepTimeBuffer = sleepTimeBuffer
+        self.refillRate = limit / rate
+        self.state = state if state is not None else self.createState(limit)
+        self.lock = self.state.get_lock()
+
+    @staticmethod
+    def createState(limit: int, context = None):
+        """
+        Allocates shared bucket, has to be created before child processes start and passed to them.
+        @context is the multiprocessing context children are started with (default one if not given)
+        """
+        context = context if context is not None else multiprocessing
+        return context.Array("d", [float(limit), monotonic(), -1.0, 0.0, 0.0])
+
+    tokens = _sharedSlot(__TOKENS)
+    lastRefill = _sharedSlot(__LAST_REFILL)
+    pending = _sharedSlot(__PENDING)
+
+    @property
+    def windowResetAt(self) -> Union[float, None]:
+        value = self.state[self.__WINDOW_RESET_AT]
+        return None if value < 0 else value
+
+    @windowResetAt.setter
+    def windowResetAt(self, value: Union[float, None]) -> None:
+        self.state[self.__WINDOW_RESET_AT] = -1.0 if value is None else value
+
+    @property
+    def blockedUntil(self) -> float:
+        return self.state[self.__BLOCKED_UNTIL]
+
+    @blockedUntil.setter
+    def blockedUntil(self, value: float) -> None:
+        # Only moves forward, a process must not lift a back off another one was told about
+        self.state[self.__BLOCKED_UNTIL] = max(self.state[self.__BLOCKED_UNTIL], value)
+
+    def _resetBudget(self, remaining: int, resetIn: Union[float, None], now: float) -> None:
+        # Processes read their responses out of order, a late one reports budget other processes already used.
+        # Within one API window the reported budget only goes down, so a higher value is stale
+        sameWindow = resetIn is not None and self.windowResetAt is not None and abs(now + resetIn - self.windowResetAt) < 1
+        if sameWindow:
+            self._refill(now)
+            remaining = min(remaining, self.tokens)
+        super()._resetBudget(remaining, resetIn, now)
+
+    def tryAcquire(self, now: float) -> float:
+        with self.lock:
+            return super().tryAcquire(now)
+
+    def syncFromHeaders(self, headers, status: int) -> None:
+        with self.lock:
+            super().syncFromHeaders(headers, status)
+
+    def available(self) -> float:
+        with self.lock:
+            return super().available()
+
+
+LIMITER_MODES = {
+    "token_bucket": TokenBucketLimiter,
+    "sliding_window": SlidingWindowLimiter,
+    "shared_token_bucket": SharedTokenBucketLimiter
+}
+
+def createRateLimiter(mode: str, rate: int, limit: int, logger: Logger, sleepTimeBuffer: float = 0, sharedState = None) -> RateLimiter:
+    """
+    Instantiates limiter of a given mode, @sharedState (see SharedTokenBucketLimiter.createState) is only used by shared modes
+    """
+    if mode not in LIMITER_MODES:
+        raise ValueError(f"Rate limiter mode needs to be in {list(LIMITER_MODES)}")
+    if mode == "shared_token_bucket":
+        return SharedTokenBucketLimiter(rate = rate, limit = limit, logger = logger, sleepTimeBuffer = sleepTimeBuffer, state = sharedState)
+    return LIMITER_MODES[mode](rate = rate, limit = limit, logger = logger, sleepTimeBuffer = sleepTimeBuffer)
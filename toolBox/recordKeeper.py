@@ -1,8 +1,13 @@
 # Using simplequeue bc we do not need task tracking when doing logging
 import requests
 import logging
-import dataset
+import re
+import sqlite3
+import sys
+import threading
 from datetime import datetime
+from queue import Empty, Full, Queue
+from time import monotonic, sleep
 from retry import retry
 from requests import RequestException
 from logging import (
@@ -16,21 +21,72 @@ from logging import (
 # Inspiration for discord handler: https://pypi.org/project/python-logging-discord-handler/
 # Discord markdown doc: https://support.discord.com/hc/en-us/articles/210298617-Markdown-Text-101-Chat-Formatting-Bold-Italic-Underline-
 
+def _reportHandlerError(handler: Handler, message: str) -> None:
+    """
+    Reports a failure of @handler itself to stderr, the way logging.Handler.handleError() does:
+    it cannot be logged through the pipeline that failed, and it is silent when logging.raiseExceptions is off
+    """
+    if logging.raiseExceptions and sys.stderr:
+        try:
+            sys.stderr.write(f"--- Logging error in {type(handler).__name__} ---\n{message}\n")
+        except Exception:
+            pass
+
+
 class dbHandler(Handler):
     """
-    Custom handler that will be used to write logs to an sqlite db
+    Custom handler that will be used to write logs to an sqlite db.
+    Records are buffered and written with one prepared statement per batch inside a single transaction,
+    a batch is flushed once it has @batchSize records, when @flushInterval seconds passed since the last flush and on close.
+    If the db cannot be written to, records are kept up to @maxBuffer and the oldest ones are dropped beyond that
     """
-    def __init__(self, db: str, table: str, runId: str) -> None:
+    def __init__(
+        self,
+        db: str,
+        table: str,
+        runId: str,
+        batchSize: int = 500,
+        flushInterval: float = 5,
+        maxBuffer: int = 50000) -> None:
         # Inherit from parent
         super().__init__()
-        # Connect to the database
-        self.db = dataset.connect(f"sqlite:///{db}")
+        # Connect to the database, connection is shared by the listener thread and the periodic flusher
+        self.db = sqlite3.connect(db, check_same_thread = False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
         # Store table name & run id in self for further use
         self.table = table
         self.runId = runId
-        
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.maxBuffer = maxBuffer
+        self.buffer = []
+        # Counters reported on close
+        self.stats = dict(flushed = 0, batches = 0, dropped = 0)
+        with self.db:
+            self.db.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    record_message TEXT,
+                    record_function TEXT,
+                    record_level TEXT,
+                    record_created DATETIME,
+                    run_id TEXT
+                )
+                """
+            )
+        # Same statement text for every batch, so sqlite reuses the prepared statement
+        self.insertStatement = (
+            f"INSERT INTO {self.table} (record_message, record_function, record_level, record_created, run_id) "
+            "VALUES (?, ?, ?, ?, ?)"
+        )
+        # Flushes records of quiet periods, when nothing triggers a size based flush
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target = self._flushPeriodically, name = "dbHandlerFlusher", daemon = True)
+        self.flusher.start()
 
-    def _prepareRecord(self, record: LogRecord):
+    def _prepareRecord(self, record: LogRecord) -> tuple:
         """
         Prepares log record to be inserted to a database
         """
@@ -38,32 +94,97 @@ class dbHandler(Handler):
         recordFunc = record.funcName
         recordLevel = record.levelname
         # Transform created time to a more readable format
-        recordCreated = datetime.utcfromtimestamp(record.created)
-
-        # Prepare a dict to add to db
-        row = dict(
-            record_message = recordMessage,
-            record_function = recordFunc,
-            record_level = recordLevel,
-            record_created = recordCreated,
-            run_id = self.runId
-        )
-        return row
-    
-    def handle(self, record):
+        recordCreated = str(datetime.utcfromtimestamp(record.created))
+        # Values in the order of insertStatement columns
+        return (recordMessage, recordFunc, recordLevel, recordCreated, self.runId)
+
+    def emit(self, record: LogRecord) -> None:
+        """
+        Adds record to the buffer, writes the buffer to db once it is full
+        """
+        try:
+            self.buffer.append(self._prepareRecord(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.batchSize:
+            self._flushBuffer()
+
+    def _flushBuffer(self) -> None:
+        """
+        Writes buffered rows in one transaction, caller has to hold the handler lock
+        """
+        if not self.buffer:
+            return
+        try:
+            with self.db:
+                self.db.executemany(self.insertStatement, self.buffer)
+        except sqlite3.Error as e:
+            # Keep rows for the next attempt (e.g. db locked), but do not let the buffer grow without bounds
+            if (overflow := len(self.buffer) - self.maxBuffer) > 0:
+                del self.buffer[:overflow]
+                self.stats["dropped"] += overflow
+            _reportHandlerError(self, f"Error writing logs to db, {len(self.buffer)} records kept for the next flush: {e}")
+            return
+        self.stats["flushed"] += len(self.buffer)
+        self.stats["batches"] += 1
+        self.buffer = []
+
+    def flush(self) -> None:
+        """
+        Writes all buffered records to db
+        """
+        self.acquire()
+        try:
+            self._flushBuffer()
+        finally:
+            self.release()
+
+    def _flushPeriodically(self) -> None:
+        while not self.closed.wait(self.flushInterval):
+            self.flush()
+
+    def close(self) -> None:
         """
-        Reads record instance to a dict and writes this dict to db
+        Stops periodic flushing, writes remaining records and a summary of written and dropped records
         """
-        # We firstly prepare our record
-        row = self._prepareRecord(record)
-        # Insert data to db
-        self.db.get_table(self.table).insert(row)
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.flusher.join()
+        self.acquire()
+        try:
+            self._flushBuffer()
+            # Whatever could not be written by now is lost
+            self.stats["dropped"] += len(self.buffer)
+            self.buffer = []
+            summary = (
+                f"Log handler wrote {self.stats['flushed']} records in {self.stats['batches']} batches, "
+                f"dropped {self.stats['dropped']}"
+            )
+            self.buffer.append((summary, "close", "INFO", str(datetime.utcnow()), self.runId))
+            self._flushBuffer()
+            self.db.close()
+        finally:
+            self.release()
+        super().close()
 
 class discordHandler(Handler):
     """
-    Custom handler to send logs to Discord
+    Custom handler to send logs to Discord.
+    emit() only puts records on a queue, a background thread collects them for @flushInterval seconds,
+    collapses repeated warnings into one line with a count and sends as few messages as the character limit allows.
+    Sender waits out Discord rate limits reported in response headers
     """
-    def __init__(self, webhook: str, poc1: str, poc2: str, runId: str, maxChars: int = 2000) -> None:
+    def __init__(
+        self,
+        webhook: str,
+        poc1: str,
+        poc2: str,
+        runId: str,
+        maxChars: int = 2000,
+        flushInterval: float = 5,
+        maxQueue: int = 1000) -> None:
         # Inherit from parent class
         super().__init__()
         # Create session for requests
@@ -76,8 +197,17 @@ class discordHandler(Handler):
         self.poc1 = poc1
         self.poc2 = poc2
         self.runId = runId
+        self.flushInterval = flushInterval
         # Set level: we only want warning+ to go to discord
         self.setLevel(logging.WARNING)
+        # Records waiting for the sender, bounded so that an unreachable webhook cannot eat memory
+        self.records = Queue(maxsize = maxQueue)
+        self.dropped = 0
+        # Monotonic time until which Discord asked us not to post
+        self.blockedUntil = 0
+        self.closed = threading.Event()
+        self.sender = threading.Thread(target = self._sendLoop, name = "discordHandlerSender", daemon = True)
+        self.sender.start()
     
     @staticmethod
     def _formatLevel(record: LogRecord, wrapperString = ":warning:") -> str:
@@ -97,61 +227,134 @@ class discordHandler(Handler):
         
         return recordLevel
 
-    def _truncateMessage(self, message: str) -> str:
+    def _truncateMessage(self, message: str, maxChars: int = None) -> str:
         """
         Truncates message to fit in within the Discord character limit
         """
-        message = message[:self.maxChars + 1]
+        maxChars = self.maxChars if maxChars is None else maxChars
+        message = message[:maxChars]
         return message
 
-    def _prepareMessage(self, record: LogRecord) -> str:
+    @staticmethod
+    def _dedupeKey(record: LogRecord) -> tuple:
         """
-        Method for preparing a discord message from the record object
+        Records differing only in numbers (wait times, urls with company numbers) count as the same warning
         """
-        # Get message attributes from the record
-        recordMessage = record.getMessage()
-        recordFunc = record.funcName
-        recordLevelFormatted = self._formatLevel(record)
-        # Compose final message
-        fullMessage = f"<@{self.poc1}>\n<@{self.poc2}>\nRun: {self.runId}.\n{recordLevelFormatted} IN {recordFunc}(). Details: {recordMessage}"
-        # Truncate message
-        fullMessage = self._truncateMessage(fullMessage)
-        
-        return fullMessage
+        return record.levelno, record.funcName, re.sub(r"\d+", "#", record.getMessage())
+
+    def _prepareLines(self, records: list) -> list:
+        """
+        Collapses repeated records and formats one line per distinct warning, latest occurrence is shown
+        """
+        grouped = {}
+        for record in records:
+            key = self._dedupeKey(record)
+            _, count = grouped.get(key, (None, 0))
+            grouped[key] = (record, count + 1)
+        lines = []
+        for record, count in grouped.values():
+            line = f"{self._formatLevel(record)} IN {record.funcName}(). Details: {record.getMessage()}"
+            if count > 1:
+                line += f" (x{count})"
+            lines.append(line)
+        if self.dropped > 0:
+            lines.append(f"{self.dropped} more records were dropped, alert queue was full")
+            self.dropped = 0
+        return lines
 
-    def _prepareContents(self, record: LogRecord) -> dict:
+    def _prepareMessages(self, records: list) -> list:
         """
-        Prepare content that can be sent to Discord Webhook
+        Packs lines of @records into as few messages as the character limit allows, every message gets the header
         """
-        fullMessage = self._prepareMessage(record)
+        header = f"<@{self.poc1}>\n<@{self.poc2}>\nRun: {self.runId}."
+        messages, current = [], header
+        for line in self._prepareLines(records):
+            line = self._truncateMessage(line, self.maxChars - len(header) - 1)
+            if len(current) + 1 + len(line) > self.maxChars:
+                messages.append(current)
+                current = header
+            current = f"{current}\n{line}"
+        if current != header:
+            messages.append(current)
+        return messages
 
-        payload = {
-            "content": fullMessage
-        }
+    def _syncRateLimit(self, resp: requests.Response) -> None:
+        """
+        Reads Discord rate limit headers: https://discord.com/developers/docs/topics/rate-limits
+        """
+        headers = resp.headers
+        waitTime = 0
+        if resp.status_code == 429:
+            waitTime = float(headers.get("Retry-After", 1))
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            waitTime = float(headers.get("X-RateLimit-Reset-After", 1))
+        if waitTime > 0:
+            self.blockedUntil = max(self.blockedUntil, monotonic() + waitTime)
 
-        return payload
-    
     # Using retry decorator to force sending warnings and error to Discord
     @retry(exceptions = RequestException, tries = 10, delay = 1, jitter = (1, 3))
-    def sendToDiscord(self, record: LogRecord):
+    def sendToDiscord(self, content: str, maxTries: int = 5):
         """
-        Uses other other methods as building blocks to send a log record to Discord as string
+        Posts one message to the webhook, waiting for the rate limit window if Discord asked us to
         """
-        data = self._prepareContents(record)
-        resp = self.sesh.post(url = self.webhook, data = data)
+        for _ in range(maxTries):
+            if (waitTime := self.blockedUntil - monotonic()) > 0:
+                sleep(waitTime)
+            resp = self.sesh.post(url = self.webhook, data = {"content": content}, timeout = 10)
+            self._syncRateLimit(resp)
+            if resp.status_code != 429:
+                break
         # Check if we want to retry
         if not 200 <= resp.status_code < 300:
-            print("Error sending logs to discord :(")
-            
-        
+            _reportHandlerError(self, f"Error sending logs to discord :( status {resp.status_code}")
+
+    def _collectBatch(self) -> list:
+        """
+        Waits for a record, then keeps collecting records for flushInterval seconds (less when closing)
+        """
+        try:
+            records = [self.records.get(timeout = 0.5)]
+        except Empty:
+            return []
+        deadline = monotonic() + self.flushInterval
+        while not self.closed.is_set() and (waitTime := deadline - monotonic()) > 0:
+            try:
+                records.append(self.records.get(timeout = min(waitTime, 0.5)))
+            except Empty:
+                pass
+        while True:
+            try:
+                records.append(self.records.get_nowait())
+            except Empty:
+                return records
+
+    def _sendLoop(self) -> None:
+        while not (self.closed.is_set() and self.records.empty()):
+            records = self._collectBatch()
+            for content in self._prepareMessages(records) if records else []:
+                try:
+                    self.sendToDiscord(content)
+                except Exception as e:
+                    _reportHandlerError(self, f"Error sending logs to discord :( {e}")
+
+    def emit(self, record: LogRecord) -> None:
+        """
+        Queues record for the background sender, never blocks the caller
+        """
+        try:
+            self.records.put_nowait(record)
+        except Full:
+            self.dropped += 1
 
-    def handle(self, record: LogRecord):
+    def close(self) -> None:
         """
-        Calls sendToDiscord to produce a discord message
+        Sends what is still queued and stops the sender
         """
-        self.sendToDiscord(record)
+        if not self.closed.is_set():
+            self.closed.set()
+            self.sender.join(timeout = 30)
+        super().close()
 
-#The above works in a sync fashion, try to make it async using top level api, then try lower levels, tbd if needed, we use queues for logging anyways
             
 
     
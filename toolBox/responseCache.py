@@ -0,0 +1,124 @@
+import sqlite3
+from logging import Logger
+from time import time
+from typing import Union
+from urllib.parse import urlencode
+
+
+class ResponseCache:
+    """
+    Persistent sqlite cache of API response bodies keyed by url.
+    Fresh entries (younger than @ttl) are served without a request, stale ones are revalidated with If-None-Match.
+    Least recently used entries are evicted once there are more than @maxEntries
+    """
+    def __init__(
+        self,
+        db: str,
+        logger: Logger,
+        ttl: int = 86400,
+        maxEntries: int = 50000,
+        requestTypes: list = None,
+        evictEvery: int = 500) -> None:
+        self.logger = logger
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.requestTypes = requestTypes if requestTypes is not None else []
+        self.evictEvery = evictEvery
+        self.conn = sqlite3.connect(db, check_same_thread = False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    etag TEXT,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.storesSinceEviction = 0
+        # Counters for run summary
+        self.stats = dict(fresh = 0, revalidated = 0, stored = 0, evicted = 0)
+
+    def isCacheable(self, requestType: str) -> bool:
+        return requestType in self.requestTypes
+
+    @staticmethod
+    def makeKey(url: str, params: dict = None) -> str:
+        """
+        Builds cache key from url and params, params are sorted so that their order does not matter
+        """
+        if not params:
+            return str(url)
+        return f"{url}?{urlencode(sorted((str(k), str(v)) for k, v in params.items()))}"
+
+    def lookup(self, key: str) -> Union[dict, None]:
+        """
+        Returns cached entry for @key and marks it as recently used, None if there is no entry
+        """
+        row = self.conn.execute(
+            "SELECT body, etag, fetched_at FROM responses WHERE url = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (time(), key))
+        body, etag, fetchedAt = row
+        fresh = time() - fetchedAt < self.ttl
+        if fresh:
+            self.stats["fresh"] += 1
+        return dict(body = body, etag = etag, fresh = fresh)
+
+    def markFresh(self, key: str, etag: str = None) -> None:
+        """
+        Restarts ttl of an entry the API confirmed to be unchanged (304)
+        """
+        now = time()
+        with self.conn:
+            self.conn.execute(
+                "UPDATE responses SET fetched_at = ?, accessed_at = ?, etag = COALESCE(?, etag) WHERE url = ?",
+                (now, now, etag, key)
+            )
+        self.stats["revalidated"] += 1
+
+    def store(self, key: str, body: bytes, etag: str = None) -> None:
+        """
+        Saves response body, replacing older entry for the same key
+        """
+        now = time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (url, body, etag, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, body, etag, now, now)
+            )
+        self.stats["stored"] += 1
+        self.storesSinceEviction += 1
+        if self.storesSinceEviction >= self.evictEvery:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes least recently used entries above @maxEntries
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                """
+                DELETE FROM responses WHERE url IN (
+                    SELECT url FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.maxEntries,)
+            )
+        self.storesSinceEviction = 0
+        if cursor.rowcount > 0:
+            self.stats["evicted"] += cursor.rowcount
+            self.logger.info(f"Evicted {cursor.rowcount} entries from response cache")
+
+    def close(self) -> None:
+        self.evict()
+        self.conn.close()
+        self.logger.info(f"Response cache stats: {self.stats}")
@@ -0,0 +1,208 @@
+import json
+import dataset
+from logging import Logger
+from random import uniform
+from sqlalchemy import text
+from time import time
+from typing import Iterable
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+from uuid import uuid4
+
+
+class RetryQueue:
+    """
+    Durable queue of failed requests kept in the cache db.
+    Entries are claimed in batches by a run, acknowledged when replayed successfully
+    and rescheduled with exponential backoff + jitter otherwise. Entries failing @maxAttempts times are dropped
+    """
+    def __init__(
+        self,
+        db: dataset.Database,
+        table: str,
+        logger: Logger,
+        baseDelay: float = 60,
+        maxDelay: float = 3600,
+        maxAttempts: int = 8,
+        leaseSeconds: float = 900) -> None:
+        self.db = db
+        self.table = table
+        self.logger = logger
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.maxAttempts = maxAttempts
+        # Claims older than this are considered abandoned (e.g. run crashed) and can be claimed again
+        self.leaseSeconds = leaseSeconds
+        self.__createTable()
+
+    def __execute(self, statement: str, params = None):
+        if params is None:
+            return self.db.executable.execute(text(statement))
+        return self.db.executable.execute(text(statement), params)
+
+    def __createTable(self) -> None:
+        with self.db:
+            self.__execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    request_key TEXT NOT NULL UNIQUE,
+                    request_type TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    params TEXT,
+                    company_number TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_status INTEGER,
+                    claim_token TEXT,
+                    claimed_at REAL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            self.__execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_due ON {self.table} (request_type, next_attempt_at)"
+            )
+            self.__execute(f"CREATE INDEX IF NOT EXISTS {self.table}_claim ON {self.table} (claim_token)")
+
+    def backoff(self, attempts: int) -> float:
+        """
+        Exponential delay before the next attempt, jitter spreads replays of the same batch apart
+        """
+        delay = min(self.maxDelay, self.baseDelay * 2 ** max(attempts - 1, 0))
+        return uniform(delay / 2, delay)
+
+    @staticmethod
+    def splitUrl(url: str, params: dict = None) -> tuple:
+        """
+        Moves query string of @url to params, so that the same request is stored the same way
+        whether it failed with params or with the final url of a response
+        """
+        parts = urlsplit(str(url))
+        merged = {key: value for key, value in parse_qsl(parts.query)}
+        merged.update({str(key): str(value) for key, value in (params or {}).items()})
+        return urlunsplit(parts._replace(query = "")), merged or None
+
+    @staticmethod
+    def requestKey(requestType: str, url: str, params: dict = None) -> str:
+        paramsStr = json.dumps(params, sort_keys = True, default = str) if params else ""
+        return f"{requestType} {url} {paramsStr}"
+
+    def pushMany(self, entries: Iterable) -> int:
+        """
+        Adds failed requests (dicts with url, requestType and optional params, companyNumber, status) to the queue.
+        Requests that are queued already keep their attempt count
+        """
+        now = time()
+        rows = []
+        for entry in entries:
+            url, params = self.splitUrl(entry["url"], entry.get("params"))
+            rows.append({
+                "requestKey": self.requestKey(entry["requestType"], url, params),
+                "requestType": entry["requestType"],
+                "url": url,
+                "params": json.dumps(params, sort_keys = True) if params else None,
+                "companyNumber": entry.get("companyNumber") or None,
+                "nextAttemptAt": now + self.backoff(1),
+                "status": entry.get("status"),
+                "now": now
+            })
+        if not rows:
+            return 0
+        with self.db:
+            self.__execute(
+                f"""
+                INSERT INTO {self.table} (
+                    request_key, request_type, url, params, company_number, next_attempt_at, last_status, created_at
+                )
+                VALUES (:requestKey, :requestType, :url, :params, :companyNumber, :nextAttemptAt, :status, :now)
+                ON CONFLICT (request_key) DO UPDATE SET last_status = excluded.last_status
+                """, rows
+            )
+        return len(rows)
+
+    def claim(self, requestType: str, batchSize: int = 500) -> list:
+        """
+        Atomically claims up to @batchSize due entries of @requestType, returns them as dicts
+        """
+        now = time()
+        token = str(uuid4())
+        with self.db:
+            self.__execute(
+                f"""
+                UPDATE {self.table} SET claim_token = :token, claimed_at = :now
+                WHERE id IN (
+                    SELECT id FROM {self.table}
+                    WHERE request_type = :requestType
+                    AND next_attempt_at <= :now
+                    AND (claim_token IS NULL OR claimed_at < :leaseExpiredAt)
+                    ORDER BY next_attempt_at
+                    LIMIT :batchSize
+                )
+                """, {
+                    "token": token,
+                    "now": now,
+                    "requestType": requestType,
+                    "leaseExpiredAt": now - self.leaseSeconds,
+                    "batchSize": batchSize
+                }
+            )
+            rows = self.__execute(
+                f"""
+                SELECT id, url, params, company_number, attempts FROM {self.table}
+                WHERE claim_token = :token
+                """, {"token": token}
+            ).mappings().all()
+        claimed = []
+        for row in rows:
+            claimed.append({
+                "id": row["id"],
+                "url": row["url"],
+                "params": json.loads(row["params"]) if row["params"] else None,
+                "companyNumber": row["company_number"],
+                "attempts": row["attempts"],
+                "requestType": requestType
+            })
+        return claimed
+
+    def ack(self, entries: Iterable) -> None:
+        """
+        Removes successfully replayed entries
+        """
+        rows = [{"id": entry["id"]} for entry in entries]
+        if not rows:
+            return
+        with self.db:
+            self.__execute(f"DELETE FROM {self.table} WHERE id = :id", rows)
+
+    def nack(self, entries: Iterable) -> None:
+        """
+        Releases entries that failed again: reschedules them with a longer delay or drops them after @maxAttempts
+        """
+        now = time()
+        toReschedule, toDrop = [], []
+        for entry in entries:
+            attempts = entry["attempts"] + 1
+            if attempts >= self.maxAttempts:
+                toDrop.append({"id": entry["id"]})
+                self.logger.warning(f"Dropping {entry['url']} from retry queue after {attempts} failed attempts")
+            else:
+                toReschedule.append({"id": entry["id"], "attempts": attempts, "nextAttemptAt": now + self.backoff(attempts)})
+        with self.db:
+            if toReschedule:
+                self.__execute(
+                    f"""
+                    UPDATE {self.table}
+                    SET attempts = :attempts, next_attempt_at = :nextAttemptAt, claim_token = NULL, claimed_at = NULL
+                    WHERE id = :id
+                    """, toReschedule
+                )
+            if toDrop:
+                self.__execute(f"DELETE FROM {self.table} WHERE id = :id", toDrop)
+
+    def pendingCount(self) -> int:
+        with self.db:
+            return self.__execute(f"SELECT COUNT(*) FROM {self.table}").scalar()
+
+    def clear(self) -> None:
+        with self.db:
+            self.__execute(f"DELETE FROM {self.table}")
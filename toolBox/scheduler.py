@@ -0,0 +1,112 @@
+import asyncio
+from logging import Logger
+from typing import Iterable, Union
+
+
+class RequestScheduler:
+    """
+    Runs request specs on a fixed pool of workers.
+    Spec is a dict of Connector.makeRequest kwargs, optionally with "callback": async function called with the response data
+    and "onError": async function called with the exception if the request or its callback raised.
+    Callbacks can schedule follow-up specs (e.g. next pages) with submitFollowUp() without risking a deadlock on a full queue
+    """
+    def __init__(
+        self,
+        connector,
+        logger: Logger,
+        workers: int = 20,
+        queueSize: int = 100,
+        typeLimits: dict = None) -> None:
+        self.connector = connector
+        self.logger = logger
+        self.workerCnt = workers
+        # Queue itself is unbounded so that workers can always add follow-ups, producers are bounded by capacity
+        self.queue = asyncio.Queue()
+        self.capacity = asyncio.Semaphore(queueSize)
+        typeLimits = typeLimits if typeLimits is not None else {}
+        self.typeLimits = {rtype: asyncio.Semaphore(cap) for rtype, cap in typeLimits.items()}
+        self.workers = []
+        self.failed = 0
+
+    def start(self) -> None:
+        """
+        Spawns worker tasks, has to be called from within a running event loop
+        """
+        if self.workers:
+            return
+        self.workers = [asyncio.create_task(self.__work()) for _ in range(self.workerCnt)]
+
+    async def submit(self, spec: dict) -> None:
+        """
+        Adds spec to the queue, waits if too many specs are queued already (backpressure)
+        """
+        await self.capacity.acquire()
+        self.queue.put_nowait((spec, True))
+
+    def submitFollowUp(self, spec: dict) -> None:
+        """
+        Adds spec to the queue without waiting for capacity, meant to be used from callbacks
+        """
+        self.queue.put_nowait((spec, False))
+
+    async def __runSpec(self, spec: dict) -> None:
+        spec = spec.copy()
+        callback = spec.pop("callback", None)
+        onError = spec.pop("onError", None)
+        typeLimit = self.typeLimits.get(spec.get("requestType"))
+        try:
+            if typeLimit is not None:
+                async with typeLimit:
+                    result = await self.connector.makeRequest(**spec)
+            else:
+                result = await self.connector.makeRequest(**spec)
+            if callback is not None:
+                await callback(result)
+        except Exception as e:
+            if onError is not None:
+                await onError(e)
+            raise
+
+    async def __work(self) -> None:
+        while True:
+            spec, holdsCapacity = await self.queue.get()
+            try:
+                await self.__runSpec(spec)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                self.logger.warning(f"Scheduled request for {spec.get('url')} failed: {e}")
+            finally:
+                if holdsCapacity:
+                    self.capacity.release()
+                self.queue.task_done()
+
+    async def stop(self) -> None:
+        """
+        Cancels workers without waiting for the queue, used when a run gets interrupted
+        """
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions = True)
+        self.workers = []
+
+    async def drain(self) -> None:
+        """
+        Waits for all queued specs (including follow-ups) to be processed and stops the workers
+        """
+        await self.queue.join()
+        await self.stop()
+
+    async def run(self, specs: Union[Iterable, None] = None) -> None:
+        """
+        Feeds specs lazily to the workers and drains the queue
+        """
+        self.start()
+        try:
+            for spec in specs if specs is not None else []:
+                await self.submit(spec)
+            await self.drain()
+        finally:
+            # Make sure no worker outlives the run if we got interrupted
+            await self.stop()
@@ -0,0 +1,82 @@
+import pandas as pd
+from typing import Iterable
+from toolBox.tracing import traced
+
+# Nested fields of search items that are flattened to strings, mapped to their output column
+FLATTENED_COLS = {
+    "registered_office_address": "address_string",
+    "sic_codes": "sic_codes_string"
+}
+
+
+class SearchNormaliser:
+    """
+    Column buffers for advanced search results.
+    Each page of items is flattened to output columns as soon as it arrives, so raw items are never accumulated.
+    Supports += with a list of items, so it can be used as makeRequest storage.
+    @onPage (if set) is called with every page of items after it is normalised, e.g. to start follow-up requests
+    """
+    def __init__(self, colsToSave: list) -> None:
+        self.colsToSave = list(colsToSave)
+        # Plain columns keep their position, flattened ones go to the end (same layout as sheet schema expects)
+        self.plainCols = [col for col in self.colsToSave if col not in FLATTENED_COLS]
+        self.flatCols = [col for col in self.colsToSave if col in FLATTENED_COLS]
+        self.buffers = {col: [] for col in self.plainCols}
+        for col in self.flatCols:
+            self.buffers[FLATTENED_COLS[col]] = []
+        self.rowCnt = 0
+        self.onPage = None
+
+    @staticmethod
+    def parseAddress(addressDict: dict) -> str:
+        """
+        Parses company registered office address (dict) to string
+        """
+        if not addressDict:
+            return ""
+        return ", ".join(str(value) for value in addressDict.values())
+
+    @staticmethod
+    def parseSic(sicCodeList: list) -> str:
+        """
+        Converts list of sic codes to string
+        """
+        if not sicCodeList:
+            return ""
+        return ", ".join(sicCodeList)
+
+    @traced()
+    def addPage(self, items: Iterable) -> None:
+        """
+        Flattens a page of search items to column buffers
+        """
+        if items is None:
+            return
+        for item in items:
+            for col in self.plainCols:
+                self.buffers[col].append(item.get(col))
+            if "registered_office_address" in self.flatCols:
+                self.buffers["address_string"].append(self.parseAddress(item.get("registered_office_address")))
+            if "sic_codes" in self.flatCols:
+                self.buffers["sic_codes_string"].append(self.parseSic(item.get("sic_codes")))
+            self.rowCnt += 1
+        if self.onPage is not None:
+            self.onPage(items)
+
+    def __iadd__(self, items: Iterable):
+        self.addPage(items)
+        return self
+
+    def __len__(self) -> int:
+        return self.rowCnt
+
+    def toFrame(self, runMetaData: dict) -> pd.DataFrame:
+        """
+        Builds dataframe from the buffers once, buffers are released afterwards
+        """
+        frame = pd.DataFrame(self.buffers, columns = list(self.buffers), dtype = object)
+        frame["added_on_run_id"] = runMetaData["run_id"]
+        frame["added_run_ts"] = runMetaData["run_start_ts"]
+        self.buffers = {col: [] for col in self.buffers}
+        self.rowCnt = 0
+        return frame
@@ -0,0 +1,78 @@
+import sqlite3
+from datetime import date
+from logging import Logger
+from typing import Iterable, Union
+
+
+class SheetIndex:
+    """
+    Local copy of the leads sheet columns a run needs: company numbers by row and their incorporation dates.
+    Rows are numbered like data rows of the sheet (1 is the first row under the header),
+    so the last indexed row tells where the unread tail of the sheet starts
+    """
+    def __init__(self, db: str, table: str, logger: Logger) -> None:
+        self.table = table
+        self.logger = logger
+        self.conn = sqlite3.connect(db)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    row_number INTEGER PRIMARY KEY,
+                    company_number TEXT NOT NULL,
+                    date_of_creation TEXT NOT NULL
+                )
+                """
+            )
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_date ON {self.table} (date_of_creation)")
+
+    def lastRow(self) -> Union[tuple, None]:
+        """
+        Returns (row_number, company_number) of the last indexed row, None if index is empty
+        """
+        return self.conn.execute(
+            f"SELECT row_number, company_number FROM {self.table} ORDER BY row_number DESC LIMIT 1"
+        ).fetchone()
+
+    def rowCount(self) -> int:
+        last = self.lastRow()
+        return 0 if last is None else last[0]
+
+    def extend(self, rows: Iterable, startRow: int) -> int:
+        """
+        Adds (company_number, date_of_creation) @rows as sheet rows starting at @startRow
+        """
+        numbered = [(startRow + i, str(companyNumber), str(dateCreated)) for i, (companyNumber, dateCreated) in enumerate(rows)]
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (row_number, company_number, date_of_creation) VALUES (?, ?, ?)",
+                numbered
+            )
+        return len(numbered)
+
+    def replace(self, rows: Iterable) -> int:
+        """
+        Rebuilds the index from all sheet rows
+        """
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {self.table}")
+        return self.extend(rows, startRow = 1)
+
+    def companyNumbers(self) -> list:
+        """
+        Company numbers in sheet row order, rows without one are kept as empty strings
+        """
+        return [row[0] for row in self.conn.execute(f"SELECT company_number FROM {self.table} ORDER BY row_number")]
+
+    def watermark(self) -> Union[date, None]:
+        """
+        Latest incorporation date on the sheet, None if there are no dated rows
+        """
+        maxDate = self.conn.execute(
+            f"SELECT MAX(date_of_creation) FROM {self.table} WHERE date_of_creation <> ''"
+        ).fetchone()[0]
+        return None if maxDate is None else date.fromisoformat(maxDate)
+
+    def close(self) -> None:
+        self.conn.close()
@@ -2,27 +2,39 @@ import pandas as pd
 import pygsheets
 from logging import Logger
 from janitor import clean_names #This is used within pandas, not alone
-from typing import Union
+from typing import Iterable, Union
+from random import uniform
+from time import sleep
+from googleapiclient.errors import HttpError
 from pygsheets import PyGsheetsException
+from toolBox.leadStore import LeadStore
+from toolBox.sheetIndex import SheetIndex
+from toolBox.tracing import traced
 
-class sheetManager:
+class sheetManager(LeadStore):
     def __init__(
         self,
         logger: Logger,
         benchmarkSheets: list,
         controlPanelSheetName: str,
         leadsSheetName: str,
-        sheetSecretVarName: str = "GSHEET_SECRET"
+        sheetSecretVarName: str = "GSHEET_SECRET",
+        appendConfig: dict = None
         ) -> None:
         """
         Helper class for interacting with Google Sheets API
         """
-        self.logger = logger
+        super().__init__(logger, controlPanelSheetName, leadsSheetName)
         self.benchmarkSheets = benchmarkSheets
-        self.controlPanelSheetName = controlPanelSheetName
-        self.leadsSheetName = leadsSheetName
         self.scope = ["https://www.googleapis.com/auth/spreadsheets","https://www.googleapis.com/auth/drive"]
         self.sheetSecretVarName = sheetSecretVarName
+        # Limits of a single append request and backoff settings for quota errors
+        appendConfig = appendConfig if appendConfig is not None else {}
+        self.appendChunkRows = appendConfig.get("chunk_rows", 500)
+        self.appendChunkChars = appendConfig.get("chunk_chars", 500000)
+        self.appendRetries = appendConfig.get("retries", 6)
+        self.appendBaseDelay = appendConfig.get("base_delay", 2)
+        self.appendMaxDelay = appendConfig.get("max_delay", 64)
     
     def _connect(self) -> Union[None, Exception]:
         """
@@ -83,45 +95,65 @@ class sheetManager:
 
         return None
     
-    def _parseSearchParams(self, controlPanelFrame: pd.DataFrame) -> Union[dict, None]:
+    @staticmethod
+    def _cleanHeader(worksheet: pygsheets.Worksheet) -> list:
         """
-        Function to parse control panel search params to a dict
+        Reads header row and cleans its names the same way as _readToDf() does
         """
-        try:
-            #Create base for 
-            searchConfig = {"params": {}}
-            searchFrame = controlPanelFrame.query("purpose == 'search' and actual_input != ''")
-            for index, row in searchFrame.iterrows():
-                key = row["parameter"]
-                dataType = row["data_type"]
-                input = row["actual_input"]
-                
-                if dataType == "list":
-                    input = ",".join(input.split(";\n"))
-                elif dataType == "int":
-                    input = int(input)
-
-                if key != "days_back":
-                    searchConfig["params"][key] = input
-                else:
-                    searchConfig[key] = input
-
-            return searchConfig, None
-        except Exception as e:
-            return None, e
-    
-    def getColsToKeep(self) -> list: #Do we actualy need this?
+        header = worksheet.get_row(1, include_tailing_empty = False)
+        return list(pd.DataFrame(columns = header).clean_names().columns)
+
+    @traced()
+    def syncLeadIndex(self, leadIndex: SheetIndex) -> Union[None, Exception]:
         """
-        Reads columns to keep from searched data
+        Brings local index of the leads tab up to date without downloading the whole tab.
+        Sheet properties are fetched fresh on every sync (cached grid size goes stale in a long-lived process),
+        rows past the indexed ones give the data row count of the sheet, which is compared with the index.
+        If the last indexed row still holds the same company, rows were only appended since the last sync and just
+        the new rows are indexed. Otherwise rows were edited, removed or moved, so the index is rebuilt from the
+        company number and date columns only
         """
         try:
-            searchFrame = getattr(self, f"{self.controlPanelSheetName}Frame")
-            colsStr = searchFrame.query("parameter == 'cols_to_keep'")["actual_input"].values[0]
-            cols = colsStr.split(";\n")
-            return cols, None
+            # Cached worksheet objects keep grid size of the first fetch, rows added by other writers would be missed
+            worksheet = self.spreadsheet.worksheets("title", self.leadsSheetName, force_fetch = True)[0]
+            setattr(self, f"{self.leadsSheetName}Sheet", worksheet)
+            header = self._cleanHeader(worksheet)
+            idCol = header.index("company_number") + 1
+            dateCol = header.index("date_of_creation") + 1
+
+            last = leadIndex.lastRow()
+            indexedCnt = leadIndex.rowCount()
+            # Data row n sits in sheet row n + 1, below the header
+            if last is not None and indexedCnt + 1 <= worksheet.rows:
+                tail = []
+                if indexedCnt + 2 <= worksheet.rows:
+                    tail = worksheet.get_values(
+                        start = (indexedCnt + 2, 1),
+                        end = (worksheet.rows, max(idCol, dateCol)),
+                        include_tailing_empty_rows = False
+                    )
+                dataRowCnt = indexedCnt + len(tail)
+                # Second guard: appends keep the last indexed row in place, in-place edits and removals do not
+                anchor = worksheet.cell((indexedCnt + 1, idCol)).value
+                if str(anchor).strip() == last[1]:
+                    rows = self._indexRows(
+                        [row[idCol - 1] if len(row) >= idCol else "" for row in tail],
+                        [row[dateCol - 1] if len(row) >= dateCol else "" for row in tail]
+                    )
+                    leadIndex.extend(rows, startRow = indexedCnt + 1)
+                    self.logger.info(f"Lead index is in sync with {dataRowCnt} sheet rows, read {dataRowCnt - indexedCnt} new rows")
+                    return None
+                self.logger.info(f"Row {indexedCnt + 1} of {self.leadsSheetName} does not match lead index, rebuilding it")
+
+            companyNumbers = worksheet.get_col(idCol, include_tailing_empty = False)[1:]
+            datesCreated = worksheet.get_col(dateCol, include_tailing_empty = False)[1:]
+            rowCnt = leadIndex.replace(self._indexRows(companyNumbers, datesCreated))
+            self.logger.info(f"Rebuilt lead index from {rowCnt} sheet rows")
+            return None
         except Exception as e:
-            return None, e
-    
+            return e
+
+    @traced()
     def prepareSeachInputs(self, sheetId: str, workSheetsToRead: list, validation = True) -> tuple:
         """
         Master function that establishes connection to the api and reads prepares input data for search step
@@ -158,16 +190,88 @@ class sheetManager:
 
         return searchParams, None
     
-    def appendToSheet(self, sheetLeads: pd.Series, df: pd.DataFrame) -> None:
-        """"
-        Appends dataframe to the sheet
+    @staticmethod
+    def _chunkRows(rows: Iterable, maxRows: int, maxChars: int):
+        """
+        Splits rows into chunks of at most @maxRows rows and roughly @maxChars characters of cell values
         """
-        df["added_run_ts"] = df["added_run_ts"].astype(str)
-        df["date_of_creation"] = pd.to_datetime(df["date_of_creation"])
-        # Sort by created for convenience
-        df.sort_values(by = "date_of_creation", ascending = True, inplace = True)
-        df["date_of_creation"] = df["date_of_creation"].astype(str)
-        rowsUpdate = df.values.tolist()
-        getattr(self, f"{self.leadsSheetName}Sheet").insert_rows(len(sheetLeads) + 1, number = len(df), values = rowsUpdate)
-        self.logger.info(f"{len(df)} new leads have been appended to the sheet")
+        chunk, chars = [], 0
+        for row in rows:
+            rowChars = sum(len(str(value)) for value in row)
+            if chunk and (len(chunk) >= maxRows or chars + rowChars > maxChars):
+                yield chunk
+                chunk, chars = [], 0
+            chunk.append(row)
+            chars += rowChars
+        if chunk:
+            yield chunk
 
+    @staticmethod
+    def _isRetryable(e: Exception) -> bool:
+        """
+        Quota (429) and server side errors are worth waiting for, so are dropped connections and timeouts
+        """
+        if isinstance(e, HttpError):
+            return e.resp.status == 429 or e.resp.status >= 500
+        return isinstance(e, (OSError, TimeoutError))
+
+    @staticmethod
+    def _chunkLanded(worksheet: pygsheets.Worksheet, chunk: list, lastRow: int, idCol: int) -> bool:
+        """
+        Checks whether an append that errored out was written anyway, by its last company number
+        """
+        try:
+            return str(worksheet.cell((lastRow, idCol)).value).strip() == str(chunk[-1][idCol - 1])
+        except Exception:
+            return False
+
+    @traced()
+    def _appendChunk(self, worksheet: pygsheets.Worksheet, chunk: list, lastRow: int, idCol: int) -> None:
+        """
+        Appends one chunk below the leads table, backing off exponentially on quota and server errors.
+        Before every retry we check if the failed request landed, so a chunk is never written twice
+        """
+        for attempt in range(1, self.appendRetries + 1):
+            try:
+                worksheet.append_table(chunk, start = "A1", dimension = "ROWS", overwrite = False)
+                return
+            except Exception as e:
+                if not self._isRetryable(e) or attempt == self.appendRetries:
+                    raise
+                delay = min(self.appendMaxDelay, self.appendBaseDelay * 2 ** (attempt - 1))
+                delay = uniform(delay / 2, delay)
+                self.logger.warning(f"Appending {len(chunk)} rows failed ({e}), retrying in {round(delay, 2)} seconds")
+                sleep(delay)
+                if self._chunkLanded(worksheet, chunk, lastRow, idCol):
+                    self.logger.info(f"Rows up to {lastRow} were written despite the error, not sending them again")
+                    return
+
+    @traced()
+    def appendToSheet(self, sheetLeads: pd.Series, df: pd.DataFrame, leadIndex: SheetIndex = None) -> tuple:
+        """"
+        Appends dataframe to the sheet in size bounded chunks and returns company numbers that were appended.
+        Every written chunk is added to @leadIndex right away, so it marks how far the append got: if a run fails
+        midway, the next sync knows the written rows and only the rest gets appended from cache
+        """
+        rowsUpdate = self._prepareAppend(df)
+        worksheet = getattr(self, f"{self.leadsSheetName}Sheet")
+        idCol = list(df.columns).index("company_number") + 1
+        dateCol = list(df.columns).index("date_of_creation") + 1
+        appended = []
+        try:
+            for chunk in self._chunkRows(rowsUpdate, self.appendChunkRows, self.appendChunkChars):
+                # Sheet row of the last row in the chunk, first row of the sheet is the header
+                lastRow = 1 + len(sheetLeads) + len(appended) + len(chunk)
+                self._appendChunk(worksheet, chunk, lastRow, idCol)
+                companyNumbers = [row[idCol - 1] for row in chunk]
+                if leadIndex is not None:
+                    leadIndex.extend(
+                        self._indexRows(companyNumbers, [row[dateCol - 1] for row in chunk]),
+                        startRow = len(sheetLeads) + len(appended) + 1
+                    )
+                appended.extend(companyNumbers)
+                self.logger.info(f"Appended {len(appended)} of {len(rowsUpdate)} new leads")
+        except Exception as e:
+            return appended, e
+        self.logger.info(f"{len(appended)} new leads have been appended to the sheet")
+        return appended, None
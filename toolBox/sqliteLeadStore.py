@@ -0,0 +1,153 @@
+import re
+import sqlite3
+import unicodedata
+import pandas as pd
+from logging import Logger
+from typing import Union
+from toolBox.leadStore import LeadStore
+from toolBox.sheetIndex import SheetIndex
+from toolBox.tracing import traced
+
+
+class SqliteLeadStore(LeadStore):
+    """
+    Lead store kept in a local sqlite db, runs with it need no Google credentials (offline runs, load tests, backfills).
+    Control panel is imported from @controlPanelCsv (an export of the control panel tab) when given,
+    leads go to a table named like the leads tab, their order of insertion plays the role of sheet rows
+    """
+    def __init__(
+        self,
+        logger: Logger,
+        controlPanelSheetName: str,
+        leadsSheetName: str,
+        db: str,
+        controlPanelCsv: str = None,
+        chunkRows: int = 5000) -> None:
+        super().__init__(logger, controlPanelSheetName, leadsSheetName)
+        self.db = db
+        self.controlPanelCsv = controlPanelCsv
+        self.chunkRows = chunkRows
+        self.conn = sqlite3.connect(db)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+
+    @staticmethod
+    def cleanName(name: str) -> str:
+        """
+        Cleans column @name the way janitor's clean_names() cleans sheet headers, without importing janitor
+        """
+        name = str(name).strip().lower()
+        name = re.sub(r"[ /:,?()\.\-\xa0]", "_", name)
+        name = re.sub(r"['’]", "", name)
+        name = re.sub(r"(\w)@(\w)", r"\1_\2", name)
+        name = "".join(letter for letter in unicodedata.normalize("NFD", name) if not unicodedata.combining(letter))
+        return re.sub(r"_+", "_", name)
+
+    def _tableExists(self, table: str) -> bool:
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone() is not None
+
+    def _importControlPanel(self) -> None:
+        """
+        Replaces control panel table with contents of the csv export, names are cleaned like sheet headers
+        """
+        frame = pd.read_csv(self.controlPanelCsv, dtype = str, keep_default_na = False)
+        frame.columns = [self.cleanName(col) for col in frame.columns]
+        frame.to_sql(self.controlPanelSheetName, self.conn, if_exists = "replace", index = False)
+        self.logger.info(f"Imported {len(frame)} control panel rows from {self.controlPanelCsv}")
+
+    @traced()
+    def prepareSeachInputs(self, sheetId: str = None, workSheetsToRead: list = None, validation = True) -> tuple:
+        """
+        Reads control panel (and other @workSheetsToRead tables) to frames and parses search params.
+        @sheetId is not used, it is kept for compatibility with the sheet backend
+        """
+        workSheetsToRead = workSheetsToRead if workSheetsToRead is not None else [self.controlPanelSheetName]
+        try:
+            if self.controlPanelCsv is not None:
+                self._importControlPanel()
+            for table in workSheetsToRead:
+                if not self._tableExists(table):
+                    if validation:
+                        return None, AttributeError(f"{table} is missing in {self.db}, import it first!")
+                    continue
+                frame = pd.read_sql(f'SELECT * FROM "{table}"', self.conn).fillna("").astype(str)
+                setattr(self, f"{table}Frame", frame)
+        except Exception as e:
+            return None, e
+
+        return self._parseSearchParams(getattr(self, f"{self.controlPanelSheetName}Frame"))
+
+    @traced()
+    def syncLeadIndex(self, leadIndex: SheetIndex) -> Union[None, Exception]:
+        """
+        Same check as for the sheet: if the last indexed row still holds the same company, only newer rows are read
+        """
+        try:
+            if not self._tableExists(self.leadsSheetName):
+                leadIndex.replace([])
+                return None
+            last = leadIndex.lastRow()
+            if last is not None:
+                rowCnt, lastCompany = last
+                anchor = self.conn.execute(
+                    f'SELECT company_number FROM "{self.leadsSheetName}" ORDER BY rowid LIMIT 1 OFFSET ?', (rowCnt - 1,)
+                ).fetchone()
+                if anchor is not None and str(anchor[0]) == lastCompany:
+                    tail = self.conn.execute(
+                        f'SELECT company_number, date_of_creation FROM "{self.leadsSheetName}" ORDER BY rowid LIMIT -1 OFFSET ?',
+                        (rowCnt,)
+                    ).fetchall()
+                    leadIndex.extend(self._indexRows([row[0] for row in tail], [row[1] for row in tail]), startRow = rowCnt + 1)
+                    self.logger.info(f"Lead index is in sync with the store, read {len(tail)} new rows")
+                    return None
+            rows = self.conn.execute(
+                f'SELECT company_number, date_of_creation FROM "{self.leadsSheetName}" ORDER BY rowid'
+            ).fetchall()
+            rowCnt = leadIndex.replace(self._indexRows([row[0] for row in rows], [row[1] for row in rows]))
+            self.logger.info(f"Rebuilt lead index from {rowCnt} stored leads")
+            return None
+        except Exception as e:
+            return e
+
+    def _createLeadsTable(self, columns: list) -> None:
+        colsDefinition = ", ".join(f'"{col}" TEXT' for col in columns)
+        with self.conn:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.leadsSheetName}" ({colsDefinition})')
+            self.conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "{self.leadsSheetName}_company_number" ON "{self.leadsSheetName}" (company_number)'
+            )
+
+    @traced()
+    def appendToSheet(self, sheetLeads: pd.Series, df: pd.DataFrame, leadIndex: SheetIndex = None) -> tuple:
+        """
+        Inserts leads in chunks of @chunkRows, one transaction each, and adds every written chunk to @leadIndex
+        """
+        rowsUpdate = self._prepareAppend(df)
+        columns = list(df.columns)
+        idCol = columns.index("company_number")
+        dateCol = columns.index("date_of_creation")
+        quotedCols = ", ".join(f'"{col}"' for col in columns)
+        placeholders = ", ".join("?" * len(columns))
+        insertStatement = f'INSERT INTO "{self.leadsSheetName}" ({quotedCols}) VALUES ({placeholders})'
+        appended = []
+        try:
+            self._createLeadsTable(columns)
+            for start in range(0, len(rowsUpdate), self.chunkRows):
+                chunk = rowsUpdate[start:start + self.chunkRows]
+                with self.conn:
+                    self.conn.executemany(insertStatement, chunk)
+                companyNumbers = [row[idCol] for row in chunk]
+                if leadIndex is not None:
+                    leadIndex.extend(
+                        self._indexRows(companyNumbers, [row[dateCol] for row in chunk]),
+                        startRow = len(sheetLeads) + len(appended) + 1
+                    )
+                appended.extend(companyNumbers)
+        except Exception as e:
+            return appended, e
+        self.logger.info(f"{len(appended)} new leads have been appended to {self.leadsSheetName} table of {self.db}")
+        return appended, None
+
+    def close(self) -> None:
+        self.conn.close()
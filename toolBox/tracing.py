@@ -0,0 +1,146 @@
+import cProfile
+import io
+import json
+import pstats
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from os.path import join
+from threading import Lock
+from time import perf_counter
+from typing import Union
+
+# Path of the span the current code runs in, asyncio tasks inherit it from the code that created them
+_currentSpan = ContextVar("currentSpan", default = "")
+
+
+class Tracer:
+    """
+    Collects nested timing spans of a run. Spans are aggregated by their path (e.g. "collect_leads/LeadManager.streamLeads/limiter_wait"),
+    so memory does not grow with the number of calls. Spans running concurrently (e.g. requests on the scheduler)
+    are summed, so their total can exceed wall time of the parent span
+    """
+    def __init__(self) -> None:
+        self.lock = Lock()
+        # path -> [calls, total seconds, max seconds], in the order paths were first entered
+        self.spans = {}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.spans = {}
+
+    def __enter(self, path: str) -> None:
+        # Registered on entry, so parents are listed before their children
+        with self.lock:
+            self.spans.setdefault(path, [0, 0.0, 0.0])
+
+    def __record(self, path: str, elapsed: float) -> None:
+        with self.lock:
+            stats = self.spans.setdefault(path, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        Times the code within the block as span @name nested under the span it runs in
+        """
+        parent = _currentSpan.get()
+        path = f"{parent}/{name}" if parent else name
+        token = _currentSpan.set(path)
+        self.__enter(path)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.__record(path, perf_counter() - start)
+            _currentSpan.reset(token)
+
+    def traced(self, name: str = None):
+        """
+        Decorator wrapping every call of a (sync or async) function in a span, named by @name or function qualname
+        """
+        def decorator(func):
+            spanName = name if name is not None else func.__qualname__
+            if iscoroutinefunction(func):
+                @wraps(func)
+                async def asyncWrapper(*args, **kwargs):
+                    with self.span(spanName):
+                        return await func(*args, **kwargs)
+                return asyncWrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(spanName):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self) -> list:
+        """
+        Span stats as a list of dicts, in the order spans were first entered
+        """
+        with self.lock:
+            return [
+                {"span": path, "calls": calls, "total_s": round(total, 4), "mean_s": round(total / calls, 4) if calls else 0.0, "max_s": round(slowest, 4)}
+                for path, (calls, total, slowest) in self.spans.items()
+            ]
+
+    def formatSummary(self) -> str:
+        """
+        Span stats as an indented table, one line per span
+        """
+        lines = [f"{'span':<60} {'calls':>8} {'total, s':>10} {'mean, s':>10} {'max, s':>10}"]
+        for row in self.summary():
+            depth = row["span"].count("/")
+            label = "  " * depth + row["span"].rsplit("/", 1)[-1]
+            lines.append(f"{label:<60} {row['calls']:>8} {row['total_s']:>10.3f} {row['mean_s']:>10.4f} {row['max_s']:>10.4f}")
+        return "\n".join(lines)
+
+
+# Process wide tracer, modules mark their phases with @traced() or `with span(...)`
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
+
+
+class RunProfiler:
+    """
+    Opt-in cProfile of a run. When enabled, stop() writes to @folder:
+    {runId}.prof (load with pstats or snakeviz), {runId}_profile.txt (top functions by cumulative time)
+    and {runId}_spans.json / {runId}_spans.txt (span summary of the tracer)
+    """
+    def __init__(self, folder: str, runId: str, enabled: bool, topFunctions: int = 50) -> None:
+        self.folder = folder
+        self.runId = runId
+        self.enabled = enabled
+        self.topFunctions = topFunctions
+        self.profile = cProfile.Profile() if enabled else None
+
+    def start(self) -> None:
+        if self.enabled:
+            self.profile.enable()
+
+    def stop(self, tracer: Tracer) -> Union[list, Exception]:
+        """
+        Stops profiling and writes run artifacts, returns paths written (none if profiling is off) or an error
+        """
+        if not self.enabled:
+            return []
+        self.profile.disable()
+        try:
+            base = join(self.folder, self.runId)
+            self.profile.dump_stats(f"{base}.prof")
+            report = io.StringIO()
+            pstats.Stats(self.profile, stream = report).sort_stats("cumulative").print_stats(self.topFunctions)
+            with open(f"{base}_profile.txt", "w") as file:
+                file.write(report.getvalue())
+            with open(f"{base}_spans.json", "w") as file:
+                json.dump(tracer.summary(), file, indent = 2)
+            with open(f"{base}_spans.txt", "w") as file:
+                file.write(tracer.formatSummary() + "\n")
+            return [f"{base}.prof", f"{base}_profile.txt", f"{base}_spans.json", f"{base}_spans.txt"]
+        except Exception as e:
+            return e
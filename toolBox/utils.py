@@ -1,12 +1,13 @@
-import pandas as pd
-import yaml
 from datetime import timedelta, date, datetime
 from os.path import exists
 from os import makedirs
 from os.path import join
-from typing import Union
+from typing import TYPE_CHECKING, Union
 from logging import Logger
 from uuid import uuid4
+from toolBox.metrics import RunMetrics
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class utilMaster:
@@ -35,21 +36,15 @@ class utilMaster:
             self.logger.error(f"Days delta computation error: {e}")
             return None
 
-    def createSearchDates(self, daysBack):
-        try:
-            return [date.today() - timedelta(days = x) for x in range(daysBack + 1)]
-        except Exception as e:
-            self.logger.error(f"Search daterange computation error: {e}")
-            return None
-
-    def createParams(self, headerBase: dict, day: date) -> Union[dict, Exception]:
+    def createSearchWindow(self, daysBack: int) -> Union[tuple, None]:
+        """
+        Returns (first, last) incorporation dates covered by the search
+        """
         try:
-            output = headerBase
-            output["incorporated_from"] = str(day)
-            output["incorporated_to"] = str(day)
-            return output
+            today = date.today()
+            return today - timedelta(days = daysBack), today
         except Exception as e:
-            self.logger.error(f"Request params generation error: {e}")
+            self.logger.error(f"Search window computation error: {e}")
             return None
 
     def softDirCreate(self, path: str) -> Union[None, Exception]:
@@ -64,7 +59,9 @@ class utilMaster:
             self.logger.error(f"Directory creation error: {e}")
             return e
 
-    def checkMaxDate(self, df: pd.DataFrame, dateSeriesName: str, searchParams: dict) -> Union[dict, None]:
+    def checkMaxDate(self, df: "pd.DataFrame", dateSeriesName: str, searchParams: dict) -> Union[dict, None]:
+        # pandas and yaml are imported on first use, most callers of utils need neither
+        import pandas as pd
         try:
             maxLeadCreatedStr = str(max(pd.to_datetime(df[dateSeriesName])))[:10]
             maxLeadCreatedDate = datetime.strptime(maxLeadCreatedStr, "%Y-%m-%d").date()
@@ -80,6 +77,7 @@ class utilMaster:
         """
         Read Yaml to a dict, log if there is an error
         """
+        import yaml
         try:
             with open(path, 'r') as yamlFile:
                 ymlParsed = yaml.safe_load(yamlFile)
@@ -91,54 +89,40 @@ class utilMaster:
     @staticmethod
     def generateRunMetaData(requestTypes: list) -> dict:
         """
-        Function that generates run uuid and its start time
+        Function that generates run uuid, its start time and metrics container filled by requests of the run
         """
-        base = {"run_id": str(uuid4()), "run_start_ts": datetime.utcnow()}
-        for rtype in requestTypes:
-            container = dict(success = [], rest = [])
-            base[rtype] = container
-        return base
-
-    @staticmethod
-    def splitToChunks(array: list, chunkSize: int) -> list:
-        """
-        Splits a list into chunks of given size
-        :param array[list] list of items to be split to chunks:
-        :param chunkSize[int] size defining the items in one chunk:
-        :return nested list:
-        """
-        return [array[i:i + chunkSize] for i in range(0, len(array), chunkSize)]
+        runId = str(uuid4())
+        metrics = RunMetrics(runId, requestTypes)
+        return {"run_id": runId, "run_start_ts": metrics.runStart, "metrics": metrics}
 
     @staticmethod
     def getRunTimeStats(metadata: dict) -> dict:
         """
         Uses metadata dict to compute summary stats of the run and returns as a dict
         """
+        metrics = metadata["metrics"]
         # Computations
         runEnd = datetime.utcnow()
-        runtime = round((runEnd - metadata["run_start_ts"]).seconds)
-        # Search endpoint stats
-        searchRequestsSuccess = sum(metadata["search"]["success"])
-        searchRequestsRest = sum(metadata["search"]["rest"])
-        searchRequests = searchRequestsSuccess + searchRequestsRest
-        # Officer endpoint stats
-        officerRequestsSuccess = sum(metadata["officers"]["success"])
-        officerRequestsRest = sum(metadata["officers"]["rest"])
-        officerRequests = officerRequestsSuccess + officerRequestsRest
-        # Save results to dict
+        runtime = round((runEnd - metadata["run_start_ts"]).total_seconds())
         summary = dict(
             run_start_ts = metadata["run_start_ts"],
             run_end_ts = runEnd,
-            runtime = runtime,
-
-            total_search_requests = searchRequests,
-            success_search_requests = searchRequestsSuccess,
-            fail_search_requests = searchRequestsRest,
-
-            total_officer_requests = officerRequests,
-            success_officer_requests = officerRequestsSuccess,
-            fail_officer_requests = officerRequestsRest,
+            runtime = runtime
         )
+        # Endpoint stats, search and officer keys are kept as they were before metrics were added
+        for rtype, name in (("search", "search"), ("officers", "officer")):
+            success, rest = metrics.requestCounts(rtype)
+            latency = metrics.typeLatency(rtype)
+            p50, p99 = latency.quantile(0.5), latency.quantile(0.99)
+            summary.update({
+                f"total_{name}_requests": success + rest,
+                f"success_{name}_requests": success,
+                f"fail_{name}_requests": rest,
+                f"{name}_latency_p50_ms": None if p50 is None else round(p50 * 1e3, 1),
+                f"{name}_latency_p99_ms": None if p99 is None else round(p99 * 1e3, 1),
+                f"{name}_limiter_wait_s": round(metrics.limiterWait[rtype].sum, 2) if rtype in metrics.limiterWait else 0,
+                f"{name}_mb_received": round(metrics.bytes.get(rtype, 0) / 2 ** 20, 2)
+            })
+        summary["throttled_requests"] = sum(cnt for (_, status), cnt in metrics.requests.items() if status == 429)
+        summary["retries"] = sum(metrics.retries.values())
         return summary
-             
-
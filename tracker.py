@@ -1,237 +1,342 @@
+import argparse
 import asyncio
-import pandas as pd
 import logging
 from queue import Queue
-from pytz import timezone
-from aiohttp import BasicAuth
 from datetime import datetime as dt
 from logging import handlers
 from time import sleep
-from toolBox.leadManager import LeadManager
-from toolBox.sheetManager import sheetManager
+from typing import TYPE_CHECKING, Union
+from toolBox.sheetIndex import SheetIndex
 from toolBox.utils import utilMaster
-from toolBox.recordKeeper import dbHandler, discordHandler
-from toolBox import (
-    IS_WINDOWS,
-    REST_KEY,
-    REST_URL,
-    SEARCH_URL,
-    RATE,
-    LIMIT,
-    LEAD_SHEET_SCHEMA,
-    GSHEET_ID,
-    BENCHMARK_SHEETNAMES,
-    GSHEET_CONTROL_PANEL_NAME,
-    GSHEET_LEAD_TABLE_NAME,
-    LOG_FOLDER,
-    LOG_FORMAT,
-    LOG_DB,
-    LOG_DB_TABLE_NAME,
-    TIMEZONE,
-    CACHE,
-    DISCORD_CONFIG,
-    REQUEST_TYPES
-)
-# Instantiate utils
-utils = utilMaster()
-# Generate search run metadata
-searchMeta = utils.generateRunMetaData(REQUEST_TYPES)
-RUN_ID = searchMeta["run_id"]
-# Create logger dir 
-err = utils.softDirCreate(LOG_FOLDER)
-#Configure logger
-# First we get a queue for logging and its handlers
-logQueue = Queue()
-queueHanlder = handlers.QueueHandler(logQueue)
-# Configure our logging handlers
-dbLogHandler = dbHandler(db = LOG_DB, table = LOG_DB_TABLE_NAME, runId = RUN_ID)
-discordLogHander = discordHandler(
-    webhook = DISCORD_CONFIG["webhook"],
-    poc1 = DISCORD_CONFIG["poc_1"],
-    poc2 = DISCORD_CONFIG["poc_2"],
-    runId = RUN_ID
-)
-# Configure queue listener, we put our DB hanlder there
-qListener = handlers.QueueListener(
-    logQueue,
-    dbLogHandler
-)
-# Start our logging queue
-qListener.start()
-#TO-DO: make a logging queue, move to a sep file
-logging.basicConfig(
-    level = logging.INFO,
-    format = LOG_FORMAT,
-    handlers = [
-        queueHanlder,
-        discordLogHander,
-        logging.StreamHandler() #this should write to console?
-    ]
-)
-# Set logger timezone
-logging.Formatter.converter = lambda *args: dt.now(tz=timezone(TIMEZONE)).timetuple()
-
-# Perform logger assignment
-utils.assignLogger(logging.getLogger("mainLogger"))
-utils.logger.info(f"Run ID {searchMeta['run_id']} starts...")
-utils.logger.info("Instantiated logger and assigned it to utils instance")
-# Prepare to run async steps
-if IS_WINDOWS:
-    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy()) #windows-specific thing!
-    utils.logger.info("Event policy set, this is a windows-specific step!")
-# Init lead manager
-manager = LeadManager(
-    rate = RATE,
-    limit = LIMIT,
-    logger = utils.logger,
-    sleepTimeBuffer = 2,
-    cache = CACHE["db"],
-    cacheTable = CACHE["companies_table"],
-    retryTable = CACHE["retries_table"],
-    allowedRequestTypes = REQUEST_TYPES
-)
-utils.logger.info("Lead Manager Instantiated")
-
-#Read Spreadsheet Data
-sheetReader = sheetManager(
-    logger = utils.logger,
-    benchmarkSheets = BENCHMARK_SHEETNAMES,
-    controlPanelSheetName = GSHEET_CONTROL_PANEL_NAME,
-    leadsSheetName = GSHEET_LEAD_TABLE_NAME,
-    sheetSecretVarName = "GSHEET_SECRET"
-)
-utils.logger.info("Sheet Manager Instantiated")
-searchParams, e = sheetReader.prepareSeachInputs(
-    sheetId = GSHEET_ID,
-    workSheetsToRead = [sheetReader.controlPanelSheetName, sheetReader.leadsSheetName]
-)
-if e is not None:
-    utils.logger.error(f"Got and error when preparing search inputs: {e}")
-    exit()
-
-utils.logger.info("Search inputs prepared")
-leadFrame = getattr(sheetReader, f"{sheetReader.leadsSheetName}Frame")
-if len(leadFrame) > 0:
-    #Override days back parameter for performing search if lead table has entries
-    utils.checkMaxDate(leadFrame, LEAD_SHEET_SCHEMA["dateCreated"], searchParams)
-#filter dates for leads, then use getDaysDelta() to compute days_back
-searchDates = utils.createSearchDates(searchParams["days_back"])
-utils.logger.info("Generated search dates")
-#Generate Tasks for asyncio - base search
-searchTasks = []
-for day in searchDates:
-    params = utils.createParams(headerBase = searchParams["params"], day = day)
-    paramsCopy = params.copy()
-    searchTasks.append(
-        manager.makeRequest(
-            url = SEARCH_URL,
-            requestType = "search",
-            auth = BasicAuth(REST_KEY, ""),
-            params = paramsCopy,
-            storage = manager.searchStorage,
-            toRetry = manager.toRetryList,
-            metaData = searchMeta
-        )
+from toolBox.tracing import RunProfiler, span, tracer
+from toolBox import IS_WINDOWS
+# Config constants and heavy modules (pandas, aiohttp, dataset, pygsheets, requests) are imported by the functions
+# using them, so that --help and modules importing tracker (e.g. daemon.py) start fast and need no config or secrets
+if TYPE_CHECKING:
+    from toolBox.leadManager import LeadManager
+    from toolBox.leadStore import LeadStore
+    from toolBox.recordKeeper import dbHandler, discordHandler
+
+
+def setupLogging(utils: utilMaster, runId: str) -> tuple:
+    """
+    Configures logging to console, sqlite db (through a queue) and discord, assigns logger to @utils.
+    Returns db handler, discord handler and queue listener, they have to be closed when the process ends
+    """
+    from pytz import timezone
+    from toolBox.recordKeeper import dbHandler, discordHandler
+    from toolBox import (
+        LOG_FOLDER,
+        LOG_FORMAT,
+        LOG_DB,
+        LOG_DB_TABLE_NAME,
+        LOG_DB_BATCH_SIZE,
+        LOG_DB_FLUSH_INTERVAL,
+        TIMEZONE,
+        DISCORD_CONFIG
     )
-utils.logger.info("Prepared search request tasks")
-#Add search urls from cache
-err = manager.processRetryCache(
-    retryType = "search",
-    taskList = searchTasks,
-    auth = BasicAuth(REST_KEY, ""),
-    dbClean = True,
-    metaData = searchMeta
-)
-if err is not None:
-    utils.logger.warning(f"Error processing search retries: {err}")
-#Make search requests
-loop = asyncio.get_event_loop()
-loop.run_until_complete(manager.performTasks(searchTasks))
-#Log search success
-utils.logger.info("Search completed. Saving to cache...")
-#Cache results and 429s to later retry
-colsToSave, err = sheetReader.getColsToKeep()
-if err is not None:
-    utils.logger.error(f"Error getting columns to save: {err}")
-    exit()
-
-manager.cacheSearch(colsToSave, runMetaData = searchMeta)
-e = manager.cacheRetries("search")
-if e is not None:
-    utils.logger.warning(f"Erros with caching retries: {e}")
-
-# Check what cache results needs to be appended to the sheet
-sheetLeadIds = leadFrame["company_number"].astype(str)
-cachedAppend = manager.getCachedToAppend(
-    existingIds = sheetLeadIds,
-    runMetaData = searchMeta
-)
-
-# Clean data before further processing
-sheetCompanyNumbers = sheetLeadIds
-searchResults, e = manager.tidySearchResults(cacheDf = cachedAppend, sheetCompanyNumbers = sheetCompanyNumbers)
-if e is not None:
-    utils.logger.error(f"Error processing search results: {e}")
-    exit()
-
-# CALL API for officers
-# Generate request tasks, url task list is needed to avoid duplication
-officerTasks, officerTaskUrls = [], []
-for companyNumber in searchResults["company_number"]:
-    officerUrl = f"{REST_URL}/company/{companyNumber}/officers"
-    officerTasks.append(
-        manager.makeRequest(
-            url = officerUrl,
-            requestType = "officers",
-            auth = BasicAuth(REST_KEY, ""),
-            storage = manager.officerStorage,
-            toRetry = manager.toRetryList,
-            companyNumber = companyNumber,
-            metaData = searchMeta
-        )
+    # Create logger dir
+    err = utils.softDirCreate(LOG_FOLDER)
+    #Configure logger
+    # First we get a queue for logging and its handlers
+    logQueue = Queue()
+    queueHanlder = handlers.QueueHandler(logQueue)
+    # Configure our logging handlers
+    dbLogHandler = dbHandler(
+        db = LOG_DB,
+        table = LOG_DB_TABLE_NAME,
+        runId = runId,
+        batchSize = LOG_DB_BATCH_SIZE,
+        flushInterval = LOG_DB_FLUSH_INTERVAL
+    )
+    discordLogHander = discordHandler(
+        webhook = DISCORD_CONFIG["webhook"],
+        poc1 = DISCORD_CONFIG["poc_1"],
+        poc2 = DISCORD_CONFIG["poc_2"],
+        runId = runId,
+        flushInterval = DISCORD_CONFIG["flush_interval"],
+        maxQueue = DISCORD_CONFIG["max_queue"]
+    )
+    # Configure queue listener, we put our DB hanlder there
+    qListener = handlers.QueueListener(
+        logQueue,
+        dbLogHandler
+    )
+    # Start our logging queue
+    qListener.start()
+    #TO-DO: make a logging queue, move to a sep file
+    logging.basicConfig(
+        level = logging.INFO,
+        format = LOG_FORMAT,
+        handlers = [
+            queueHanlder,
+            discordLogHander,
+            logging.StreamHandler() #this should write to console?
+        ]
+    )
+    # Set logger timezone
+    logging.Formatter.converter = lambda *args: dt.now(tz=timezone(TIMEZONE)).timetuple()
+
+    # Perform logger assignment
+    utils.assignLogger(logging.getLogger("mainLogger"))
+    utils.logger.info("Instantiated logger and assigned it to utils instance")
+    return dbLogHandler, discordLogHander, qListener
+
+
+def createManager(utils: utilMaster) -> "LeadManager":
+    """
+    Inits lead manager with API, cache and retry settings from config
+    """
+    from toolBox.leadManager import LeadManager
+    from toolBox import (
+        REST_KEYS,
+        RATE,
+        LIMIT,
+        LIMITER_MODE,
+        CONNECTION_CONFIG,
+        SCHEDULER_CONFIG,
+        CACHE,
+        RETRY_QUEUE_CONFIG,
+        HTTP_CACHE_CONFIG,
+        REQUEST_TYPES
+    )
+    manager = LeadManager(
+        rate = RATE,
+        limit = LIMIT,
+        logger = utils.logger,
+        sleepTimeBuffer = 2,
+        cache = CACHE["db"],
+        cacheTable = CACHE["companies_table"],
+        retryTable = CACHE["retries_table"],
+        allowedRequestTypes = REQUEST_TYPES,
+        connectionConfig = CONNECTION_CONFIG,
+        limiterMode = LIMITER_MODE,
+        schedulerConfig = SCHEDULER_CONFIG,
+        httpCacheConfig = HTTP_CACHE_CONFIG,
+        retryConfig = RETRY_QUEUE_CONFIG,
+        apiKeys = REST_KEYS
+    )
+    utils.logger.info(f"Lead Manager Instantiated with {len(REST_KEYS)} API keys")
+    return manager
+
+
+def createLeadStore(utils: utilMaster) -> "LeadStore":
+    """
+    Inits lead store backend chosen in config, local store needs no Google credentials
+    """
+    from toolBox import (
+        LEAD_STORE_CONFIG,
+        BENCHMARK_SHEETNAMES,
+        GSHEET_CONTROL_PANEL_NAME,
+        GSHEET_LEAD_TABLE_NAME,
+        GSHEET_APPEND_CONFIG
     )
-    officerTaskUrls.append(officerUrl)
-# Add officer retries
-err = manager.processRetryCache(
-    retryType = "search",
-    taskList = searchTasks,
-    auth = BasicAuth(REST_KEY, ""),
-    dbClean = True,
-    taskUrlLog = officerTaskUrls,
-    metaData = searchMeta
-)
-if err is not None:
-    # We warn that retries were not processed, but we do not stop the execution!
-    utils.logger.warning(f"Error processing officer retries: {err}")
-#TO-DO: maybe process officer tasks as a separate function?
-if IS_WINDOWS:
-    # https://stackoverflow.com/questions/47675410/python-asyncio-aiohttp-valueerror-too-many-file-descriptors-in-select-on-win
-    # The above is why we split to chunks!
-    officerTaskChunks = utils.splitToChunks(officerTasks, 60) if len(officerTasks) > 60 else [officerTasks]
-utils.logger.info("Prepared tasks for officer requests")
-
-for chunk in officerTaskChunks:
-    loop.run_until_complete(manager.performTasks(chunk))
-
-utils.logger.info("Officer data collected")
-officersCleaned = manager.tidyOfficerResults()
-mergedData = pd.merge(searchResults, officersCleaned, on = "company_number", how = "left")
-# Align column order
-mergedData = mergedData[LEAD_SHEET_SCHEMA.values()]
-utils.logger.info("Sheet update prepared")
-sheetReader.appendToSheet(sheetLeads = sheetLeadIds, df = mergedData)
-# Clean cache to avoid exta work during further runs
-e = manager.cleanCacheTable()
-if e is not None:
-    utils.logger.warning(f"Error cleaning cache table: {e}")
-# Calculate runtime
-runtimeStats = utils.getRunTimeStats(searchMeta)
-runtimeStats["new_leads"] = len(mergedData)
-print(runtimeStats) # this should be logged to m3 or some other observability tool!
-# Cleanup of queue listener and event loop
-loop.close()
-sleep(3)
-qListener.stop()
-#summary stats of the run: runtime, calls to different services, new leads
+    if LEAD_STORE_CONFIG["backend"] == "sqlite":
+        from toolBox.sqliteLeadStore import SqliteLeadStore
+        sheetReader = SqliteLeadStore(
+            logger = utils.logger,
+            controlPanelSheetName = GSHEET_CONTROL_PANEL_NAME,
+            leadsSheetName = GSHEET_LEAD_TABLE_NAME,
+            db = LEAD_STORE_CONFIG["sqlite"]["db"],
+            controlPanelCsv = LEAD_STORE_CONFIG["sqlite"].get("control_panel_csv"),
+            chunkRows = LEAD_STORE_CONFIG["sqlite"]["chunk_rows"]
+        )
+    else:
+        from toolBox.sheetManager import sheetManager
+        sheetReader = sheetManager(
+            logger = utils.logger,
+            benchmarkSheets = BENCHMARK_SHEETNAMES,
+            controlPanelSheetName = GSHEET_CONTROL_PANEL_NAME,
+            leadsSheetName = GSHEET_LEAD_TABLE_NAME,
+            sheetSecretVarName = "GSHEET_SECRET",
+            appendConfig = GSHEET_APPEND_CONFIG
+        )
+    utils.logger.info(f"Lead store ({LEAD_STORE_CONFIG['backend']}) instantiated")
+    return sheetReader
+
+
+def runCycle(
+    utils: utilMaster,
+    manager: "LeadManager",
+    sheetReader: "LeadStore",
+    leadIndex: SheetIndex,
+    loop: asyncio.AbstractEventLoop,
+    searchMeta: dict) -> Union[dict, None]:
+    """
+    Searches for new leads, fetches their officers and appends them to the lead store.
+    Returns summary stats of the run, None if it stopped early (errors are logged)
+    """
+    import pandas as pd
+    from toolBox import GSHEET_ID, LEAD_SHEET_SCHEMA, OFFICERS_PAGE_SIZE, REST_URL, SEARCH_PAGE_SIZE, SEARCH_URL
+    manager.resetRunState()
+    with span("read_inputs"):
+        searchParams, e = sheetReader.prepareSeachInputs(
+            sheetId = GSHEET_ID,
+            workSheetsToRead = [sheetReader.controlPanelSheetName]
+        )
+        if e is not None:
+            utils.logger.error(f"Got and error when preparing search inputs: {e}")
+            return None
+
+    utils.logger.info("Search inputs prepared")
+    # Leads tab is not downloaded, local index of its company numbers and dates is synced instead
+    with span("sync_lead_index"):
+        e = sheetReader.syncLeadIndex(leadIndex)
+        if e is not None:
+            utils.logger.error(f"Got an error when syncing lead index: {e}")
+            return None
+        if (watermark := leadIndex.watermark()) is not None:
+            #Override days back parameter for performing search if lead table has entries
+            searchParams["days_back"] = utils.getDaysDelta(lastLeadDate = watermark)
+    #filter dates for leads, then use getDaysDelta() to compute days_back
+    searchWindow = utils.createSearchWindow(searchParams["days_back"])
+    if searchWindow is None:
+        return None
+    searchFrom, searchTo = searchWindow
+    utils.logger.info(f"Searching companies incorporated between {searchFrom} and {searchTo}")
+    #Search pages are normalised to columns we keep as soon as they arrive
+    with span("load_cached"):
+        colsToSave, err = sheetReader.getColsToKeep()
+        if err is not None:
+            utils.logger.error(f"Error getting columns to save: {err}")
+            return None
+        manager.prepareSearchStorage(colsToSave)
+        # Leads held over from previous runs (e.g. incomplete officer data) that are not on the sheet yet
+        sheetLeadIds = pd.Series(leadIndex.companyNumbers(), dtype = object)
+        cachedAppend = manager.getCachedToAppend(
+            existingIds = sheetLeadIds,
+            runMetaData = searchMeta
+        )
+        #Claim requests that are due for retry, they are replayed along with the search.
+        #Officer retries are settled by fetching their companies again, held back companies come back from cache
+        searchRetries = manager.claimRetries("search")
+        officerRetries = manager.claimRetries("officers")
+    # Search and officer requests share one scheduler: officers of a new company are requested as soon as
+    # the search page listing it arrives, so the rate budget is not left idle between the two
+    with span("collect_leads"):
+        loop.run_until_complete(
+            manager.streamLeads(
+                searchUrl = SEARCH_URL,
+                baseUrl = REST_URL,
+                # Requests take keys from the pool of the manager
+                auth = None,
+                baseParams = searchParams["params"],
+                dateFrom = searchFrom,
+                dateTo = searchTo,
+                metaData = searchMeta,
+                excludeIds = sheetLeadIds,
+                cachedCompanyNumbers = cachedAppend["company_number"] if "company_number" in cachedAppend else [],
+                searchPageSize = SEARCH_PAGE_SIZE,
+                officersPageSize = OFFICERS_PAGE_SIZE,
+                searchRetries = searchRetries,
+                officerRetries = officerRetries
+            )
+        )
+    utils.logger.info("Search and officer data collected. Saving to cache...")
+    #Cache results and failed requests to later retry
+    with span("cache_results"):
+        manager.cacheSearch(runMetaData = searchMeta)
+        # Leads with incomplete officer data stay in cache until their requests succeed
+        incompleteCompanies = manager.getIncompleteCompanies()
+        e = manager.cacheRetries("search and officer")
+        if e is not None:
+            utils.logger.warning(f"Erros with caching retries: {e}")
+
+    # Clean data before further processing
+    with span("tidy_and_merge"):
+        searchResults, e = manager.tidySearchResults(cacheDf = cachedAppend, sheetCompanyNumbers = sheetLeadIds)
+        if e is not None:
+            utils.logger.error(f"Error processing search results: {e}")
+            return None
+        officersCleaned = manager.tidyOfficerResults()
+        mergedData = pd.merge(searchResults, officersCleaned, on = "company_number", how = "left")
+        if incompleteCompanies:
+            utils.logger.warning(f"Holding back {len(incompleteCompanies)} leads with incomplete officer data")
+            mergedData = mergedData[~mergedData["company_number"].isin(incompleteCompanies)]
+        # Align column order
+        mergedData = mergedData[LEAD_SHEET_SCHEMA.values()]
+    utils.logger.info("Sheet update prepared")
+    with span("append_leads"):
+        appended, e = sheetReader.appendToSheet(sheetLeads = sheetLeadIds, df = mergedData, leadIndex = leadIndex)
+    # Leads that did not make it to the sheet stay in cache and get appended on the next run
+    notAppended = set(mergedData["company_number"]) - set(appended)
+    if e is not None:
+        utils.logger.error(f"Append stopped after {len(appended)} leads, {len(notAppended)} stay in cache: {e}")
+    # Clean cache to avoid exta work during further runs
+    with span("clean_cache"):
+        e = manager.cleanCacheTable(keepCompanyNumbers = incompleteCompanies | notAppended)
+        if e is not None:
+            utils.logger.warning(f"Error cleaning cache table: {e}")
+    # Calculate runtime
+    runtimeStats = utils.getRunTimeStats(searchMeta)
+    runtimeStats["new_leads"] = len(appended)
+    utils.logger.info(f"Run summary: {runtimeStats}")
+    return runtimeStats
+
+
+def exportMetrics(utils: utilMaster, metrics) -> None:
+    """
+    Writes request metrics for scraping / later analysis
+    """
+    from toolBox import METRICS_CONFIG
+    e = metrics.export(promPath = METRICS_CONFIG["prometheus_file"], jsonPath = METRICS_CONFIG["json_file"])
+    if e is not None:
+        utils.logger.warning(f"Error exporting run metrics: {e}")
+
+
+def closeLogging(dbLogHandler: "dbHandler", discordLogHander: "discordHandler", qListener: handlers.QueueListener) -> None:
+    """
+    Stops queue listener, writes records still buffered by the db handler and sends pending alerts
+    """
+    sleep(3)
+    qListener.stop()
+    dbLogHandler.close()
+    discordLogHander.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Searches Companies House for new leads and appends them to the lead store")
+    parser.add_argument("--profile", action = "store_true", help = "profile the run with cProfile (same as TRACKER_PROFILE=1)")
+    args = parser.parse_args()
+    from toolBox import CACHE, PROFILE_FOLDER, PROFILE_RUN, REQUEST_TYPES
+    # Instantiate utils
+    utils = utilMaster()
+    # Generate search run metadata
+    searchMeta = utils.generateRunMetaData(REQUEST_TYPES)
+    logHandlers = setupLogging(utils, searchMeta["run_id"])
+    utils.logger.info(f"Run ID {searchMeta['run_id']} starts...")
+    # Phases below are timed as spans, profiling is opt-in and writes its artifacts next to the log db
+    profiler = RunProfiler(folder = PROFILE_FOLDER, runId = searchMeta["run_id"], enabled = args.profile or PROFILE_RUN)
+    if profiler.enabled:
+        utils.softDirCreate(PROFILE_FOLDER)
+        utils.logger.info(f"Profiling run, artifacts go to {PROFILE_FOLDER}")
+    profiler.start()
+    # Prepare to run async steps
+    if IS_WINDOWS:
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy()) #windows-specific thing!
+        utils.logger.info("Event policy set, this is a windows-specific step!")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    manager = createManager(utils)
+    sheetReader = createLeadStore(utils)
+    leadIndex = SheetIndex(db = CACHE["db"], table = CACHE["sheet_index_table"], logger = utils.logger)
+    try:
+        if runCycle(utils, manager, sheetReader, leadIndex, loop, searchMeta) is not None:
+            exportMetrics(utils, searchMeta["metrics"])
+    finally:
+        # Cleanup of lead store, pooled connections, response cache, event loop and log pipeline
+        leadIndex.close()
+        sheetReader.close()
+        loop.run_until_complete(manager.close())
+        loop.close()
+        utils.logger.info(f"Run spans:\n{tracer.formatSummary()}")
+        artifacts = profiler.stop(tracer)
+        if isinstance(artifacts, Exception):
+            utils.logger.warning(f"Error writing profile artifacts: {artifacts}")
+        elif artifacts:
+            utils.logger.info(f"Profile artifacts written: {artifacts}")
+        closeLogging(*logHandlers)
 
 
+if __name__ == "__main__":
+    main()